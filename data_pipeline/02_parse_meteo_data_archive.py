@@ -1,133 +1,54 @@
+import dataclasses
 import os
 import xml.etree.ElementTree as ET
-from json import JSONDecodeError
-from typing import Iterable
-from multiprocessing import Pool
-
-from data_pipeline import db
-from data_pipeline.jsonl_util import read_jsonl
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Optional
+
+from data_pipeline import checkpoints, db
+from data_pipeline.archive_util import get_input_files_list
+from data_pipeline.checkpoints import FileCheckpoint
+from data_pipeline.datapoint_writer import DatapointWriter
+from data_pipeline.metrics import FileMetrics, RunMetrics, profiling, read_jsonl_timed
+from data_pipeline.meteo_xml_util import tree_to_datapoints
 from data_pipeline.models import Datapoint
-from data_pipeline.parsing_util import parse_arso_datetime, float_or_none
+from data_pipeline.parse_cache import ParseCache, get_parse_cache
 from data_pipeline.paths_util import get_data_dir
 
+PROCESS_WORKERS = 24
+
+
+def parse_xml(xml: str, metrics: FileMetrics) -> list[Datapoint]:
+    with metrics.stage("xml_parse"):
+        tree = ET.fromstring(xml)
+    with metrics.stage("conversion"):
+        return list(tree_to_datapoints(tree))
+
+
+def datapoints_in_rows(rows: list, metrics: FileMetrics, cache: Optional[ParseCache] = None) -> Iterable[Datapoint]:
+    for row in rows:
+        if cache is None:
+            datapoints = parse_xml(row['xml'], metrics)
+        else:
+            with metrics.stage("cache"):
+                key = cache.key(row['xml'])
+                cached = cache.get(key)
+            if cached is None:
+                datapoints = parse_xml(row['xml'], metrics)
+                with metrics.stage("cache"):
+                    cache.put(key, [d.model_dump() for d in datapoints])
+            else:
+                metrics.cache_hits += 1
+                with metrics.stage("conversion"):
+                    datapoints = [Datapoint.model_construct(**d) for d in cached]
+        metrics.datapoints += len(datapoints)
+        yield from datapoints
+
 
-def xml_to_datapoints(xml: str) -> Iterable[Datapoint]:
-    tree = ET.fromstring(xml)
-    for met_data in tree.findall("metData"):
-        yield Datapoint(
-            station_arso_code=met_data.find("domain_meteosiId").text.strip("_"),
-            sunrise=parse_arso_datetime(met_data.find("sunrise").text),
-            sunset=parse_arso_datetime(met_data.find("sunset").text),
-            interval_start=parse_arso_datetime(met_data.find("validStart").text),
-            interval_end=parse_arso_datetime(met_data.find("validEnd").text),
-            temperature_dew_point=float_or_none(met_data.find("td").text),
-            temperature_air_avg=float_or_none(met_data.find("tavg").text),
-            temperature_air_max=float_or_none(met_data.find("tx").text),
-            temperature_air_min=float_or_none(met_data.find("tn").text),
-            humidity_relative_avg=float_or_none(met_data.find("rhavg").text),
-            wind_direction_avg=float_or_none(met_data.find("ddavg_val").text),
-            wind_direction_max_gust=float_or_none(met_data.find("ddmax_val").text),
-            wind_speed_avg=float_or_none(met_data.find("ffavg_val").text),
-            wind_speed_max=float_or_none(met_data.find("ffmax_val").text),
-            pressure_mean_sea_level_avg=float_or_none(met_data.find("mslavg").text),
-            pressure_surface_level_avg=float_or_none(met_data.find("pavg").text),
-            precipitation_sum_10min=float_or_none(met_data.find("rr_val").text),
-            precipitation_sum_1h=float_or_none(met_data.find("tp_1h_acc").text),
-            precipitation_sum_24h=float_or_none(met_data.find("tp_24h_acc").text),
-            snow_cover_height=float_or_none(met_data.find("snow").text),
-            sun_radiation_global_avg=float_or_none(met_data.find("gSunRadavg").text),
-            sun_radiation_diffuse_avg=float_or_none(met_data.find("diffSunRadavg").text),
-            visibility=float_or_none(met_data.find("vis_val").text)
-        )
-
-
-def upsert_datapoint(datapoint: Datapoint, cursor):
-    cursor.execute("""
-    INSERT INTO weather_datapoints (
-        station_arso_code,
-        sunrise,
-        sunset,
-        interval_start,
-        interval_end,
-        temperature_dew_point,
-        temperature_air_avg,
-        temperature_air_max,
-        temperature_air_min,
-        humidity_relative_avg,
-        wind_direction_avg,
-        wind_direction_max_gust,
-        wind_speed_avg,
-        wind_speed_max,
-        pressure_mean_sea_level_avg,
-        pressure_surface_level_avg,
-        precipitation_sum_10min,
-        precipitation_sum_1h,
-        precipitation_sum_24h,
-        snow_cover_height,
-        sun_radiation_global_avg,
-        sun_radiation_diffuse_avg,
-        visibility
-    ) VALUES (
-        %(station_arso_code)s,
-        %(sunrise)s,
-        %(sunset)s,
-        %(interval_start)s,
-        %(interval_end)s,
-        %(temperature_dew_point)s,
-        %(temperature_air_avg)s,
-        %(temperature_air_max)s,
-        %(temperature_air_min)s,
-        %(humidity_relative_avg)s,
-        %(wind_direction_avg)s,
-        %(wind_direction_max_gust)s,
-        %(wind_speed_avg)s,
-        %(wind_speed_max)s,
-        %(pressure_mean_sea_level_avg)s,
-        %(pressure_surface_level_avg)s,
-        %(precipitation_sum_10min)s,
-        %(precipitation_sum_1h)s,
-        %(precipitation_sum_24h)s,
-        %(snow_cover_height)s,
-        %(sun_radiation_global_avg)s,
-        %(sun_radiation_diffuse_avg)s,
-        %(visibility)s
-    ) ON CONFLICT (station_arso_code, interval_start, interval_end) DO UPDATE SET
-        sunrise = excluded.sunrise,
-        sunset = excluded.sunset,
-        temperature_dew_point = excluded.temperature_dew_point,
-        temperature_air_avg = excluded.temperature_air_avg,
-        temperature_air_max = excluded.temperature_air_max,
-        temperature_air_min = excluded.temperature_air_min,
-        humidity_relative_avg = excluded.humidity_relative_avg,
-        wind_direction_avg = excluded.wind_direction_avg,
-        wind_direction_max_gust = excluded.wind_direction_max_gust,
-        wind_speed_avg = excluded.wind_speed_avg,
-        wind_speed_max = excluded.wind_speed_max,
-        pressure_mean_sea_level_avg = excluded.pressure_mean_sea_level_avg,
-        pressure_surface_level_avg = excluded.pressure_surface_level_avg,
-        precipitation_sum_10min = excluded.precipitation_sum_10min,
-        precipitation_sum_1h = excluded.precipitation_sum_1h,
-        precipitation_sum_24h = excluded.precipitation_sum_24h,
-        snow_cover_height = excluded.snow_cover_height,
-        sun_radiation_global_avg = excluded.sun_radiation_global_avg,
-        sun_radiation_diffuse_avg = excluded.sun_radiation_diffuse_avg,
-        visibility = excluded.visibility
-    """, datapoint.model_dump())
-
-
-def get_input_files_list(data_dir: str) -> list:
-    meteo_data_archive_paths = [os.path.join(data_dir, filename) for filename in os.listdir(data_dir) if
-                                (filename.endswith(".json") or filename.endswith(".json.gz")) and
-                                filename.startswith("meteo_data_archive_")]
-    meteo_data_archive_paths.sort()
-    return meteo_data_archive_paths
-
-
-def datapoints_in_file(file_path: str) -> Iterable[Datapoint]:
-    data = read_jsonl(file_path)
-    for row in data:
-        for datapoint in xml_to_datapoints(row['xml']):
-            yield datapoint
+def datapoints_in_file(file_path: str, metrics: Optional[FileMetrics] = None,
+                       cache: Optional[ParseCache] = None) -> Iterable[Datapoint]:
+    metrics = metrics or FileMetrics(file_path)
+    return datapoints_in_rows(read_jsonl_timed(file_path, metrics), metrics, cache)
 
 
 def datapoints_in_dir(data_dir: str) -> Iterable[Datapoint]:
@@ -135,45 +56,92 @@ def datapoints_in_dir(data_dir: str) -> Iterable[Datapoint]:
 
     for path in meteo_data_archive_paths:
         print("Reading", path)
-        return datapoints_in_file(path)
+        yield from datapoints_in_file(path)
 
 
-def upsert_datapoints_in_file(file_path: str):
+def upsert_datapoints_in_file(file_path: str, writer: Optional[DatapointWriter] = None,
+                              start_line: int = 0) -> FileMetrics:
+    """Upserts the file's datapoints from start_line on, in batches of checkpoints.BATCH_LINES lines.
+
+    Each batch commits together with the file's checkpoint. A file which fails to load is
+    recorded as failed (see checkpoints.record_failure), batches committed before stay."""
     print("Reading", file_path)
-    with db.connect(autocommit=True) as conn:
+    metrics = FileMetrics(file_path)
+    writer = writer or DatapointWriter()
+    try:
+        rows = read_jsonl_timed(file_path, metrics)
+        cache = get_parse_cache()
+        checkpoint = FileCheckpoint.of(file_path, start_line)
+        # An empty file still gets a checkpoint.
+        while not checkpoint.done:
+            batch = rows[checkpoint.lines_done:checkpoint.lines_done + checkpoints.BATCH_LINES]
+            datapoints = list(datapoints_in_rows(batch, metrics, cache))
+            checkpoint = dataclasses.replace(checkpoint, lines_done=checkpoint.lines_done + len(batch),
+                                             done=checkpoint.lines_done + len(batch) >= len(rows))
+            with metrics.stage("db_write"):
+                writer.write(datapoints, checkpoint)
+    except Exception as e:
+        # Truncated files (EOFError, JSONDecodeError) as well as database errors; the other files go on.
+        print(f"Failed to load {file_path}: {e!r}")
+        metrics.error = repr(e)
         try:
-            for datapoint in datapoints_in_file(file_path):
-                upsert_datapoint(datapoint, conn)
-        except JSONDecodeError as e:
-            print(f"Failed to read {file_path}: {e}")
-        except EOFError as e:
-            print(f"Failed to read {file_path}: {e}")
+            with writer.pool.connection() as conn:
+                checkpoints.record_failure(conn, file_path, repr(e))
+        except Exception as record_error:
+            print(f"Failed to record failure of {file_path}: {record_error!r}")
+        return metrics
     print("Done loading", file_path)
+    return metrics
 
 
-def main_multiprocessing():
-    data_dir = get_data_dir()
-    meteo_data_archive_paths = get_input_files_list(data_dir)
-
-    with Pool(processes=24) as p:
-        p.map(upsert_datapoints_in_file, meteo_data_archive_paths)
+def _upsert_task(task: tuple[str, int]) -> FileMetrics:
+    return upsert_datapoints_in_file(task[0], start_line=task[1])
 
 
-def main():
-    data_dir = get_data_dir()
+def ingest_tasks(resume: bool = False, retry_failed: bool = False) -> list[tuple[str, int]]:
+    """Archive files to load with the line to start at, see checkpoints.plan."""
+    paths = get_input_files_list(get_data_dir())
+    if not resume and not retry_failed:
+        return [(path, 0) for path in paths]
     with db.connect() as conn:
-        with conn.cursor() as cur:
-            datapoint_counter = 0
+        saved = checkpoints.load_checkpoints(conn)
+    tasks = checkpoints.plan(paths, {path: os.path.getsize(path) for path in paths}, saved, resume, retry_failed)
+    print(f"{len(tasks)} of {len(paths)} files to load")
+    return tasks
 
-            for datapoint in datapoints_in_dir(data_dir):
-                upsert_datapoint(datapoint, cur)
 
-                datapoint_counter += 1
+def _executor(executor: str) -> Executor:
+    """Processes parse in parallel. Threads share one parse cache and connection pool, but
+    parse in parallel only on free-threaded Python."""
+    if executor == "threads":
+        # Threads share the process's connection pool, more of them would only wait for connections.
+        return ThreadPoolExecutor(max_workers=db.pool_size())
+    return ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
 
-                if datapoint_counter % 1000 == 0:
-                    print(f"Inserted {datapoint_counter} datapoints")
 
-            print(f"Inserted {datapoint_counter} datapoints")
+def main_multiprocessing(resume: bool = False, retry_failed: bool = False, executor: str = "processes"):
+    """Loads files in parallel, executor is "processes" or "threads"."""
+    tasks = ingest_tasks(resume, retry_failed)
+
+    run = RunMetrics("parse_meteo_data_archive")
+    with profiling(run), _executor(executor) as executor:
+        futures = [executor.submit(_upsert_task, task) for task in tasks]
+        try:
+            for future in as_completed(futures):
+                run.add(future.result())
+        except BrokenProcessPool as e:
+            # A worker died (killed, out of memory); committed batches of all files stay.
+            print(f"Stopped loading: {e}. Continue with: slo-weather ingest --resume")
+    run.write_summary()
+
+
+def main(resume: bool = False, retry_failed: bool = False):
+    run = RunMetrics("parse_meteo_data_archive")
+    writer = DatapointWriter()
+    with profiling(run):
+        for path, start_line in ingest_tasks(resume, retry_failed):
+            run.add(upsert_datapoints_in_file(path, writer, start_line))
+    run.write_summary()
 
 
 if __name__ == "__main__":
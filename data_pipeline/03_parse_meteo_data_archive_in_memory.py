@@ -1,20 +1,26 @@
-import os
 from io import StringIO, BytesIO
 
 # import xml.etree.ElementTree as ET
 from lxml import etree as ET
 from json import JSONDecodeError
-from typing import Iterable, Any
+from typing import Iterable, Any, Optional
 from multiprocessing import Pool, Manager
+from concurrent.futures import ThreadPoolExecutor
 import sys
+import threading
 from xml.sax.handler import ContentHandler
 from xml.sax import parseString
 
-from data_pipeline.jsonl_util import read_jsonl
+from data_pipeline.archive_util import get_input_files_list
+from data_pipeline.metrics import FileMetrics, RunMetrics, profiling, read_jsonl_timed, timed_iter
 from data_pipeline.models import Datapoint
+from data_pipeline.parse_cache import ParseCache, get_parse_cache
 from data_pipeline.parsing_util import parse_arso_datetime, float_or_none
 from data_pipeline.paths_util import get_data_dir
 
+# Version of xml_to_datapoints_with_clearing for the parse cache, bump when it changes.
+PARSER_VERSION = "xml_to_datapoints_with_clearing/1"
+
 
 class MetDataXmlHandler(ContentHandler):
     def __init__(self):
@@ -118,70 +124,90 @@ def xml_to_datapoints(xml: str) -> Iterable[dict]:
         ).model_dump()
 
 
-def xml_to_datapoints_with_clearing(xml: str) -> Iterable[dict]:
-    context = iter(ET.iterparse(BytesIO(xml.encode('utf-8')), events=('start', 'end')))
+def xml_to_datapoints_with_clearing(xml: str, metrics: Optional[FileMetrics] = None) -> Iterable[dict]:
+    metrics = metrics or FileMetrics("")
+    context = timed_iter(ET.iterparse(BytesIO(xml.encode('utf-8')), events=('start', 'end')), metrics, "xml_parse")
     _, root = next(context)  # get root element
 
     for action, met_data in context:
         if action == "end" and met_data.tag == "metData":
-            yield Datapoint(
-                station_arso_code=met_data.find("domain_meteosiId").text.strip("_"),
-                sunrise=parse_arso_datetime(met_data.find("sunrise").text),
-                sunset=parse_arso_datetime(met_data.find("sunset").text),
-                interval_start=parse_arso_datetime(met_data.find("validStart").text),
-                interval_end=parse_arso_datetime(met_data.find("validEnd").text),
-                temperature_dew_point=float_or_none(met_data.find("td").text),
-                temperature_air_avg=float_or_none(met_data.find("tavg").text),
-                temperature_air_max=float_or_none(met_data.find("tx").text),
-                temperature_air_min=float_or_none(met_data.find("tn").text),
-                humidity_relative_avg=float_or_none(met_data.find("rhavg").text),
-                wind_direction_avg=float_or_none(met_data.find("ddavg_val").text),
-                wind_direction_max_gust=float_or_none(met_data.find("ddmax_val").text),
-                wind_speed_avg=float_or_none(met_data.find("ffavg_val").text),
-                wind_speed_max=float_or_none(met_data.find("ffmax_val").text),
-                pressure_mean_sea_level_avg=float_or_none(met_data.find("mslavg").text),
-                pressure_surface_level_avg=float_or_none(met_data.find("pavg").text),
-                precipitation_sum_10min=float_or_none(met_data.find("rr_val").text),
-                precipitation_sum_1h=float_or_none(met_data.find("tp_1h_acc").text),
-                precipitation_sum_24h=float_or_none(met_data.find("tp_24h_acc").text),
-                snow_cover_height=float_or_none(met_data.find("snow").text),
-                sun_radiation_global_avg=float_or_none(met_data.find("gSunRadavg").text),
-                sun_radiation_diffuse_avg=float_or_none(met_data.find("diffSunRadavg").text),
-                visibility=float_or_none(met_data.find("vis_val").text)
-            ).model_dump()
+            with metrics.stage("conversion"):
+                datapoint = Datapoint(
+                    station_arso_code=met_data.find("domain_meteosiId").text.strip("_"),
+                    sunrise=parse_arso_datetime(met_data.find("sunrise").text),
+                    sunset=parse_arso_datetime(met_data.find("sunset").text),
+                    interval_start=parse_arso_datetime(met_data.find("validStart").text),
+                    interval_end=parse_arso_datetime(met_data.find("validEnd").text),
+                    temperature_dew_point=float_or_none(met_data.find("td").text),
+                    temperature_air_avg=float_or_none(met_data.find("tavg").text),
+                    temperature_air_max=float_or_none(met_data.find("tx").text),
+                    temperature_air_min=float_or_none(met_data.find("tn").text),
+                    humidity_relative_avg=float_or_none(met_data.find("rhavg").text),
+                    wind_direction_avg=float_or_none(met_data.find("ddavg_val").text),
+                    wind_direction_max_gust=float_or_none(met_data.find("ddmax_val").text),
+                    wind_speed_avg=float_or_none(met_data.find("ffavg_val").text),
+                    wind_speed_max=float_or_none(met_data.find("ffmax_val").text),
+                    pressure_mean_sea_level_avg=float_or_none(met_data.find("mslavg").text),
+                    pressure_surface_level_avg=float_or_none(met_data.find("pavg").text),
+                    precipitation_sum_10min=float_or_none(met_data.find("rr_val").text),
+                    precipitation_sum_1h=float_or_none(met_data.find("tp_1h_acc").text),
+                    precipitation_sum_24h=float_or_none(met_data.find("tp_24h_acc").text),
+                    snow_cover_height=float_or_none(met_data.find("snow").text),
+                    sun_radiation_global_avg=float_or_none(met_data.find("gSunRadavg").text),
+                    sun_radiation_diffuse_avg=float_or_none(met_data.find("diffSunRadavg").text),
+                    visibility=float_or_none(met_data.find("vis_val").text)
+                ).model_dump()
+            yield datapoint
             met_data.clear()
             root.clear()
 
 
+def row_datapoints(xml: str, metrics: FileMetrics, cache: Optional[ParseCache]) -> list[dict]:
+    if cache is None:
+        return list(xml_to_datapoints_with_clearing(xml, metrics))
+
+    with metrics.stage("cache"):
+        key = cache.key(xml, PARSER_VERSION)
+        datapoints = cache.get(key)
+    if datapoints is None:
+        datapoints = list(xml_to_datapoints_with_clearing(xml, metrics))
+        with metrics.stage("cache"):
+            cache.put(key, datapoints)
+    else:
+        metrics.cache_hits += 1
+    return datapoints
+
+
 def upsert_datapoint(datapoint: dict, map):
     key = str((datapoint['station_arso_code'], datapoint['interval_start'], datapoint['interval_end']))
     map[key] = datapoint
 
 
-def get_input_files_list(data_dir: str) -> list:
-    meteo_data_archive_paths = [os.path.join(data_dir, filename) for filename in os.listdir(data_dir) if
-                                (filename.endswith(".json") or filename.endswith(".json.gz")) and
-                                filename.startswith("meteo_data_archive_")]
-    meteo_data_archive_paths.sort()
-    return meteo_data_archive_paths
-
-
-def datapoints_in_file(file_path: str) -> Iterable[dict[str, Any]]:
+def datapoints_in_file(file_path: str, metrics: Optional[FileMetrics] = None) -> Iterable[dict[str, Any]]:
     # print("Reading", file_path)
+    metrics = metrics or FileMetrics(file_path)
     try:
-        data = read_jsonl(file_path)
-        dps = [datapoint for row in data for datapoint in xml_to_datapoints_with_clearing(row['xml'])]
+        data = read_jsonl_timed(file_path, metrics)
+        dps = [datapoint for row in data for datapoint in row_datapoints(row['xml'], metrics, get_parse_cache())]
+        metrics.datapoints = len(dps)
         # print("Loaded datapoints: ", len(dps))
         # print("Size: ", sys.getsizeof(dps))
         return dps
     except JSONDecodeError as e:
         print(f"Failed to read {file_path}: {e}")
+        metrics.error = str(e)
     except EOFError as e:
         print(f"Failed to read {file_path}: {e}")
+        metrics.error = str(e)
 
     return []
 
 
+def datapoints_in_file_with_metrics(file_path: str) -> tuple[list[dict[str, Any]], FileMetrics]:
+    metrics = FileMetrics(file_path)
+    return datapoints_in_file(file_path, metrics), metrics
+
+
 def upsert_datapoints_in_file(file_path: str, map):
     print("Reading", file_path)
     try:
@@ -194,19 +220,61 @@ def upsert_datapoints_in_file(file_path: str, map):
     print("Done loading", file_path)
 
 
+def load_in_processes(file_paths: list, run: RunMetrics, processes: int = 12) -> dict:
+    """Parses files in worker processes. Datapoints are pickled back and deduplicated here."""
+    d = dict()
+    with Pool(processes=processes, maxtasksperchild=1) as p:
+        for dpl, metrics in p.imap(datapoints_in_file_with_metrics, file_paths):
+            with metrics.stage("dedup"):
+                for dp in dpl:
+                    upsert_datapoint(dp, d)
+            run.add(metrics)
+    return d
+
+
+def load_in_threads(file_paths: list, run: RunMetrics, threads: Optional[int] = None) -> dict:
+    """Parses files in worker threads, which deduplicate straight into one shared dict.
+
+    Nothing is pickled or copied between processes. lxml parsing and zlib decompression
+    release the GIL, and the shared dict is only touched under a lock, so this also runs
+    correctly on free-threaded Python."""
+    d = dict()
+    lock = threading.Lock()
+
+    def load(file_path: str) -> FileMetrics:
+        metrics = FileMetrics(file_path)
+        dps = datapoints_in_file(file_path, metrics)
+        with lock, metrics.stage("dedup"):
+            for dp in dps:
+                upsert_datapoint(dp, d)
+        return metrics
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for metrics in executor.map(load, file_paths):
+            run.add(metrics)
+    return d
+
+
 #
 def main():
     data_dir = get_data_dir()
     meteo_data_archive_paths = get_input_files_list(data_dir)
 
     d = dict()
-    for fn in meteo_data_archive_paths:
-        dps = datapoints_in_file(fn)
-        for dp in dps:
-            upsert_datapoint(dp, d)
-        print("Count: ", len(d))
-        if len(d) > 50000:
-            break
+    run = RunMetrics("parse_meteo_data_archive_in_memory")
+    with profiling(run):
+        for fn in meteo_data_archive_paths:
+            metrics = FileMetrics(fn)
+            dps = datapoints_in_file(fn, metrics)
+            with metrics.stage("dedup"):
+                for dp in dps:
+                    upsert_datapoint(dp, d)
+            run.add(metrics)
+            print("Count: ", len(d))
+            # The whole archive doesn't fit into the dict, see main_external.
+            if len(d) > 50000:
+                break
+    run.write_summary()
 
 
 def main_multiprocessing():
@@ -215,13 +283,40 @@ def main_multiprocessing():
 
     d = dict()
     counter = 0
-    with Pool(processes=12, maxtasksperchild=1) as p:
-        dps = p.imap(datapoints_in_file, meteo_data_archive_paths)
-        for dpl in dps:
+    run = RunMetrics("parse_meteo_data_archive_in_memory")
+    with profiling(run), Pool(processes=12, maxtasksperchild=1) as p:
+        dps = p.imap(datapoints_in_file_with_metrics, meteo_data_archive_paths)
+        for dpl, metrics in dps:
             for dp in dpl:
                 counter += 1
                 # upsert_datapoint(dp, d)
+            run.add(metrics)
             print("Count: ", counter)
+    run.write_summary()
+
+
+def main_threads():
+    data_dir = get_data_dir()
+    meteo_data_archive_paths = get_input_files_list(data_dir)
+
+    run = RunMetrics("parse_meteo_data_archive_in_memory")
+    with profiling(run):
+        d = load_in_threads(meteo_data_archive_paths, run)
+    print("Count: ", len(d))
+    run.write_summary()
+
+
+def main_external():
+    """Deduplicates the whole archive on disk instead of in a dict, see external_dedup.py."""
+    from data_pipeline.external_dedup import archive_datapoints, deduplicated
+
+    data_dir = get_data_dir()
+    meteo_data_archive_paths = get_input_files_list(data_dir)
+
+    count = 0
+    for _ in deduplicated(archive_datapoints(meteo_data_archive_paths, get_parse_cache()), data_dir):
+        count += 1
+    print("Count: ", count)
 
 
 def main_multiprocessing_and_manager():
@@ -239,4 +334,9 @@ def main_multiprocessing_and_manager():
 
 if __name__ == "__main__":
     # main()
-    main_multiprocessing()
+    if len(sys.argv) > 1 and sys.argv[1] == "threads":
+        main_threads()
+    elif len(sys.argv) > 1 and sys.argv[1] == "external":
+        main_external()
+    else:
+        main_multiprocessing()
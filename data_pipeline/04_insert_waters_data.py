@@ -0,0 +1,76 @@
+import os
+from json import JSONDecodeError
+
+from data_pipeline import db
+from data_pipeline.jsonl_util import read_jsonl
+from data_pipeline.paths_util import get_data_dir
+from data_pipeline.waters_util import WATERS_COLUMNS, row_to_waters_datapoint
+
+
+def get_input_files_list(data_dir: str) -> list:
+    waters_data_paths = [os.path.join(data_dir, filename) for filename in os.listdir(data_dir) if
+                         (filename.endswith(".json") or filename.endswith(".json.gz")) and
+                         filename.startswith("waters_")]
+    # File names end with the batch time, so sort by it to let newer scrapes win.
+    waters_data_paths.sort(key=lambda path: os.path.basename(path).rsplit("_", 1)[-1])
+    return waters_data_paths
+
+
+def stage_waters_datapoints(paths: list, cur) -> int:
+    """COPYs datapoints of the files into waters_datapoints_staging, one file at a time.
+
+    Rows are numbered in the order of files and rows within them, so that deduplication
+    can keep the newest version. Returns the number of staged rows."""
+    columns = ", ".join(WATERS_COLUMNS)
+    sequence = 0
+    for path in paths:
+        print("Reading", path)
+        try:
+            rows = read_jsonl(path)
+        except (JSONDecodeError, EOFError) as e:
+            print(f"Failed to read {path}: {e}")
+            continue
+        with cur.copy(f"COPY waters_datapoints_staging ({columns}, sequence) FROM STDIN") as copy:
+            for row in rows:
+                datapoint = row_to_waters_datapoint(row)
+                if datapoint is not None:
+                    copy.write_row([getattr(datapoint, c) for c in WATERS_COLUMNS] + [sequence])
+                    sequence += 1
+    return sequence
+
+
+def upsert_waters_datapoints(paths: list, conn):
+    """Bulk upsert of the files' datapoints through a COPY-filled staging table.
+
+    The 30-day spider overlaps with previous runs for up to 30 days, so most rows are
+    duplicates. Only the newest version of each (location, timestamp) is upserted, and rows
+    which didn't change are not rewritten, so reloading overlapping files is cheap."""
+    columns = ", ".join(WATERS_COLUMNS)
+    value_columns = [c for c in WATERS_COLUMNS if c not in ("location", "timestamp")]
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TEMPORARY TABLE waters_datapoints_staging ON COMMIT DROP AS "
+            f"SELECT {columns}, 0::bigint AS sequence FROM waters_datapoints WITH NO DATA"
+        )
+        print(f"Staged {stage_waters_datapoints(paths, cur)} datapoints")
+
+        cur.execute(f"""
+        INSERT INTO waters_datapoints ({columns})
+        SELECT DISTINCT ON (location, timestamp) {columns} FROM waters_datapoints_staging
+        ORDER BY location, timestamp, sequence DESC
+        ON CONFLICT (location, timestamp) DO UPDATE SET
+            {", ".join(f"{c} = excluded.{c}" for c in value_columns)}
+        WHERE ({", ".join(f"waters_datapoints.{c}" for c in value_columns)})
+            IS DISTINCT FROM ({", ".join(f"excluded.{c}" for c in value_columns)})
+        """)
+        print(f"Upserted {cur.rowcount} changed datapoints")
+
+
+def main():
+    with db.connect() as conn:
+        upsert_waters_datapoints(get_input_files_list(get_data_dir()), conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""Read-only HTTP API over weather_datapoints.
+
+    GET /latest[?station=CODE...]                          latest datapoint of each station
+    GET /stations/CODE/observations?start=ISO[&end=ISO]    datapoints of a station by interval_end
+    GET /observations?time=ISO                             datapoint of each station covering the time
+                                                           (at most MAX_INTERVAL long)
+
+Responses are JSON arrays. Results are cached in memory by query and dropped when a loader
+notifies (see db.notify_datapoints_changed) that it wrote datapoints of the same stations and
+time range. Every response has an ETag, so clients can revalidate with If-None-Match.
+Station ranges longer than STREAM_MIN_SPAN (or without an end) are streamed from a server-side
+cursor instead of being cached.
+
+Usage: slo-weather serve [--host HOST] [--port PORT]
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from data_pipeline import db
+
+DEFAULT_PORT = 8080
+STREAM_MIN_SPAN = datetime.timedelta(days=31)
+STREAM_BATCH_SIZE = 2000
+DEFAULT_MAX_CACHE_ENTRIES = 4096
+LISTEN_RETRY_SECONDS = 5
+# Longest interval of a datapoint, bounds interval_start of /observations?time=ISO so the
+# query can use the interval_start BRIN index and skip partitions. Longer datapoints aren't found.
+MAX_INTERVAL = datetime.timedelta(days=1)
+
+_station_observations_path = re.compile(r"^/stations/([^/]+)/observations$")
+
+_reasons = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def parse_time(s: str) -> datetime.datetime:
+    """ISO datetime, UTC unless given."""
+    try:
+        value = datetime.datetime.fromisoformat(s)
+    except ValueError:
+        raise BadRequest(f"Invalid datetime: {s}")
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        # Timestamps are stored without a time zone, in UTC.
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_rows(rows: list[dict]) -> bytes:
+    return json.dumps(rows, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def _overlaps(start_a: Optional[datetime.datetime], end_a: Optional[datetime.datetime],
+              start_b: Optional[datetime.datetime], end_b: Optional[datetime.datetime]) -> bool:
+    if start_a is not None and end_b is not None and end_b < start_a:
+        return False
+    if start_b is not None and end_a is not None and end_a < start_b:
+        return False
+    return True
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str
+    stations: Optional[frozenset] = None  # None for all stations
+    start: Optional[datetime.datetime] = None  # time range the result depends on, None if unbounded
+    end: Optional[datetime.datetime] = None
+
+
+@dataclass
+class ResponseCache:
+    max_entries: int = DEFAULT_MAX_CACHE_ENTRIES
+    # Only enabled while change notifications are received, otherwise entries could go stale.
+    enabled: bool = False
+    # Incremented on every invalidation. Results of queries which ran across an invalidation aren't cached.
+    generation: int = 0
+    entries: OrderedDict = field(default_factory=OrderedDict)
+
+    def get(self, key) -> Optional[CacheEntry]:
+        if not self.enabled:
+            return None
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry: CacheEntry, generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, stations: Optional[set] = None,
+                   start: Optional[datetime.datetime] = None,
+                   end: Optional[datetime.datetime] = None):
+        """Drops entries which could depend on datapoints of the stations (all if None) in the time range."""
+        self.generation += 1
+        for key, entry in list(self.entries.items()):
+            if stations is not None and entry.stations is not None and not (stations & entry.stations):
+                continue
+            if _overlaps(start, end, entry.start, entry.end):
+                del self.entries[key]
+
+    def invalidate_payload(self, payload: dict):
+        """Invalidates by a db.datapoints_changed_payload."""
+        if "stations" not in payload:
+            self.clear()
+            return
+        self.invalidate(
+            set(payload["stations"]),
+            parse_time(payload["start"]) if payload.get("start") else None,
+            parse_time(payload["end"]) if payload.get("end") else None,
+        )
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+
+
+_STATION_RANGE_QUERY = """
+    SELECT * FROM weather_datapoints
+    WHERE station_arso_code = %(station)s
+      AND interval_end >= %(start)s
+      AND (%(end)s::timestamptz IS NULL OR interval_end <= %(end)s)
+    ORDER BY interval_start, interval_end
+"""
+
+
+class PostgresStorage:
+    def __init__(self, dsn: str = db.dsn):
+        self.dsn = dsn
+        self.pool = None
+
+    async def _connect(self, **kwargs):
+        # Timestamp columns hold UTC times without a time zone.
+        return await psycopg.AsyncConnection.connect(self.dsn, options=db.CONNECT_OPTIONS, **kwargs)
+
+    async def open(self):
+        # Connections are checked before use, so queries after a database restart get a new one.
+        self.pool = AsyncConnectionPool(
+            self.dsn,
+            min_size=1,
+            max_size=db.pool_size(),
+            kwargs={"autocommit": True, "row_factory": dict_row, "options": db.CONNECT_OPTIONS},
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        await self.pool.open()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+    async def _fetch(self, query: str, params) -> list[dict]:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(query, params)
+                return await cur.fetchall()
+
+    async def latest(self, stations: Optional[list[str]]) -> list[dict]:
+        # Maintained by the loader, see datapoint_writer.
+        return await self._fetch("""
+            SELECT * FROM station_latest
+            WHERE %(stations)s::text[] IS NULL OR station_arso_code = ANY(%(stations)s)
+            ORDER BY station_arso_code
+        """, {"stations": stations})
+
+    async def station_range(self, station: str, start: datetime.datetime,
+                            end: Optional[datetime.datetime]) -> list[dict]:
+        return await self._fetch(_STATION_RANGE_QUERY, {"station": station, "start": start, "end": end})
+
+    async def stream_station_range(self, station: str, start: datetime.datetime,
+                                   end: Optional[datetime.datetime]) -> AsyncIterator[list[dict]]:
+        # A server-side cursor needs a transaction.
+        async with self.pool.connection() as conn, conn.transaction():
+            async with conn.cursor(name="station_range") as cur:
+                await cur.execute(_STATION_RANGE_QUERY, {"station": station, "start": start, "end": end})
+                while batch := await cur.fetchmany(STREAM_BATCH_SIZE):
+                    yield batch
+
+    async def at(self, time: datetime.datetime) -> list[dict]:
+        # When intervals of different lengths cover the time, the shortest one is returned.
+        return await self._fetch("""
+            SELECT DISTINCT ON (station_arso_code) * FROM weather_datapoints
+            WHERE interval_start >= %(earliest)s AND interval_start < %(time)s AND interval_end >= %(time)s
+            ORDER BY station_arso_code, interval_end - interval_start
+        """, {"time": time, "earliest": time - MAX_INTERVAL})
+
+    async def listen(self) -> AsyncIterator[dict]:
+        """Starts listening for change notifications. Returns an iterator of their payloads."""
+        conn = await self._connect(autocommit=True)
+        await conn.execute(f"LISTEN {db.DATAPOINTS_CHANGED_CHANNEL}")
+        return self._changes(conn)
+
+    @staticmethod
+    async def _changes(conn) -> AsyncIterator[dict]:
+        async with conn:
+            async for notify in conn.notifies():
+                yield json.loads(notify.payload or "{}")
+
+
+@dataclass
+class Response:
+    status: int
+    body: bytes = b""
+    etag: Optional[str] = None
+    stream: Optional[AsyncIterator[bytes]] = None
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as for GET requests.
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def _error(status: int, message: str) -> Response:
+    return Response(status, json.dumps({"error": message}).encode("utf-8"))
+
+
+class ApiServer:
+    def __init__(self, storage, cache: Optional[ResponseCache] = None):
+        self.storage = storage
+        self.cache = cache if cache is not None else ResponseCache()
+        # Queries of the same key in progress, so concurrent misses (e.g. after ingestion) share one query.
+        self._inflight = {}
+        # Part of ETags of streamed responses, which are derived from the cache generation instead of the body.
+        self._instance = os.urandom(4).hex()
+
+    async def _cached(self, key, query, stations: Optional[frozenset],
+                      start: Optional[datetime.datetime], end: Optional[datetime.datetime]) -> CacheEntry:
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(
+                self._query(key, query, stations, start, end))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _query(self, key, query, stations, start, end) -> CacheEntry:
+        generation = self.cache.generation
+        body = encode_rows(await query())
+        entry = CacheEntry(body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', stations, start, end)
+        self.cache.put(key, entry, generation)
+        return entry
+
+    async def _stream(self, station: str, start: datetime.datetime,
+                      end: Optional[datetime.datetime]) -> AsyncIterator[bytes]:
+        separator = b"["
+        async for batch in self.storage.stream_station_range(station, start, end):
+            body = encode_rows(batch)
+            # Rows of the batch without the enclosing brackets.
+            yield separator + body[1:-1]
+            separator = b","
+        yield b"[]" if separator == b"[" else b"]"
+
+    async def route(self, method: str, target: str, headers: dict[str, str]) -> Response:
+        if method not in ("GET", "HEAD"):
+            return _error(405, f"Method {method} not allowed")
+
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if_none_match = headers.get("if-none-match")
+
+        if url.path == "/latest":
+            stations = sorted(set(query.get("station", []))) or None
+            entry = await self._cached(
+                ("latest", tuple(stations) if stations else None),
+                lambda: self.storage.latest(stations),
+                frozenset(stations) if stations else None, None, None,
+            )
+        elif url.path == "/observations":
+            if "time" not in query:
+                raise BadRequest("Missing time")
+            time = parse_time(query["time"][0])
+            entry = await self._cached(("at", time), lambda: self.storage.at(time), None, time, time)
+        elif match := _station_observations_path.match(url.path):
+            station = unquote(match.group(1))
+            if "start" not in query:
+                raise BadRequest("Missing start")
+            start = parse_time(query["start"][0])
+            end = parse_time(query["end"][0]) if "end" in query else None
+            if end is not None and end < start:
+                raise BadRequest("End is before start")
+
+            if end is None or end - start > STREAM_MIN_SPAN:
+                etag = f'W/"{self._instance}-{self.cache.generation}-{hashlib.blake2b(target.encode("utf-8"), digest_size=8).hexdigest()}"'
+                # Without notifications, there's no telling whether the data changed.
+                if self.cache.enabled and _etag_matches(if_none_match, etag):
+                    return Response(304, etag=etag)
+                return Response(200, etag=etag if self.cache.enabled else None, stream=self._stream(station, start, end))
+
+            entry = await self._cached(
+                ("range", station, start, end),
+                lambda: self.storage.station_range(station, start, end),
+                frozenset([station]), start, end,
+            )
+        else:
+            return _error(404, f"Not found: {url.path}")
+
+        if _etag_matches(if_none_match, entry.etag):
+            return Response(304, etag=entry.etag)
+        return Response(200, entry.body, entry.etag)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._write(writer, _error(400, "Malformed request line"), "HTTP/1.0", "GET")
+                    break
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0)):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                try:
+                    response = await self.route(method, target, headers)
+                except BadRequest as e:
+                    response = _error(400, str(e))
+                except Exception as e:
+                    print(f"Failed to handle {method} {target}: {e!r}")
+                    response = _error(500, "Internal server error")
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                if response.stream is not None and version == "HTTP/1.0":
+                    # Without chunked encoding, the end of a streamed body is marked by closing the connection.
+                    keep_alive = False
+                await self._write(writer, response, version, method, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            print(f"Failed to handle a connection: {e!r}")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, version: str, method: str,
+                     keep_alive: bool = False):
+        chunked = response.stream is not None and version != "HTTP/1.0"
+        lines = [f"HTTP/1.1 {response.status} {_reasons[response.status]}"]
+        if response.status != 304:
+            lines.append("Content-Type: application/json")
+        if response.etag is not None:
+            lines.append(f"ETag: {response.etag}")
+            lines.append("Cache-Control: no-cache")
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        elif response.stream is None:
+            lines.append(f"Content-Length: {len(response.body)}")
+        if not keep_alive:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+        if method == "HEAD":
+            if response.stream is not None:
+                await response.stream.aclose()
+        elif response.stream is not None:
+            async for chunk in response.stream:
+                writer.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n" if chunked else chunk)
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+        else:
+            writer.write(response.body)
+        await writer.drain()
+
+    async def watch_changes(self):
+        """Invalidates the cache on change notifications. The cache is disabled while not listening."""
+        while True:
+            try:
+                changes = await self.storage.listen()
+                self.cache.clear()
+                self.cache.enabled = True
+                async for payload in changes:
+                    self.cache.invalidate_payload(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Not listening for changes: {e!r}")
+            self.cache.enabled = False
+            self.cache.clear()
+            await asyncio.sleep(LISTEN_RETRY_SECONDS)
+
+    async def serve(self, host: str, port: int):
+        await self.storage.open()
+        watcher = asyncio.create_task(self.watch_changes())
+        try:
+            server = await asyncio.start_server(self.handle, host, port)
+            print("Serving on", ", ".join(str(socket.getsockname()) for socket in server.sockets))
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            await self.storage.close()
+
+
+def main(host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+    asyncio.run(ApiServer(PostgresStorage()).serve(host, port))
+
+
+if __name__ == "__main__":
+    main()
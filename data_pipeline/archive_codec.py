@@ -0,0 +1,265 @@
+"""Zstandard codec of archive files, with a dictionary trained on ARSO XML.
+
+Archive lines wrap station history XMLs, which repeat the same element names, variable
+descriptions, units and URLs in every metData block. A dictionary trained on samples of
+them lets zstd encode that boilerplate from the first line on.
+
+A .json.zst archive holds one zstd frame per JSONL line, compressed with the dictionary,
+so that a single line can be decompressed on its own (see archive_index.py). Frames name
+their dictionary by id. Dictionaries are kept as data/zstd_dictionaries/<id>.dict, files
+written with an older dictionary stay readable after retraining.
+
+The scraper can write this format directly (see scraper/postprocessing.py), existing
+gzipped daily archives are re-encoded with:
+
+Usage: slo-weather recompress [--train] [--remove-sources]
+"""
+
+import functools
+import hashlib
+import os
+import random
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+import zstandard
+
+from data_pipeline.paths_util import get_data_dir
+
+ZSTD_SUFFIX = ".json.zst"
+DICTIONARY_SIZE = 112 * 1024
+# Higher levels are several times slower for a few percent smaller files.
+DEFAULT_LEVEL = 9
+# Lines sampled from archives for training, each split into metData blocks.
+TRAINING_LINES = 400
+
+_MAX_FRAME_HEADER_SIZE = 18
+
+
+class BadZstdFile(OSError):
+    """Corrupt zstd data, like gzip.BadGzipFile is for gzip."""
+
+
+def dictionary_dir(data_dir: Optional[str] = None) -> str:
+    return os.path.join(data_dir or get_data_dir(), "zstd_dictionaries")
+
+
+@functools.lru_cache(maxsize=None)
+def _load_dictionary(path: str, mtime_ns: int) -> zstandard.ZstdCompressionDict:
+    with open(path, mode="rb") as fp:
+        return zstandard.ZstdCompressionDict(fp.read())
+
+
+def load_dictionaries(directory: str) -> dict[int, zstandard.ZstdCompressionDict]:
+    """Dictionaries in the directory by id."""
+    dictionaries = {}
+    if os.path.isdir(directory):
+        for filename in os.listdir(directory):
+            if filename.endswith(".dict"):
+                path = os.path.join(directory, filename)
+                dictionary = _load_dictionary(path, os.stat(path).st_mtime_ns)
+                dictionaries[dictionary.dict_id()] = dictionary
+    return dictionaries
+
+
+def latest_dictionary(directory: str) -> Optional[zstandard.ZstdCompressionDict]:
+    """The most recently trained dictionary in the directory."""
+    paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".dict")] \
+        if os.path.isdir(directory) else []
+    if not paths:
+        return None
+    path = max(paths, key=os.path.getmtime)
+    return _load_dictionary(path, os.stat(path).st_mtime_ns)
+
+
+def training_samples(lines: Iterable[bytes]) -> list[bytes]:
+    """Lines split before each metData block, samples about the size of what repeats."""
+    samples = []
+    for line in lines:
+        samples.extend(piece for piece in line.split(b"<metData>") if piece)
+    return samples
+
+
+def train_dictionary(lines: Iterable[bytes], size: int = DICTIONARY_SIZE) -> zstandard.ZstdCompressionDict:
+    return zstandard.train_dictionary(size, training_samples(lines))
+
+
+def save_dictionary(dictionary: zstandard.ZstdCompressionDict, directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{dictionary.dict_id()}.dict")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode="wb") as fp:
+        fp.write(dictionary.as_bytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+class FrameWriter:
+    """Writes one zstd frame per line to a binary file."""
+
+    def __init__(self, fp: BinaryIO, dictionary: Optional[zstandard.ZstdCompressionDict],
+                 level: int = DEFAULT_LEVEL):
+        self.fp = fp
+        self.compressor = zstandard.ZstdCompressor(level=level, dict_data=dictionary, write_checksum=True)
+        # Pieces of the line not ended yet, joined once it ends.
+        self._pending = []
+
+    def write(self, data: bytes) -> int:
+        """Takes data in pieces of any size, a frame is written for each complete line."""
+        lines = bytes(data).split(b"\n")
+        for line in lines[:-1]:
+            self._pending.append(line)
+            self._pending.append(b"\n")
+            self.fp.write(self.compressor.compress(b"".join(self._pending)))
+            self._pending = []
+        if lines[-1]:
+            self._pending.append(lines[-1])
+        return len(data)
+
+    def close(self):
+        if self._pending:
+            self.fp.write(self.compressor.compress(b"".join(self._pending)))
+            self._pending = []
+
+
+def _frame_parameters(data, offset: int) -> zstandard.FrameParameters:
+    header = data[offset:offset + _MAX_FRAME_HEADER_SIZE]
+    try:
+        return zstandard.get_frame_parameters(header)
+    except zstandard.ZstdError as e:
+        if len(header) < _MAX_FRAME_HEADER_SIZE:
+            raise EOFError("Compressed file ended within a zstd frame header")
+        raise BadZstdFile(str(e))
+
+
+def frame_length(data, offset: int = 0) -> int:
+    """Compressed length of the frame at offset, from its block headers.
+
+    Raises EOFError when the data ends within the frame, like gzip does for truncated files."""
+    parameters = _frame_parameters(data, offset)
+    position = offset + zstandard.frame_header_size(data[offset:offset + _MAX_FRAME_HEADER_SIZE])
+    while True:
+        if position + 3 > len(data):
+            raise EOFError("Compressed file ended before the end of a zstd frame")
+        block_header = int.from_bytes(data[position:position + 3], "little")
+        block_type = (block_header >> 1) & 3
+        # RLE blocks store the repeated byte only.
+        position += 3 + (1 if block_type == 1 else block_header >> 3)
+        if block_header & 1:
+            break
+    if parameters.has_checksum:
+        position += 4
+    if position > len(data):
+        raise EOFError("Compressed file ended before the end of a zstd frame")
+    return position - offset
+
+
+def iter_frames(data: bytes, directory: Optional[str] = None) -> Iterator[tuple[int, int, bytes]]:
+    """Offset, compressed length and content of each frame.
+
+    Raises EOFError at a truncated frame and BadZstdFile at a corrupt one."""
+    view = memoryview(data)
+    dictionaries = None
+    decompressors = {}
+    offset = 0
+    while offset < len(data):
+        dict_id = _frame_parameters(view, offset).dict_id
+        if dict_id not in decompressors:
+            if dict_id and dictionaries is None:
+                dictionaries = load_dictionaries(directory or dictionary_dir())
+            if dict_id and dict_id not in dictionaries:
+                raise BadZstdFile(f"Missing zstd dictionary {dict_id}")
+            decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionaries[dict_id] if dict_id else None)
+        length = frame_length(view, offset)
+        # Frames written by FrameWriter store their content size, so this is a single allocation.
+        try:
+            content = decompressors[dict_id].decompress(view[offset:offset + length])
+        except zstandard.ZstdError as e:
+            raise BadZstdFile(f"Corrupt zstd frame at offset {offset}: {e}")
+        yield offset, length, content
+        offset += length
+
+
+def decompress(data: bytes, directory: Optional[str] = None) -> bytes:
+    return b"".join(content for _, _, content in iter_frames(data, directory))
+
+
+def decompress_frame(frame: bytes, directory: Optional[str] = None) -> bytes:
+    (_, _, content), = iter_frames(frame, directory)
+    return content
+
+
+def read_bytes(path: str) -> bytes:
+    """Decompressed content of a .json.zst file, with dictionaries from the data dir next to it."""
+    with open(path, mode="rb") as fp:
+        data = fp.read()
+    return decompress(data, dictionary_dir(os.path.dirname(path)))
+
+
+def recompress_file(path: str, dictionary: zstandard.ZstdCompressionDict, level: int = DEFAULT_LEVEL) -> str:
+    """Writes a .json.zst copy of the gzipped archive file and verifies it. Returns its path."""
+    from data_pipeline.jsonl_util import read_bytes as read_jsonl_bytes
+
+    content = read_jsonl_bytes(path)
+    output_path = path[:-len(".json.gz")] + ZSTD_SUFFIX
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode="wb") as fp:
+            writer = FrameWriter(fp, dictionary, level)
+            writer.write(content)
+            writer.close()
+        with open(tmp_path, mode="rb") as fp:
+            written = decompress(fp.read(), dictionary_dir(os.path.dirname(path)))
+        if hashlib.sha256(written).digest() != hashlib.sha256(content).digest():
+            raise ValueError(f"Recompressed {path} doesn't match the original")
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+
+def sample_lines(paths: list[str], count: int = TRAINING_LINES, seed: int = 0) -> list[bytes]:
+    from data_pipeline.jsonl_util import read_bytes as read_jsonl_bytes
+
+    lines = []
+    for path in paths:
+        lines.extend(line for line in read_jsonl_bytes(path).splitlines() if line)
+    return random.Random(seed).sample(lines, min(count, len(lines)))
+
+
+def main(train: bool = False, remove_sources: bool = False, data_dir: Optional[str] = None):
+    from data_pipeline.archive_util import DAILY_ARCHIVE_PREFIXES, file_sort_key
+
+    data_dir = data_dir or get_data_dir()
+    directory = dictionary_dir(data_dir)
+    # Not get_daily_archive_files, it hides sources which already have a .json.zst version.
+    gz_paths = sorted((os.path.join(data_dir, filename) for filename in os.listdir(data_dir)
+                       if filename.startswith(DAILY_ARCHIVE_PREFIXES) and filename.endswith(".json.gz")),
+                      key=file_sort_key)
+
+    dictionary = None if train else latest_dictionary(directory)
+    if dictionary is None:
+        # The most recent files are the most like what the scraper will write.
+        lines = sample_lines(gz_paths[-30:])
+        if not lines:
+            print("No archives to train a dictionary on")
+            return
+        dictionary = train_dictionary(lines)
+        print(f"Trained dictionary {dictionary.dict_id()} on {len(lines)} lines,"
+              f" saved to {save_dictionary(dictionary, directory)}")
+
+    for path in gz_paths:
+        output_path = path[:-len(".json.gz")] + ZSTD_SUFFIX
+        if os.path.exists(output_path):
+            # Verified when it was written.
+            if remove_sources:
+                os.remove(path)
+            continue
+        try:
+            output_path = recompress_file(path, dictionary)
+        except (EOFError, OSError, ValueError) as e:
+            print(f"Failed to recompress {path}: {e}")
+            continue
+        print(f"Recompressed {path}: {os.path.getsize(path)} -> {os.path.getsize(output_path)} bytes")
+        if remove_sources:
+            os.remove(path)
@@ -0,0 +1,252 @@
+"""Per-line index of archive files, for reprocessing only some stations or time ranges.
+
+For every JSONL line of an archive file the index records the station, min/max validEnd
+and where the line is stored. Plain files are indexed by byte offsets. Lines of files
+recompressed with zstd (see archive_codec) are separate frames, and lines of segments (see
+compaction) are separate gzip members, so a single line can be decompressed by seeking to
+it. Daily .json.gz files are a single gzip stream, in which a line can't be read without
+decompressing everything before it. They are not indexed; recompress them to index them.
+Archive files themselves are never modified.
+
+Indexes are stored next to archive files as <archive file>.idx. Only the index command
+builds them; readers use an up-to-date index if there is one and read the whole file
+otherwise.
+
+Usage: slo-weather index
+"""
+
+import datetime
+import gzip
+import json
+import os
+import re
+import zlib
+from json import JSONDecodeError
+from typing import Iterable, Iterator, Optional
+
+from data_pipeline.archive_codec import ZSTD_SUFFIX, BadZstdFile, decompress_frame, dictionary_dir, iter_frames
+from data_pipeline.archive_util import get_input_files_list
+from data_pipeline.compaction import read_rows_until_truncated
+from data_pipeline.models import Datapoint
+from data_pipeline.parse_cache import ParseCache, cached_xml_to_datapoints, get_parse_cache
+from data_pipeline.parsing_util import parse_arso_datetime
+from data_pipeline.paths_util import get_data_dir
+
+INDEX_SUFFIX = ".idx"
+# Left by an earlier version of indexing, which wrote member-per-line copies of gzipped files.
+MEMBERS_SUFFIX = ".members.gz"
+# Compressed bytes fed to the decompressor at a time, so finding the end of a member doesn't copy the rest of the file.
+_READ_CHUNK = 64 * 1024
+
+_valid_end_pattern = re.compile(r"<validEnd>([^<]*)</validEnd>")
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def members_path(path: str) -> str:
+    return path + MEMBERS_SUFFIX
+
+
+def gzip_members(data: bytes) -> Iterator[tuple[int, int, bytes]]:
+    """Offset, length and decompressed content of each gzip member of the data."""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        parts = []
+        position = offset
+        while not decompressor.eof:
+            if position >= len(data):
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            chunk = view[position:position + _READ_CHUNK]
+            parts.append(decompressor.decompress(chunk))
+            position += len(chunk)
+        end = position - len(decompressor.unused_data)
+        yield offset, end - offset, b"".join(parts)
+        offset = end
+
+
+def _line_entry(line: bytes, offset: int, length: int) -> dict:
+    row = json.loads(line)
+    valid_ends = [parse_arso_datetime(s) for s in _valid_end_pattern.findall(row["xml"])]
+    return {
+        "offset": offset,
+        "length": length,
+        "station": (row.get("meteosiId") or "").strip("_"),
+        "min_valid_end": min(valid_ends).isoformat() if valid_ends else None,
+        "max_valid_end": max(valid_ends).isoformat() if valid_ends else None,
+    }
+
+
+def _index_plain_file(path: str) -> tuple[str, list[dict]]:
+    lines = []
+    offset = 0
+    with open(path, mode="rb") as fp:
+        for line in fp:
+            lines.append(_line_entry(line, offset, len(line)))
+            offset += len(line)
+    return "plain", lines
+
+
+def _index_gzip_file(path: str) -> Optional[tuple[str, list[dict]]]:
+    """Indexes the gzip members of the file, None unless each member is one line."""
+    with open(path, mode="rb") as fp:
+        data = fp.read()
+    lines = []
+    for offset, length, content in gzip_members(data):
+        if content.count(b"\n") > 1 or (content and not content.endswith(b"\n")):
+            return None
+        if content:
+            lines.append(_line_entry(content, offset, length))
+    return "gzip_members", lines
+
+
+def _index_zstd_file(path: str) -> tuple[str, list[dict]]:
+    with open(path, mode="rb") as fp:
+        data = fp.read()
+    lines = [_line_entry(line, offset, length)
+             for offset, length, line in iter_frames(data, dictionary_dir(os.path.dirname(path)))]
+    return "zstd_frames", lines
+
+
+def build_index(path: str) -> Optional[dict]:
+    """Builds the index of the archive file, unless an up-to-date index already exists.
+
+    Returns None for gzipped files whose lines can't be read on their own."""
+    index = load_index(path)
+    if index is not None:
+        return index
+
+    if path.endswith(ZSTD_SUFFIX):
+        layout, lines = _index_zstd_file(path)
+    elif path.endswith(".gz"):
+        indexed = _index_gzip_file(path)
+        if indexed is None:
+            return None
+        layout, lines = indexed
+    else:
+        layout, lines = _index_plain_file(path)
+
+    stat = os.stat(path)
+    index = {
+        "file": os.path.basename(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "layout": layout,
+        "lines": lines,
+    }
+    with open(index_path(path), mode="w") as fp:
+        json.dump(index, fp)
+    return index
+
+
+def load_index(path: str) -> Optional[dict]:
+    """Returns the index of the archive file, or None if it's missing or the file changed since."""
+    try:
+        with open(index_path(path)) as fp:
+            index = json.load(fp)
+    except FileNotFoundError:
+        return None
+
+    stat = os.stat(path)
+    if index["size"] != stat.st_size or index["mtime_ns"] != stat.st_mtime_ns:
+        return None
+    if os.path.exists(members_path(path)):
+        # Offsets point into the copy, see remove_member_copies.
+        return None
+    return index
+
+
+def _matches(entry: dict, stations: Optional[set], start: Optional[datetime.datetime],
+             end: Optional[datetime.datetime]) -> bool:
+    if stations is not None and entry["station"] not in stations:
+        return False
+    if entry["max_valid_end"] is None:
+        return False
+    if start is not None and datetime.datetime.fromisoformat(entry["max_valid_end"]) < start:
+        return False
+    if end is not None and datetime.datetime.fromisoformat(entry["min_valid_end"]) > end:
+        return False
+    return True
+
+
+def read_line(path: str, index: dict, entry: dict) -> dict:
+    with open(path, mode="rb") as fp:
+        fp.seek(entry["offset"])
+        data = fp.read(entry["length"])
+    if index["layout"] == "gzip_members":
+        data = gzip.decompress(data)
+    elif index["layout"] == "zstd_frames":
+        data = decompress_frame(data, dictionary_dir(os.path.dirname(path)))
+    return json.loads(data)
+
+
+def _matching_rows(path: str, stations: Optional[set], start: Optional[datetime.datetime],
+                   end: Optional[datetime.datetime]) -> Iterator[dict]:
+    index = load_index(path)
+    if index is None:
+        rows, error = read_rows_until_truncated(path)
+        if error is not None:
+            print(f"Failed to read {path}: {error}")
+        yield from rows
+        return
+    for entry in index["lines"]:
+        if _matches(entry, stations, start, end):
+            yield read_line(path, index, entry)
+
+
+def iter_datapoints(stations: Optional[Iterable[str]] = None,
+                    start: Optional[datetime.datetime] = None,
+                    end: Optional[datetime.datetime] = None,
+                    data_dir: Optional[str] = None,
+                    cache: Optional[ParseCache] = None) -> Iterable[Datapoint]:
+    """Datapoints of the given stations (ARSO codes) with start <= interval_end <= end.
+
+    Only archive lines which can contain such datapoints are read and parsed, if the file
+    has an up-to-date index (see main). Files without one are read in full."""
+    stations = set(stations) if stations is not None else None
+    cache = cache or get_parse_cache()
+    for path in get_input_files_list(data_dir or get_data_dir()):
+        for row in _matching_rows(path, stations, start, end):
+            for datapoint in cached_xml_to_datapoints(row["xml"], cache):
+                if stations is not None and datapoint.station_arso_code not in stations:
+                    continue
+                if start is not None and datapoint.interval_end < start:
+                    continue
+                if end is not None and datapoint.interval_end > end:
+                    continue
+                yield datapoint
+
+
+def remove_member_copies(data_dir: str):
+    for filename in os.listdir(data_dir):
+        if filename.endswith(MEMBERS_SUFFIX):
+            print("Removing", filename)
+            os.remove(os.path.join(data_dir, filename))
+            # Their indexes pointed into the copies.
+            archive_index = index_path(os.path.join(data_dir, filename[:-len(MEMBERS_SUFFIX)]))
+            if os.path.exists(archive_index):
+                os.remove(archive_index)
+
+
+def main():
+    data_dir = get_data_dir()
+    remove_member_copies(data_dir)
+    for path in get_input_files_list(data_dir):
+        print("Indexing", path)
+        try:
+            index = build_index(path)
+        except (JSONDecodeError, EOFError, BadZstdFile) as e:
+            print(f"Failed to index {path}: {e}")
+            continue
+        if index is None:
+            print(f"Not indexing {path}, lines of a gzip stream can't be read on their own."
+                  f" Recompress it with: slo-weather recompress")
+            continue
+        print(f"Indexed {len(index['lines'])} lines of {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Listing of meteo data archive files in the data directory.
+
+Scraper writes one weather_data_<batch time>.json.gz per run (older runs were named
+meteo_data_archive_*). Closed months are compacted into meteo_data_segment_<month>.json.gz,
+see data_pipeline.compaction. Each segment has a manifest listing the daily files it replaces.
+
+Daily files recompressed with zstd (see data_pipeline.archive_codec) are .json.zst. While
+both versions of a file exist, only the .json.zst one is listed.
+"""
+
+import json
+import os
+import re
+from typing import Optional
+
+DAILY_ARCHIVE_PREFIXES = ("meteo_data_archive_", "weather_data_")
+SEGMENT_PREFIX = "meteo_data_segment_"
+SEGMENT_MANIFEST_SUFFIX = ".manifest.json"
+JSONL_SUFFIXES = (".json", ".json.gz", ".json.zst")
+
+_month_pattern = re.compile(r"(\d{4}-\d{2})")
+_date_pattern = re.compile(r"(\d{4}-\d{2}(-\d{2}[^.]*)?)")
+
+
+def is_jsonl_file(filename: str) -> bool:
+    return filename.endswith(JSONL_SUFFIXES)
+
+
+def archive_stem(filename: str) -> str:
+    """File name without the directory and the .json[.gz|.zst] suffix."""
+    filename = os.path.basename(filename)
+    for suffix in JSONL_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def file_month(filename: str) -> Optional[str]:
+    """Month of the batch time in the file name, for example "2024-03"."""
+    match = _month_pattern.search(os.path.basename(filename))
+    return match.group(1) if match else None
+
+
+def file_sort_key(path: str) -> str:
+    """Orders daily files and segments by their batch time, oldest first."""
+    match = _date_pattern.search(os.path.basename(path))
+    return match.group(1) if match else ""
+
+
+def get_daily_archive_files(data_dir: str) -> list:
+    filenames = [filename for filename in os.listdir(data_dir) if
+                 is_jsonl_file(filename) and filename.startswith(DAILY_ARCHIVE_PREFIXES)]
+    recompressed = {archive_stem(filename) for filename in filenames if filename.endswith(".json.zst")}
+    paths = [os.path.join(data_dir, filename) for filename in filenames
+             if filename.endswith(".json.zst") or archive_stem(filename) not in recompressed]
+    paths.sort(key=file_sort_key)
+    return paths
+
+
+def segment_path(data_dir: str, month: str) -> str:
+    return os.path.join(data_dir, f"{SEGMENT_PREFIX}{month}.json.gz")
+
+
+def segment_manifest_path(data_dir: str, month: str) -> str:
+    return os.path.join(data_dir, f"{SEGMENT_PREFIX}{month}{SEGMENT_MANIFEST_SUFFIX}")
+
+
+def get_segment_manifests(data_dir: str) -> list[dict]:
+    manifests = []
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.startswith(SEGMENT_PREFIX) and filename.endswith(SEGMENT_MANIFEST_SUFFIX):
+            with open(os.path.join(data_dir, filename)) as fp:
+                manifests.append(json.load(fp))
+    return manifests
+
+
+def get_input_files_list(data_dir: str) -> list:
+    """Verified segments and the daily files which aren't compacted into any of them."""
+    manifests = get_segment_manifests(data_dir)
+    # By stem, daily files may have been recompressed after compaction.
+    compacted = {archive_stem(source) for manifest in manifests for source in manifest["sources"]}
+
+    paths = [os.path.join(data_dir, manifest["segment"]) for manifest in manifests]
+    paths += [path for path in get_daily_archive_files(data_dir) if archive_stem(path) not in compacted]
+    paths.sort(key=file_sort_key)
+    return paths
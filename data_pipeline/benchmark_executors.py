@@ -0,0 +1,83 @@
+"""Compares process pool and thread pool parsing of a synthetic archive.
+
+The archive is generated from data/example.xml: every file holds one row per station.
+Each mode runs in a fresh interpreter, so peak RSS is measured separately.
+
+Usage: PYTHONPATH=. python -m data_pipeline.benchmark_executors [files] [stations] [workers]
+"""
+
+import gzip
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from data_pipeline.metrics import RunMetrics
+from data_pipeline.paths_util import get_data_dir
+
+MODES = ("processes", "threads")
+
+
+def write_synthetic_archive(archive_dir: str, files: int, stations: int):
+    with open(os.path.join(get_data_dir(), "example.xml")) as fp:
+        xml = fp.read()
+
+    for i in range(files):
+        path = os.path.join(archive_dir, f"weather_data_2024-01-{i + 1:02}T04-17-00.json.gz")
+        with gzip.open(path, mode="wt") as fp:
+            for j in range(stations):
+                station = f"STATION{j:03}_"
+                fp.write(json.dumps({"meteosiId": station, "xml": xml.replace("GODNJE_", station)}) + "\n")
+
+
+def run_mode(mode: str, archive_dir: str, workers: int):
+    """Runs in the child interpreter, prints results as JSON."""
+    loader = importlib.import_module("data_pipeline.03_parse_meteo_data_archive_in_memory")
+    paths = loader.get_input_files_list(archive_dir)
+
+    run = RunMetrics(f"benchmark_{mode}")
+    start = time.perf_counter()
+    if mode == "processes":
+        d = loader.load_in_processes(paths, run, workers)
+    else:
+        d = loader.load_in_threads(paths, run, workers)
+    wall_seconds = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux. For children it's the peak of the largest one.
+    print(json.dumps({
+        "wall_seconds": wall_seconds,
+        "datapoints": sum(f.datapoints for f in run.files),
+        "unique_datapoints": len(d),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "max_worker_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }))
+
+
+def main(files: int = 12, stations: int = 8, workers: int = 4):
+    with tempfile.TemporaryDirectory() as archive_dir:
+        write_synthetic_archive(archive_dir, files, stations)
+        print(f"Synthetic archive: {files} files with {stations} stations, {workers} workers")
+
+        env = {**os.environ, "SLO_WEATHER_PARSE_CACHE": "off"}
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "data_pipeline.benchmark_executors", "--run", mode, archive_dir, str(workers)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            worker_rss = (f", largest worker {result['max_worker_rss_mb']:.0f} MB, up to "
+                          f"{result['max_rss_mb'] + workers * result['max_worker_rss_mb']:.0f} MB in total"
+                          if mode == "processes" else "")
+            print(f"{mode}: {result['wall_seconds']:.2f}s, {result['datapoints']} datapoints "
+                  f"({result['unique_datapoints']} unique), peak RSS {result['max_rss_mb']:.0f} MB{worker_rss}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        run_mode(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main(*map(int, sys.argv[1:]))
@@ -0,0 +1,100 @@
+"""Checkpoints of loading archive files, so that an interrupted load can resume.
+
+Files are loaded in batches of BATCH_LINES lines (station XMLs). Each batch is committed
+in one transaction together with the file's checkpoint, the number of its lines loaded so
+far (see DatapointWriter.write). Whatever stops a run, a crashed worker or a restarted
+database, at most the batches in flight are lost, and a resumed run continues each file
+after its last committed batch.
+
+Files which fail to load are recorded with their error, and loaded again by a run
+retrying failed files, until they failed MAX_ATTEMPTS times in a row.
+
+Files are identified by name and size: a file which changed size is loaded from the start.
+
+SLO_WEATHER_BATCH_LINES overrides the number of lines per batch.
+
+Table is created by schema_09_ingest_checkpoints.sql.
+
+Usage: slo-weather ingest [--resume | --retry-failed]
+"""
+
+import dataclasses
+import os
+from typing import Optional
+
+DEFAULT_BATCH_LINES = 50
+BATCH_LINES = int(os.environ.get("SLO_WEATHER_BATCH_LINES", DEFAULT_BATCH_LINES))
+MAX_ATTEMPTS = 3
+
+
+@dataclasses.dataclass
+class FileCheckpoint:
+    file_name: str
+    file_size: int
+    lines_done: int = 0
+    done: bool = False
+    attempts: int = 0
+    error: Optional[str] = None
+
+    @classmethod
+    def of(cls, path: str, lines_done: int = 0) -> "FileCheckpoint":
+        return cls(os.path.basename(path), os.path.getsize(path), lines_done)
+
+    def save(self, cursor):
+        """Records committed progress, clearing failures. Run in the transaction of the batch."""
+        cursor.execute("""
+            INSERT INTO ingest_checkpoints (file_name, file_size, lines_done, done, attempts, error, updated_at)
+            VALUES (%s, %s, %s, %s, 0, NULL, now() AT TIME ZONE 'UTC')
+            ON CONFLICT (file_name) DO UPDATE SET
+                file_size = excluded.file_size,
+                lines_done = excluded.lines_done,
+                done = excluded.done,
+                attempts = 0,
+                error = NULL,
+                updated_at = excluded.updated_at
+        """, (self.file_name, self.file_size, self.lines_done, self.done))
+
+
+def record_failure(conn, path: str, error: str):
+    """Counts a failed attempt of loading the file. Committed progress is kept."""
+    conn.execute("""
+        INSERT INTO ingest_checkpoints (file_name, file_size, lines_done, done, attempts, error, updated_at)
+        VALUES (%s, %s, 0, FALSE, 1, %s, now() AT TIME ZONE 'UTC')
+        ON CONFLICT (file_name) DO UPDATE SET
+            attempts = ingest_checkpoints.attempts + 1,
+            error = excluded.error,
+            updated_at = excluded.updated_at
+    """, (os.path.basename(path), os.path.getsize(path), error))
+
+
+def load_checkpoints(conn) -> dict[str, FileCheckpoint]:
+    return {
+        row[0]: FileCheckpoint(*row)
+        for row in conn.execute(
+            "SELECT file_name, file_size, lines_done, done, attempts, error FROM ingest_checkpoints")
+    }
+
+
+def plan(paths: list[str], sizes: dict[str, int], checkpoints: dict[str, FileCheckpoint],
+         resume: bool = False, retry_failed: bool = False) -> list[tuple[str, int]]:
+    """Files to load and the line to start each at.
+
+    Without resume or retry_failed all files are loaded from the start. resume skips loaded
+    files and continues partially loaded ones, retry_failed does the same for files whose
+    last attempt failed, fewer than MAX_ATTEMPTS times in a row."""
+    tasks = []
+    for path in paths:
+        checkpoint = checkpoints.get(os.path.basename(path))
+        if checkpoint is not None and checkpoint.file_size != sizes[path]:
+            checkpoint = None
+        if retry_failed:
+            if checkpoint is not None and checkpoint.error is not None and checkpoint.attempts < MAX_ATTEMPTS:
+                tasks.append((path, checkpoint.lines_done))
+        elif resume:
+            if checkpoint is None:
+                tasks.append((path, 0))
+            elif not checkpoint.done:
+                tasks.append((path, checkpoint.lines_done))
+        else:
+            tasks.append((path, 0))
+    return tasks
@@ -0,0 +1,238 @@
+"""slo-weather command line interface.
+
+Commands import what they need when they run, so that short runs from cron don't pay
+for importing Scrapy, lxml, psycopg or pydantic. Check with:
+
+    python -X importtime -m data_pipeline --help
+"""
+
+import argparse
+import importlib
+import sys
+
+
+def _loader(name: str):
+    # Loader scripts have numbered module names, so they can't be imported with import statements.
+    return importlib.import_module(f"data_pipeline.{name}")
+
+
+def _parse_datetime(s: str):
+    import datetime
+
+    value = datetime.datetime.fromisoformat(s)
+    return value if value.tzinfo is not None else value.replace(tzinfo=datetime.timezone.utc)
+
+
+def stations(args):
+    _loader("01_insert_stations").main()
+
+
+def ingest(args):
+    if args.source == "waters":
+        _loader("04_insert_waters_data").main()
+    else:
+        if args.mode == "external":
+            from data_pipeline.external_dedup import main
+
+            main()
+        elif args.mode == "sequential":
+            _loader("02_parse_meteo_data_archive").main(args.resume, args.retry_failed)
+        else:
+            _loader("02_parse_meteo_data_archive").main_multiprocessing(args.resume, args.retry_failed, args.executor)
+        if args.rollups:
+            rollups(args)
+
+
+def export(args):
+    from data_pipeline.export import export_csv
+
+    if args.output == "-":
+        count = export_csv(sys.stdout, args.station, args.start, args.end)
+    else:
+        with open(args.output, mode="w", newline="") as fp:
+            count = export_csv(fp, args.station, args.start, args.end)
+    print(f"Exported {count} datapoints", file=sys.stderr)
+
+
+def compact(args):
+    import datetime
+
+    from data_pipeline.compaction import compact
+    from data_pipeline.paths_util import get_data_dir
+
+    compact(get_data_dir(), datetime.datetime.now(tz=datetime.timezone.utc).date(), args.remove_sources)
+
+
+def recompress(args):
+    from data_pipeline.archive_codec import main
+
+    main(args.train, args.remove_sources)
+
+
+def index(args):
+    from data_pipeline.archive_index import main
+
+    main()
+
+
+def partitions(args):
+    from data_pipeline.partitions import main
+
+    if args.partitions_command == "detach" and args.before is None:
+        sys.exit("partitions detach: --before is required")
+    main(args.partitions_command, args.months_ahead, args.before, args.archive)
+
+
+def coverage(args):
+    from data_pipeline.coverage import main
+
+    main(args.coverage_command, args.start, args.end, args.min_slots, args.dry_run)
+
+
+def climatology(args):
+    from data_pipeline.climatology import main
+
+    main(args.climatology_command)
+
+
+def rollups(args):
+    from data_pipeline.rollups import main
+
+    main()
+
+
+def qc(args):
+    from data_pipeline.quality import main
+
+    main()
+
+
+def grids(args):
+    import dataclasses
+
+    from data_pipeline.interpolation import SLOVENIA_GRID, main
+
+    main(args.input_dir, dataclasses.replace(SLOVENIA_GRID, step=args.step), args.elevation)
+
+
+def serve(args):
+    from data_pipeline.api import main
+
+    main(args.host, args.port)
+
+
+def bench(args):
+    if args.benchmark == "crawl":
+        from scraper.benchmark_crawl import main
+
+        main(args.stations, args.gauges)
+        return
+    if args.benchmark == "extract":
+        from data_pipeline.columnar import main
+
+        main(args.start, args.end)
+        return
+    if args.benchmark == "waters-parsing":
+        from scraper.benchmark_waters_parsing_util import main
+    else:
+        from data_pipeline.benchmark_executors import main
+    main()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="slo-weather", description="Archive of ARSO observations.")
+    subparsers = parser.add_subparsers(required=True, metavar="command")
+
+    p = subparsers.add_parser("stations", help="load stations into the database")
+    p.set_defaults(func=stations)
+
+    p = subparsers.add_parser("ingest", help="load archived observations into the database")
+    p.add_argument("--source", choices=["meteo", "waters"], default="meteo")
+    p.add_argument("--mode", choices=["processes", "sequential", "external"], default="processes",
+                   help="how meteo archive files are processed, external deduplicates the whole archive"
+                        " on disk first, for full rebuilds")
+    p.add_argument("--executor", choices=["processes", "threads"], default="processes",
+                   help="workers of --mode processes, threads share one parse cache and connection pool")
+    p.add_argument("--rollups", action="store_true",
+                   help="update rollups of loaded meteo datapoints afterwards, see slo-weather rollups")
+    resume = p.add_mutually_exclusive_group()
+    resume.add_argument("--resume", action="store_true",
+                        help="skip loaded meteo files and continue partially loaded ones after their last batch")
+    resume.add_argument("--retry-failed", action="store_true", help="load meteo files whose last load failed")
+    p.set_defaults(func=ingest)
+
+    p = subparsers.add_parser("export", help="export deduplicated observations from the archive to CSV")
+    p.add_argument("--station", action="append", help="ARSO station code, can be repeated")
+    p.add_argument("--start", type=_parse_datetime, help="ISO datetime, UTC unless given")
+    p.add_argument("--end", type=_parse_datetime, help="ISO datetime, UTC unless given")
+    p.add_argument("--output", default="-", help="CSV file, stdout by default")
+    p.set_defaults(func=export)
+
+    p = subparsers.add_parser("compact", help="compact closed months of daily archive files")
+    p.add_argument("--remove-sources", action="store_true",
+                   help="remove daily files once their segment is written and verified")
+    p.set_defaults(func=compact)
+
+    p = subparsers.add_parser("recompress", help="re-encode gzipped daily archive files with zstd")
+    p.add_argument("--train", action="store_true", help="train a new dictionary instead of using the latest one")
+    p.add_argument("--remove-sources", action="store_true",
+                   help="remove .json.gz files once their .json.zst version is written and verified")
+    p.set_defaults(func=recompress)
+
+    p = subparsers.add_parser("index", help="build per-line indexes of archive files")
+    p.set_defaults(func=index)
+
+    p = subparsers.add_parser("partitions", help="manage monthly partitions of weather_datapoints")
+    p.add_argument("partitions_command", choices=["ensure", "detach"])
+    p.add_argument("--months-ahead", type=int, default=3, help="months after the current one to create")
+    p.add_argument("--before", help="YYYY-MM, detach partitions of earlier months")
+    p.add_argument("--archive", action="store_true", help="export detached partitions to data/partitions/ and drop them")
+    p.set_defaults(func=partitions)
+
+    p = subparsers.add_parser("coverage", help="report gaps in datapoints and refetch recoverable ones")
+    p.add_argument("coverage_command", choices=["report", "refetch"])
+    p.add_argument("--start", type=_parse_datetime, help="ISO datetime, UTC unless given")
+    p.add_argument("--end", type=_parse_datetime, help="ISO datetime, UTC unless given")
+    p.add_argument("--min-slots", type=int, default=1, help="report only gaps of at least this many 10-minute slots")
+    p.add_argument("--dry-run", action="store_true", help="list stations to refetch without crawling")
+    p.set_defaults(func=coverage)
+
+    p = subparsers.add_parser("climatology", help="rebuild station climatologies or show anomalies of latest datapoints")
+    p.add_argument("climatology_command", choices=["rebuild", "latest"])
+    p.set_defaults(func=climatology)
+
+    p = subparsers.add_parser("rollups", help="update rollups of datapoints written since the last update")
+    p.set_defaults(func=rollups)
+
+    p = subparsers.add_parser("qc", help="screen datapoints in the database and update their quality flags")
+    p.set_defaults(func=qc)
+
+    p = subparsers.add_parser("grids", help="interpolate dumped station matrices onto precipitation and temperature grids")
+    p.add_argument("--input-dir", help="directory with dump_binary output, data/ by default")
+    p.add_argument("--step", type=float, default=0.01, help="grid step in degrees")
+    p.add_argument("--elevation", help=".npy elevation model [lat x lon] of the grid, in metres")
+    p.set_defaults(func=grids)
+
+    p = subparsers.add_parser("serve", help="serve the read API over HTTP")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.set_defaults(func=serve)
+
+    p = subparsers.add_parser("bench", help="run a benchmark")
+    p.add_argument("benchmark", choices=["waters-parsing", "executors", "crawl", "extract"])
+    p.add_argument("--stations", type=int, default=200, help="synthetic weather stations of the crawl benchmark")
+    p.add_argument("--gauges", type=int, default=100, help="synthetic water gauges of the crawl benchmark")
+    p.add_argument("--start", type=_parse_datetime, help="start of datapoints read by the extract benchmark")
+    p.add_argument("--end", type=_parse_datetime, help="end of datapoints read by the extract benchmark")
+    p.set_defaults(func=bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Climatology of each station: normal values per day of the year and hour, and anomalies.
+
+For every station, variable and cell (day of the year and hour of the day, UTC) the table
+station_climatology keeps count, mean and M2 (sum of squared deviations from the mean) of
+all values so far. These moments are mergeable (Chan et al.): moments of two sets of
+values combine into the moments of their union without the values. So:
+
+- Loaders merge the moments of each batch's new datapoints in the same transaction as the
+  datapoints (see datapoint_writer.py). Only datapoints the batch inserted are counted, the
+  overlapping days of consecutive archive files are not counted twice. Values of
+  datapoints which are updated later are not corrected.
+- rebuild computes all moments in one vectorized pass over the columnar reader's chunks
+  (see columnar.py), merging each chunk's moments into the totals.
+
+Days are days of a leap year's calendar, so 1 March is the same day every year. One day
+and hour of a station only gets ~6 values a year, so normals (see Climatology) merge the
+cells of the same hour within WINDOW_DAYS around the day. Looking up the anomaly of a
+datapoint is then an index into arrays.
+
+Table is created by schema_10_station_climatology.sql.
+
+Usage: slo-weather climatology rebuild
+       slo-weather climatology latest
+"""
+
+import dataclasses
+import datetime
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+from data_pipeline.models import Datapoint
+
+CLIMATOLOGY_VARIABLES = (
+    "temperature_air_avg",
+    "humidity_relative_avg",
+    "pressure_mean_sea_level_avg",
+    "precipitation_sum_1h",
+)
+DAYS = 366
+HOURS = 24
+CELLS = DAYS * HOURS
+# Normals merge the cells of the same hour of this many days before and after the day.
+WINDOW_DAYS = 7
+# Fewer values than this don't make a normal.
+MIN_COUNT = 30
+
+# First day of each month in a leap year's calendar.
+_MONTH_STARTS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+UPSERT_CLIMATOLOGY_SQL = """
+    INSERT INTO station_climatology (station_arso_code, variable, cell, count, mean, m2)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON CONFLICT (station_arso_code, variable, cell) DO UPDATE SET
+        count = station_climatology.count + excluded.count,
+        mean = station_climatology.mean + (excluded.mean - station_climatology.mean)
+            * excluded.count / (station_climatology.count + excluded.count),
+        m2 = station_climatology.m2 + excluded.m2 + (excluded.mean - station_climatology.mean) ^ 2
+            * station_climatology.count * excluded.count / (station_climatology.count + excluded.count)
+"""
+
+
+def cells_of(times: np.ndarray) -> np.ndarray:
+    """Cell (day * 24 + hour) of each time (datetime64, UTC)."""
+    hours = times.astype("datetime64[h]")
+    days = hours.astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    day_of_year = _MONTH_STARTS[months.astype(np.int64) % 12] + (days - months).astype(np.int64)
+    return day_of_year * HOURS + (hours - days).astype(np.int64)
+
+
+def cell_of(dt: datetime.datetime) -> int:
+    # Timestamps are stored without a time zone, in UTC.
+    dt = dt.astimezone(datetime.timezone.utc) if dt.tzinfo is not None else dt
+    return (int(_MONTH_STARTS[dt.month - 1]) + dt.day - 1) * HOURS + dt.hour
+
+
+def moments(keys: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Unique keys and count, mean and M2 of the values with each. NaN values are skipped."""
+    present = ~np.isnan(values)
+    keys, values = keys[present], values[present].astype(np.float64)
+    unique_keys, groups = np.unique(keys, return_inverse=True)
+    count = np.bincount(groups, minlength=len(unique_keys))
+    mean = np.bincount(groups, weights=values, minlength=len(unique_keys)) / np.maximum(count, 1)
+    # Deviations from the group's mean, more accurate than the sum of squares.
+    m2 = np.bincount(groups, weights=(values - mean[groups]) ** 2, minlength=len(unique_keys))
+    return unique_keys, count, mean, m2
+
+
+def merge_moments(count_a: np.ndarray, mean_a: np.ndarray, m2_a: np.ndarray,
+                  count_b: np.ndarray, mean_b: np.ndarray, m2_b: np.ndarray
+                  ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Moments of the union of the values of a and b, elementwise."""
+    count = count_a + count_b
+    safe_count = np.maximum(count, 1)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / safe_count
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / safe_count
+    return count, np.where(count > 0, mean, 0.0), m2
+
+
+def batch_rows(datapoints: Iterable[Datapoint]) -> list[tuple]:
+    """Rows of UPSERT_CLIMATOLOGY_SQL with the moments of the datapoints."""
+    datapoints = list(datapoints)
+    if not datapoints:
+        return []
+    stations = sorted({d.station_arso_code for d in datapoints})
+    station_indexes = {station: i for i, station in enumerate(stations)}
+    station_column = np.array([station_indexes[d.station_arso_code] for d in datapoints], dtype=np.int64)
+    cells = np.array([cell_of(d.interval_start) for d in datapoints], dtype=np.int64)
+
+    rows = []
+    for variable in CLIMATOLOGY_VARIABLES:
+        values = np.array([getattr(d, variable) for d in datapoints], dtype=np.float64)
+        keys, count, mean, m2 = moments(station_column * CELLS + cells, values)
+        rows.extend(
+            (stations[key // CELLS], variable, key % CELLS, n, m, s)
+            for key, n, m, s in zip(keys.tolist(), count.tolist(), mean.tolist(), m2.tolist())
+        )
+    return rows
+
+
+def mark_climatology(cursor, datapoints: Iterable[Datapoint]):
+    """Merges the moments of the datapoints into station_climatology."""
+    cursor.executemany(UPSERT_CLIMATOLOGY_SQL, batch_rows(datapoints))
+
+
+class Accumulator:
+    """Moments of [station x variable x cell], merged chunk by chunk."""
+
+    def __init__(self, stations: int):
+        shape = stations * len(CLIMATOLOGY_VARIABLES) * CELLS
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    def add_chunk(self, chunk: dict[str, np.ndarray]):
+        """Adds a chunk of columnar.read_datapoints."""
+        cells = cells_of(chunk["interval_start"])
+        base = chunk["station"].astype(np.int64) * len(CLIMATOLOGY_VARIABLES) * CELLS + cells
+        for i, variable in enumerate(CLIMATOLOGY_VARIABLES):
+            keys, count, mean, m2 = moments(base + i * CELLS, chunk[variable])
+            self.count[keys], self.mean[keys], self.m2[keys] = merge_moments(
+                self.count[keys], self.mean[keys], self.m2[keys], count, mean, m2)
+
+    def rows(self, stations: list[str]) -> Iterable[tuple]:
+        for key in np.flatnonzero(self.count).tolist():
+            station, rest = divmod(key, len(CLIMATOLOGY_VARIABLES) * CELLS)
+            variable, cell = divmod(rest, CELLS)
+            yield (stations[station], CLIMATOLOGY_VARIABLES[variable], cell,
+                   int(self.count[key]), float(self.mean[key]), float(self.m2[key]))
+
+
+def rebuild(conn) -> int:
+    """Recomputes station_climatology from all datapoints. Returns the number of cells.
+
+    The table is locked first, so loaders writing meanwhile wait and merge their batches
+    into the rebuilt moments, none are lost or counted twice."""
+    from data_pipeline.columnar import read_datapoints
+
+    stations = [row[0] for row in conn.execute("SELECT arso_code FROM stations ORDER BY arso_code")]
+    conn.execute("LOCK TABLE station_climatology IN EXCLUSIVE MODE")
+    accumulator = Accumulator(len(stations))
+    for chunk in read_datapoints(conn, stations, datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc),
+                                 datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(days=1),
+                                 CLIMATOLOGY_VARIABLES):
+        accumulator.add_chunk(chunk)
+
+    cells = 0
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE station_climatology")
+        with cur.copy("COPY station_climatology (station_arso_code, variable, cell, count, mean, m2) FROM STDIN") as copy:
+            for row in accumulator.rows(stations):
+                copy.write_row(row)
+                cells += 1
+    conn.commit()
+    return cells
+
+
+@dataclasses.dataclass
+class Anomaly:
+    value: float
+    normal: float
+    std: float
+    count: int  # values the normal is of
+
+    @property
+    def deviation(self) -> float:
+        return self.value - self.normal
+
+    @property
+    def z_score(self) -> Optional[float]:
+        return self.deviation / self.std if self.std > 0 else None
+
+
+class Climatology:
+    """Normals of all stations, as [station x variable x cell] arrays, for constant-time lookups."""
+
+    def __init__(self, stations: list[str], count: np.ndarray, mean: np.ndarray, m2: np.ndarray,
+                 window_days: int = WINDOW_DAYS):
+        self.station_indexes = {station: i for i, station in enumerate(stations)}
+        self.count, self.normal, self.std = self.smooth(count, mean, m2, window_days)
+
+    @staticmethod
+    def smooth(count: np.ndarray, mean: np.ndarray, m2: np.ndarray,
+               window_days: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Merges cells of the same hour within window_days around each day (wrapping around the year).
+
+        Arrays have the shape [..., CELLS]. Moments are summed as count, sum and sum of squares."""
+        shape = count.shape
+        count = count.reshape(-1, DAYS, HOURS).astype(np.float64)
+        total = count * mean.reshape(-1, DAYS, HOURS)
+        squares = m2.reshape(-1, DAYS, HOURS) + total * mean.reshape(-1, DAYS, HOURS)
+
+        def window_sum(a: np.ndarray) -> np.ndarray:
+            padded = np.concatenate((a[:, DAYS - window_days:], a, a[:, :window_days]), axis=1)
+            cumulative = np.concatenate((np.zeros_like(a[:, :1]), np.cumsum(padded, axis=1)), axis=1)
+            return cumulative[:, 2 * window_days + 1:] - cumulative[:, :DAYS]
+
+        count, total, squares = window_sum(count), window_sum(total), window_sum(squares)
+        safe_count = np.maximum(count, 1)
+        normal = total / safe_count
+        std = np.sqrt(np.maximum(squares / safe_count - normal ** 2, 0))
+        return (count.reshape(shape).astype(np.int32), normal.reshape(shape).astype(np.float32),
+                std.reshape(shape).astype(np.float32))
+
+    @classmethod
+    def load(cls, conn, window_days: int = WINDOW_DAYS) -> "Climatology":
+        from data_pipeline.columnar import copy_columns
+
+        stations = [row[0] for row in conn.execute("SELECT arso_code FROM stations ORDER BY arso_code")]
+        shape = (len(stations), len(CLIMATOLOGY_VARIABLES), CELLS)
+        count = np.zeros(shape, dtype=np.int64)
+        mean = np.zeros(shape, dtype=np.float64)
+        m2 = np.zeros(shape, dtype=np.float64)
+        query = """
+            SELECT (s.index - 1)::int4, (v.index - 1)::int4, cell::int4, count, mean, m2
+            FROM station_climatology
+            JOIN unnest(%s::text[]) WITH ORDINALITY AS s (code, index) ON station_arso_code = s.code
+            JOIN unnest(%s::text[]) WITH ORDINALITY AS v (name, index) ON variable = v.name
+        """
+        columns = {"station": "int4", "variable": "int4", "cell": "int4", "count": "int4", "mean": "float8",
+                   "m2": "float8"}
+        for chunk in copy_columns(conn, query, (stations, list(CLIMATOLOGY_VARIABLES)), columns):
+            index = (chunk["station"], chunk["variable"], chunk["cell"])
+            count[index], mean[index], m2[index] = chunk["count"], chunk["mean"], chunk["m2"]
+        return cls(stations, count, mean, m2, window_days)
+
+    def anomalies(self, datapoint: Datapoint) -> dict[str, Anomaly]:
+        """Anomalies of the datapoint's values which have a normal."""
+        station = self.station_indexes.get(datapoint.station_arso_code)
+        if station is None:
+            return {}
+        cell = cell_of(datapoint.interval_start)
+        result = {}
+        for i, variable in enumerate(CLIMATOLOGY_VARIABLES):
+            value = getattr(datapoint, variable)
+            count = int(self.count[station, i, cell])
+            if value is None or count < MIN_COUNT:
+                continue
+            result[variable] = Anomaly(value, float(self.normal[station, i, cell]),
+                                       float(self.std[station, i, cell]), count)
+        return result
+
+
+def main(command: str):
+    from data_pipeline import db
+
+    with db.connect() as conn:
+        if command == "rebuild":
+            start = time.perf_counter()
+            cells = rebuild(conn)
+            print(f"Rebuilt {cells} climatology cells in {time.perf_counter() - start:.1f}s")
+            return
+
+        climatology = Climatology.load(conn)
+        columns = list(Datapoint.model_fields)
+        for row in conn.execute(f"SELECT {', '.join(columns)} FROM station_latest ORDER BY station_arso_code"):
+            datapoint = Datapoint.model_construct(**dict(zip(columns, row)))
+            anomalies = climatology.anomalies(datapoint)
+            print(f"{datapoint.station_arso_code} {datapoint.interval_start.isoformat()}: " + (", ".join(
+                f"{variable} {anomaly.value:g} ({anomaly.deviation:+.1f} from {anomaly.normal:.1f})"
+                for variable, anomaly in anomalies.items()) or "no normals"))
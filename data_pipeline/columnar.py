@@ -0,0 +1,167 @@
+"""Streaming reads of query results into NumPy column arrays.
+
+Results are read with COPY ... TO STDOUT (FORMAT BINARY) and decoded in fixed-size chunks
+of rows, without creating Python objects per row or value. Memory stays bounded by the
+chunk size however large the range is.
+
+Every column must be a fixed-width type without NULLs (COALESCE them, e.g. to 'NaN' for
+REAL), so that all rows have the same size: a chunk of rows is then one NumPy record
+array over the received bytes, and each column is one conversion from it.
+
+read_datapoints reads datapoints of stations in a time range, stations as indexes into
+the given list of codes.
+
+Usage: slo-weather bench extract [--start ISO] [--end ISO]
+"""
+
+import datetime
+import struct
+import time
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from data_pipeline.quality import QC_VARIABLES
+
+DEFAULT_CHUNK_ROWS = 65536
+
+# Wire types of columns and their (big-endian) NumPy types.
+COLUMN_TYPES = {
+    "int4": ">i4",
+    "int8": ">i8",
+    "float4": ">f4",
+    "float8": ">f8",
+    # Microseconds since 2000-01-01.
+    "timestamp": ">i8",
+}
+
+_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_HEADER = struct.Struct(">11sii")
+_TRAILER = b"\xff\xff"
+_POSTGRES_EPOCH = np.datetime64("2000-01-01T00:00:00", "us")
+
+
+def row_dtype(columns: dict[str, str]) -> np.dtype:
+    """Layout of a row of the columns (name -> wire type): field count, then length and value of each field."""
+    fields = [("field_count", ">i2")]
+    for name, column_type in columns.items():
+        fields.append((f"{name}_length", ">i4"))
+        fields.append((name, COLUMN_TYPES[column_type]))
+    return np.dtype(fields)
+
+
+class BinaryCopyDecoder:
+    """Decodes binary COPY data into chunks of column arrays.
+
+    feed takes data as it arrives and yields each complete chunk, finish yields the rest."""
+
+    def __init__(self, columns: dict[str, str], chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        self.columns = columns
+        self.dtype = row_dtype(columns)
+        self.chunk_rows = chunk_rows
+        self._buffer = bytearray()
+        self._header_read = False
+
+    def feed(self, data) -> Iterator[dict[str, np.ndarray]]:
+        self._buffer += data
+        if not self._header_read:
+            if len(self._buffer) < _HEADER.size:
+                return
+            signature, _flags, extension_length = _HEADER.unpack_from(self._buffer)
+            if signature != _SIGNATURE:
+                raise ValueError("Not binary COPY data")
+            if len(self._buffer) < _HEADER.size + extension_length:
+                return
+            del self._buffer[:_HEADER.size + extension_length]
+            self._header_read = True
+
+        while len(self._buffer) >= self.chunk_rows * self.dtype.itemsize:
+            yield self._decode(self.chunk_rows)
+
+    def finish(self) -> Iterator[dict[str, np.ndarray]]:
+        if self._buffer.endswith(_TRAILER) and len(self._buffer) % self.dtype.itemsize == len(_TRAILER):
+            del self._buffer[-len(_TRAILER):]
+        rows, remainder = divmod(len(self._buffer), self.dtype.itemsize)
+        if remainder:
+            raise ValueError(f"Incomplete row, {remainder} bytes left")
+        if rows:
+            yield self._decode(rows)
+
+    def _decode(self, rows: int) -> dict[str, np.ndarray]:
+        size = rows * self.dtype.itemsize
+        with memoryview(self._buffer) as view:
+            data = view[:size].tobytes()
+        del self._buffer[:size]
+
+        records = np.frombuffer(data, dtype=self.dtype)
+        if not (records["field_count"] == len(self.columns)).all():
+            raise ValueError(f"Rows don't have {len(self.columns)} fields")
+        chunk = {}
+        for name, column_type in self.columns.items():
+            if not (records[f"{name}_length"] == self.dtype[name].itemsize).all():
+                raise ValueError(f"Column {name} has NULLs or isn't {column_type}")
+            values = records[name]
+            if column_type == "timestamp":
+                chunk[name] = _POSTGRES_EPOCH + values.astype(np.int64).astype("timedelta64[us]")
+            else:
+                chunk[name] = values.astype(values.dtype.newbyteorder("="))
+        return chunk
+
+
+def copy_columns(conn, query: str, params: Optional[Iterable], columns: dict[str, str],
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[dict[str, np.ndarray]]:
+    """Chunks of at most chunk_rows rows of the query's results, as arrays per column.
+
+    columns are the query's columns in order, with their wire types (see COLUMN_TYPES)."""
+    decoder = BinaryCopyDecoder(columns, chunk_rows)
+    with conn.cursor() as cur:
+        with cur.copy(f"COPY ({query}) TO STDOUT (FORMAT BINARY)", params) as copy:
+            for data in copy:
+                yield from decoder.feed(data)
+    yield from decoder.finish()
+
+
+def read_datapoints(conn, stations: list[str], start: datetime.datetime, end: datetime.datetime,
+                    variables: Iterable[str] = QC_VARIABLES,
+                    chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[dict[str, np.ndarray]]:
+    """Datapoints of the stations with interval_start in [start, end), sorted by station code and time.
+
+    Chunks have columns station (index into stations), interval_start and interval_end
+    (datetime64[us], UTC) and the variables (float32, NaN when missing)."""
+    variables = list(variables)
+    columns = {"station": "int4", "interval_start": "timestamp", "interval_end": "timestamp",
+               **{variable: "float4" for variable in variables}}
+    utc = datetime.timezone.utc
+    query = f"""
+        SELECT (requested.index - 1)::int4,
+               interval_start,
+               interval_end,
+               {", ".join(f"COALESCE({variable}, 'NaN')::float4" for variable in variables)}
+        FROM weather_datapoints
+        JOIN unnest(%s::text[]) WITH ORDINALITY AS requested (code, index) ON station_arso_code = requested.code
+        WHERE interval_start >= %s AND interval_start < %s
+          AND interval_end IS NOT NULL
+        ORDER BY station_arso_code, interval_start, interval_end
+    """
+    params = (stations, start.astimezone(utc).replace(tzinfo=None), end.astimezone(utc).replace(tzinfo=None))
+    return copy_columns(conn, query, params, columns, chunk_rows)
+
+
+def main(start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None):
+    """Reads datapoints of all stations in the range and reports the throughput."""
+    from data_pipeline import db
+
+    utc = datetime.timezone.utc
+    start = start or datetime.datetime(1970, 1, 1, tzinfo=utc)
+    end = end or datetime.datetime.now(tz=utc)
+    with db.connect() as conn:
+        stations = [row[0] for row in conn.execute("SELECT arso_code FROM stations ORDER BY arso_code")]
+        rows = 0
+        nbytes = 0
+        started = time.perf_counter()
+        for chunk in read_datapoints(conn, stations, start, end):
+            rows += len(chunk["station"])
+            nbytes += sum(values.nbytes for values in chunk.values())
+        elapsed = time.perf_counter() - started
+    print(f"Read {rows} datapoints ({nbytes / 1e6:.1f} MB of columns) in {elapsed:.2f} s,"
+          f" {rows / elapsed:.0f} rows/s, {nbytes / 1e6 / elapsed:.1f} MB/s")
@@ -0,0 +1,218 @@
+"""Compaction of a closed month of daily archive files into one deduplicated segment.
+
+Every daily file repeats ~48h of metData blocks of each station. The segment keeps only
+the newest version of each (station, validStart, validEnd) block, sorted by station and time.
+Rows of the segment have the same shape as rows of daily files, so loaders read it unchanged.
+Each row is a separate gzip member, so archive_index can read single rows.
+
+Usage: slo-weather compact [--remove-sources]
+"""
+
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import xml.etree.ElementTree as ET
+from json import JSONDecodeError
+from typing import Optional
+
+from data_pipeline.archive_codec import ZSTD_SUFFIX, dictionary_dir, iter_frames
+from data_pipeline.archive_util import (
+    file_month,
+    get_daily_archive_files,
+    get_segment_manifests,
+    segment_manifest_path,
+    segment_path,
+)
+from data_pipeline.parsing_util import parse_arso_datetime
+from data_pipeline.paths_util import get_data_dir
+
+_spill_record_header = struct.Struct(">qI")  # interval start (epoch seconds), block length
+
+
+def read_rows_until_truncated(path: str) -> tuple[list, Optional[str]]:
+    """Reads JSONL rows, keeping the rows before the point where a truncated file ends.
+
+    Returns the rows and the error, if the file is truncated or corrupt."""
+    rows = []
+    try:
+        if path.endswith(ZSTD_SUFFIX):
+            with open(path, mode="rb") as fp:
+                data = fp.read()
+            # Each frame is a line, frames before a truncated one decompress on their own.
+            for _, _, line in iter_frames(data, dictionary_dir(os.path.dirname(path))):
+                rows.append(json.loads(line))
+            return rows, None
+        with (gzip.open(path, mode="r") if path.endswith(".gz") else open(path, mode="rb")) as fp:
+            for line in fp:
+                rows.append(json.loads(line))
+    except (EOFError, JSONDecodeError, OSError) as e:
+        return rows, f"{type(e).__name__}: {e}"
+    return rows, None
+
+
+def get_closed_months(paths: list, today: datetime.date) -> list[str]:
+    current_month = f"{today:%Y-%m}"
+    return sorted({month for month in map(file_month, paths) if month is not None and month < current_month})
+
+
+class _SpillFiles:
+    """Per-station temporary files of unique metData blocks."""
+
+    def __init__(self, tmp_dir: str):
+        self.tmp_dir = tmp_dir
+        self.files = {}
+
+    def write(self, station: str, interval_start: datetime.datetime, block: bytes):
+        fp = self.files.get(station)
+        if fp is None:
+            fp = self.files[station] = open(os.path.join(self.tmp_dir, f"{len(self.files)}.bin"), mode="w+b")
+        fp.write(_spill_record_header.pack(int(interval_start.timestamp()), len(block)))
+        fp.write(block)
+
+    def sorted_blocks(self, station: str) -> list[tuple[int, bytes]]:
+        fp = self.files[station]
+        fp.seek(0)
+        data = fp.read()
+        blocks = []
+        offset = 0
+        while offset < len(data):
+            interval_start, length = _spill_record_header.unpack_from(data, offset)
+            offset += _spill_record_header.size
+            blocks.append((interval_start, data[offset:offset + length]))
+            offset += length
+        blocks.sort(key=lambda block: block[0])
+        return blocks
+
+    def close(self):
+        for fp in self.files.values():
+            fp.close()
+
+
+def compact_month(data_dir: str, month: str, sources: list) -> dict:
+    """Writes and verifies the segment of the month. Returns its manifest."""
+    seen_keys = set()
+    truncated = {}
+    blocks_in = 0
+
+    with tempfile.TemporaryDirectory(dir=data_dir) as tmp_dir:
+        spill_files = _SpillFiles(tmp_dir)
+        try:
+            # Newest file first, so the first version of a block we see is the one to keep.
+            for path in reversed(sources):
+                print("Reading", path)
+                rows, error = read_rows_until_truncated(path)
+                if error is not None:
+                    print(f"Truncated {path}: {error}")
+                    truncated[os.path.basename(path)] = {"error": error, "rows_recovered": len(rows)}
+
+                for row in rows:
+                    for met_data in ET.fromstring(row["xml"]).findall("metData"):
+                        blocks_in += 1
+                        station = met_data.find("domain_meteosiId").text
+                        key = (station, met_data.find("validStart").text, met_data.find("validEnd").text)
+                        if key in seen_keys:
+                            continue
+                        seen_keys.add(key)
+                        met_data.tail = "\n"
+                        spill_files.write(
+                            station,
+                            parse_arso_datetime(met_data.find("validStart").text),
+                            ET.tostring(met_data, encoding="utf-8"),
+                        )
+
+            output_path = segment_path(data_dir, month)
+            tmp_output_path = os.path.join(tmp_dir, os.path.basename(output_path))
+            content_hash = hashlib.sha256()
+            # Each line is a separate gzip member, so archive_index can read lines on their own.
+            with open(tmp_output_path, mode="wb") as fp:
+                for station in sorted(spill_files.files):
+                    blocks = spill_files.sorted_blocks(station)
+                    # One row per station and day keeps rows about as large as in daily files.
+                    for day, day_blocks in _group_by_day(blocks):
+                        xml = b"<data>\n" + b"".join(block for _, block in day_blocks) + b"</data>"
+                        line = json.dumps({"meteosiId": station, "xml": xml.decode("utf-8")}).encode("utf-8") + b"\n"
+                        content_hash.update(line)
+                        fp.write(gzip.compress(line, mtime=0))
+        finally:
+            spill_files.close()
+
+        verify_segment(tmp_output_path, content_hash.hexdigest(), len(seen_keys))
+        os.replace(tmp_output_path, output_path)
+
+    return {
+        "month": month,
+        "segment": os.path.basename(output_path),
+        "sources": [os.path.basename(path) for path in sources],
+        "truncated": truncated,
+        "blocks_in": blocks_in,
+        "blocks_out": len(seen_keys),
+        "sha256": content_hash.hexdigest(),
+        "created_at": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+    }
+
+
+def _group_by_day(blocks: list[tuple[int, bytes]]):
+    day_blocks = []
+    day = None
+    for interval_start, block in blocks:
+        block_day = interval_start // 86400
+        if day_blocks and block_day != day:
+            yield day, day_blocks
+            day_blocks = []
+        day = block_day
+        day_blocks.append((interval_start, block))
+    if day_blocks:
+        yield day, day_blocks
+
+
+def verify_segment(path: str, expected_sha256: str, expected_blocks: int):
+    """Re-reads the written segment and checks it decompresses into exactly what was written."""
+    with gzip.open(path, mode="rb") as fp:
+        content = fp.read()
+    if hashlib.sha256(content).hexdigest() != expected_sha256:
+        raise ValueError(f"Segment {path} doesn't match the written content")
+    blocks = sum(json.loads(line)["xml"].count("<metData>") for line in content.splitlines())
+    if blocks != expected_blocks:
+        raise ValueError(f"Segment {path} has {blocks} metData blocks, expected {expected_blocks}")
+
+
+def compact(data_dir: str, today: datetime.date, remove_sources: bool = False) -> list[dict]:
+    """Compacts all closed months which don't have a segment yet."""
+    compacted_months = {manifest["month"] for manifest in get_segment_manifests(data_dir)}
+    daily_files = get_daily_archive_files(data_dir)
+
+    manifests = []
+    for month in get_closed_months(daily_files, today):
+        if month in compacted_months:
+            continue
+        sources = [path for path in daily_files if file_month(path) == month]
+        manifest = compact_month(data_dir, month, sources)
+        with open(segment_manifest_path(data_dir, month), mode="w") as fp:
+            json.dump(manifest, fp, indent=2)
+        print(f"Compacted {len(sources)} files of {month}: "
+              f"{manifest['blocks_in']} metData blocks into {manifest['blocks_out']}")
+        manifests.append(manifest)
+
+        if remove_sources:
+            for path in sources:
+                os.remove(path)
+
+    return manifests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact closed months of daily archive files into segments.")
+    parser.add_argument("--remove-sources", action="store_true",
+                        help="remove daily files once their segment is written and verified")
+    args = parser.parse_args()
+
+    compact(get_data_dir(), datetime.datetime.now(tz=datetime.timezone.utc).date(), args.remove_sources)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Coverage index: which 10-minute slots of each station have datapoints.
+
+Slot n of a station covers [n * 10 min, (n + 1) * 10 min) since the epoch (UTC). A datapoint
+covers the slots from its interval_start to its interval_end, so stations reporting at
+coarser intervals have no gaps between their datapoints.
+
+Bitmaps are stored per station and month in station_coverage, one BIT(4464) row holding
+31 days of 144 slots (trailing bits of shorter months stay 0). Loaders OR the slots of a
+batch into them in the same transaction as the datapoints (see datapoint_writer.py), so
+concurrent loaders never lose each other's bits. Years of a station's coverage are a few
+dozen short rows, which is what makes gap queries cheap.
+
+History XMLs only reach about 48 hours back, so gaps older than that can't be refetched.
+refetch crawls the history XMLs of stations with missing slots in the recoverable window,
+the next ingest loads them.
+
+Table is created by schema_08_station_coverage.sql.
+
+Usage: slo-weather coverage report [--start ISO] [--end ISO] [--min-slots N]
+       slo-weather coverage refetch [--dry-run]
+"""
+
+import datetime
+import subprocess
+import sys
+from typing import Iterable, Optional
+
+import numpy as np
+
+from data_pipeline.partitions import add_months, month_of
+
+SLOT_SECONDS = 600
+SLOTS_PER_DAY = 86400 // SLOT_SECONDS
+MONTH_SLOTS = 31 * SLOTS_PER_DAY
+# How far back history XMLs reach, less an hour for publishing delays.
+RECOVERABLE_SECONDS = 47 * 3600
+
+UPSERT_COVERAGE_SQL = f"""
+    INSERT INTO station_coverage (station_arso_code, month, slots)
+    VALUES (%s, %s, %s::bit({MONTH_SLOTS}))
+    ON CONFLICT (station_arso_code, month) DO UPDATE SET
+        slots = station_coverage.slots | excluded.slots
+"""
+
+
+def _epoch(dt: datetime.datetime) -> float:
+    # Timestamps are stored without a time zone, in UTC.
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp() if dt.tzinfo is None else dt.timestamp()
+
+
+def _month_first_slot(month: datetime.date) -> int:
+    return int(datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc).timestamp()) // SLOT_SECONDS
+
+
+def _month_slots(month: datetime.date) -> int:
+    return _month_first_slot(add_months(month, 1)) - _month_first_slot(month)
+
+
+def slot_of(dt: datetime.datetime) -> int:
+    return int(_epoch(dt)) // SLOT_SECONDS
+
+
+def slots_of(interval_start: datetime.datetime, interval_end: datetime.datetime) -> range:
+    """Slots covered by a datapoint, at least the slot of interval_start."""
+    first = slot_of(interval_start)
+    return range(first, max(first + 1, -(-int(_epoch(interval_end)) // SLOT_SECONDS)))
+
+
+def slot_time(slot: int) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(slot * SLOT_SECONDS, tz=datetime.timezone.utc)
+
+
+def month_bitmaps(datapoints: Iterable) -> dict[tuple[str, datetime.date], np.ndarray]:
+    """Bitmap of covered slots (bool array of MONTH_SLOTS) per station and month."""
+    slots_by_station = {}
+    for datapoint in datapoints:
+        slots_by_station.setdefault(datapoint.station_arso_code, []).extend(
+            slots_of(datapoint.interval_start, datapoint.interval_end))
+
+    bitmaps = {}
+    for station, slots in slots_by_station.items():
+        slots = np.unique(np.array(slots, dtype=np.int64))
+        months = (slots * SLOT_SECONDS).astype("datetime64[s]").astype("datetime64[M]")
+        for month in np.unique(months):
+            month = month.astype(datetime.date)
+            bits = np.zeros(MONTH_SLOTS, dtype=bool)
+            month_slots = slots[months == np.datetime64(month, "M")]
+            bits[month_slots - _month_first_slot(month)] = True
+            bitmaps[(station, month)] = bits
+    return bitmaps
+
+
+def to_bit_string(bits: np.ndarray) -> str:
+    return (np.asarray(bits, dtype=np.uint8) + ord("0")).tobytes().decode("ascii")
+
+
+def from_bit_string(s: str) -> np.ndarray:
+    return np.frombuffer(s.encode("ascii"), dtype=np.uint8) == ord("1")
+
+
+def mark_coverage(cursor, datapoints: Iterable):
+    """ORs the slots covered by the datapoints into station_coverage."""
+    cursor.executemany(UPSERT_COVERAGE_SQL, [
+        (station, month, to_bit_string(bits))
+        for (station, month), bits in sorted(month_bitmaps(datapoints).items())
+    ])
+
+
+def assemble(rows: Iterable[tuple[datetime.date, np.ndarray]], first_slot: int, end_slot: int) -> np.ndarray:
+    """Bitmap of slots [first_slot, end_slot) from monthly bitmaps, months without a row are uncovered."""
+    covered = np.zeros(max(0, end_slot - first_slot), dtype=bool)
+    for month, bits in rows:
+        month_first = _month_first_slot(month)
+        bits = bits[:_month_slots(month)]
+        lo, hi = max(first_slot, month_first), min(end_slot, month_first + len(bits))
+        if lo < hi:
+            covered[lo - first_slot:hi - first_slot] = bits[lo - month_first:hi - month_first]
+    return covered
+
+
+def find_gaps(covered: np.ndarray, first_slot: int = 0) -> list[tuple[int, int]]:
+    """Runs of uncovered slots as [start, end) slot ranges."""
+    edges = np.diff(np.concatenate(([1], covered.astype(np.int8), [1])))
+    starts = np.flatnonzero(edges == -1)
+    ends = np.flatnonzero(edges == 1)
+    return [(first_slot + int(start), first_slot + int(end)) for start, end in zip(starts, ends)]
+
+
+def fetch_coverage(conn, start: datetime.datetime, end: datetime.datetime,
+                   stations: Optional[list[str]] = None) -> dict[str, list[tuple[datetime.date, np.ndarray]]]:
+    """Monthly bitmaps per station of months overlapping [start, end)."""
+    rows = conn.execute("""
+        SELECT station_arso_code, month, slots::text
+        FROM station_coverage
+        WHERE month >= %s AND month <= %s AND (%s::text[] IS NULL OR station_arso_code = ANY(%s))
+        ORDER BY station_arso_code, month
+    """, (month_of(start), month_of(end), stations, stations)).fetchall()
+    by_station = {}
+    for station, month, slots in rows:
+        by_station.setdefault(station, []).append((month, from_bit_string(slots)))
+    return by_station
+
+
+def station_gaps(conn, start: datetime.datetime, end: datetime.datetime,
+                 stations: Optional[list[str]] = None) -> dict[str, tuple[int, int, list[tuple[int, int]]]]:
+    """Covered slots, slots since the station's first covered slot and gaps per station in [start, end).
+
+    Slots before a station's first covered one are not counted, the station didn't report yet."""
+    first_slot, end_slot = slot_of(start), slot_of(end)
+    result = {}
+    for station, rows in fetch_coverage(conn, start, end, stations).items():
+        covered = assemble(rows, first_slot, end_slot)
+        reported = np.flatnonzero(covered)
+        if len(reported) == 0:
+            continue
+        covered = covered[reported[0]:]
+        result[station] = (int(covered.sum()), len(covered), find_gaps(covered, first_slot + int(reported[0])))
+    return result
+
+
+def _watermark(conn) -> Optional[datetime.datetime]:
+    """interval_end of the newest datapoint of any station, slots after it aren't expected yet."""
+    watermark = conn.execute("SELECT MAX(interval_end) FROM station_latest").fetchone()[0]
+    # Stored without a time zone, in UTC.
+    return watermark.replace(tzinfo=datetime.timezone.utc) if watermark is not None else None
+
+
+def report(conn, start: Optional[datetime.datetime], end: Optional[datetime.datetime], min_slots: int = 1):
+    if start is None:
+        first_month = conn.execute("SELECT MIN(month) FROM station_coverage").fetchone()[0]
+        start = datetime.datetime(first_month.year, first_month.month, 1) if first_month is not None else None
+    end = end if end is not None else _watermark(conn)
+    if start is None or end is None:
+        print("No datapoints")
+        return
+    for station, (covered, slots, gaps) in sorted(station_gaps(conn, start, end).items()):
+        gaps = [gap for gap in gaps if gap[1] - gap[0] >= min_slots]
+        print(f"{station}: {covered / slots:.2%} of {slots} slots covered, {len(gaps)} gaps")
+        for gap_start, gap_end in gaps:
+            print(f"  {slot_time(gap_start).isoformat()} - {slot_time(gap_end).isoformat()}"
+                  f" ({gap_end - gap_start} slots)")
+
+
+def recoverable_stations(conn, now: datetime.datetime) -> list[str]:
+    """Stations with missing slots their history XML still contains.
+
+    Only stations which reported within the window are checked, stations which stopped
+    reporting earlier can't be recovered by a refetch."""
+    end = _watermark(conn)
+    start = now - datetime.timedelta(seconds=RECOVERABLE_SECONDS)
+    if end is None or end <= start:
+        return []
+    active = [row[0] for row in conn.execute(
+        "SELECT station_arso_code FROM station_latest WHERE interval_end > %s", (start.replace(tzinfo=None),))]
+    first_slot, end_slot = slot_of(start), slot_of(end)
+    rows = fetch_coverage(conn, start, end, active)
+    return [station for station in active
+            if not assemble(rows.get(station, []), first_slot, end_slot).all()]
+
+
+def refetch(stations: list[str]) -> int:
+    """Crawls the history XMLs of the stations. Returns the exit status of the crawl."""
+    return subprocess.call(
+        [sys.executable, "-m", "scrapy", "crawl", "weather_stations", "-a", f"stations={','.join(stations)}"])
+
+
+def main(command: str, start: Optional[datetime.datetime] = None, end: Optional[datetime.datetime] = None,
+         min_slots: int = 1, dry_run: bool = False):
+    from data_pipeline import db
+
+    with db.connect() as conn:
+        if command == "report":
+            report(conn, start, end, min_slots)
+            return
+        stations = recoverable_stations(conn, datetime.datetime.now(tz=datetime.timezone.utc))
+
+    if not stations:
+        print("No recoverable gaps")
+        return
+    print(f"Refetching history of {len(stations)} stations: {', '.join(stations)}")
+    if not dry_run:
+        status = refetch(stations)
+        if status:
+            sys.exit(f"Crawl failed with exit status {status}")
@@ -0,0 +1,206 @@
+"""Writer of datapoint batches for incremental loads.
+
+Each batch is one transaction on a pooled connection (see db.get_pool) in pipeline mode:
+statements are sent without waiting for each other's results and rows are sent with
+executemany, so a batch costs a few network round trips instead of one per datapoint.
+Pooled connections prepare statements on first use.
+
+Next to datapoints, a batch updates station_latest, the coverage index (see coverage.py)
+and the climatology of datapoints it inserted (see climatology.py), queues rollup updates, notifies readers (see api.py) and saves the checkpoint of the file
+it's from (see checkpoints.py), all in the same transaction. Rollup updates are only queued
+when the rollup tables exist (schema_06_rollups.sql).
+
+When weather_datapoints is partitioned, datapoints are upserted directly into the monthly
+partitions of their interval_start, which are created first if missing (see partitions.py).
+"""
+
+import datetime
+import functools
+from typing import Iterable, Optional
+
+from data_pipeline import climatology, coverage, db, partitions
+from data_pipeline.checkpoints import FileCheckpoint
+from data_pipeline.models import Datapoint
+from data_pipeline.quality import QC_VARIABLES
+
+# qc_flags of an updated datapoint are cleared when any screened value changes, they're recomputed
+# by the next `slo-weather qc` run (see quality.py).
+UPSERT_DATAPOINT_SQL = f"""
+    INSERT INTO weather_datapoints AS d (
+        station_arso_code,
+        sunrise,
+        sunset,
+        interval_start,
+        interval_end,
+        temperature_dew_point,
+        temperature_air_avg,
+        temperature_air_max,
+        temperature_air_min,
+        humidity_relative_avg,
+        wind_direction_avg,
+        wind_direction_max_gust,
+        wind_speed_avg,
+        wind_speed_max,
+        pressure_mean_sea_level_avg,
+        pressure_surface_level_avg,
+        precipitation_sum_10min,
+        precipitation_sum_1h,
+        precipitation_sum_24h,
+        snow_cover_height,
+        sun_radiation_global_avg,
+        sun_radiation_diffuse_avg,
+        visibility
+    ) VALUES (
+        %(station_arso_code)s,
+        %(sunrise)s,
+        %(sunset)s,
+        %(interval_start)s,
+        %(interval_end)s,
+        %(temperature_dew_point)s,
+        %(temperature_air_avg)s,
+        %(temperature_air_max)s,
+        %(temperature_air_min)s,
+        %(humidity_relative_avg)s,
+        %(wind_direction_avg)s,
+        %(wind_direction_max_gust)s,
+        %(wind_speed_avg)s,
+        %(wind_speed_max)s,
+        %(pressure_mean_sea_level_avg)s,
+        %(pressure_surface_level_avg)s,
+        %(precipitation_sum_10min)s,
+        %(precipitation_sum_1h)s,
+        %(precipitation_sum_24h)s,
+        %(snow_cover_height)s,
+        %(sun_radiation_global_avg)s,
+        %(sun_radiation_diffuse_avg)s,
+        %(visibility)s
+    ) ON CONFLICT (station_arso_code, interval_start, interval_end) DO UPDATE SET
+        sunrise = excluded.sunrise,
+        sunset = excluded.sunset,
+        temperature_dew_point = excluded.temperature_dew_point,
+        temperature_air_avg = excluded.temperature_air_avg,
+        temperature_air_max = excluded.temperature_air_max,
+        temperature_air_min = excluded.temperature_air_min,
+        humidity_relative_avg = excluded.humidity_relative_avg,
+        wind_direction_avg = excluded.wind_direction_avg,
+        wind_direction_max_gust = excluded.wind_direction_max_gust,
+        wind_speed_avg = excluded.wind_speed_avg,
+        wind_speed_max = excluded.wind_speed_max,
+        pressure_mean_sea_level_avg = excluded.pressure_mean_sea_level_avg,
+        pressure_surface_level_avg = excluded.pressure_surface_level_avg,
+        precipitation_sum_10min = excluded.precipitation_sum_10min,
+        precipitation_sum_1h = excluded.precipitation_sum_1h,
+        precipitation_sum_24h = excluded.precipitation_sum_24h,
+        snow_cover_height = excluded.snow_cover_height,
+        sun_radiation_global_avg = excluded.sun_radiation_global_avg,
+        sun_radiation_diffuse_avg = excluded.sun_radiation_diffuse_avg,
+        visibility = excluded.visibility,
+        qc_flags = CASE
+            WHEN ({", ".join(f"d.{c}" for c in QC_VARIABLES)}) IS NOT DISTINCT FROM ({", ".join(f"excluded.{c}" for c in QC_VARIABLES)})
+            THEN d.qc_flags
+        END
+    RETURNING (xmax = 0) AS inserted
+    """
+
+
+
+@functools.lru_cache(maxsize=None)
+def upsert_datapoint_sql(table: str) -> str:
+    """UPSERT_DATAPOINT_SQL into a partition of weather_datapoints."""
+    return UPSERT_DATAPOINT_SQL.replace("INSERT INTO weather_datapoints AS d (", f'INSERT INTO "{table}" AS d (', 1)
+
+
+STATION_LATEST_COLUMNS = list(Datapoint.model_fields)
+_station_latest_value_columns = [c for c in STATION_LATEST_COLUMNS if c != "station_arso_code"]
+
+# Replaces the station's row in station_latest, unless it already has a newer interval_end.
+UPSERT_STATION_LATEST_SQL = f"""
+    INSERT INTO station_latest ({", ".join(STATION_LATEST_COLUMNS)})
+    VALUES ({", ".join(f"%({c})s" for c in STATION_LATEST_COLUMNS)})
+    ON CONFLICT (station_arso_code) DO UPDATE SET
+        {", ".join(f"{c} = excluded.{c}" for c in _station_latest_value_columns)}
+    WHERE (station_latest.interval_end, station_latest.interval_start)
+        <= (excluded.interval_end, excluded.interval_start)
+"""
+
+
+def summarize(datapoints: Iterable[Datapoint]) -> tuple[dict[str, Datapoint],
+                                                        dict[str, tuple[datetime.datetime, datetime.datetime]]]:
+    """Newest datapoint (by interval_end, then interval_start) and range of interval_starts of each station."""
+    latest = {}
+    ranges = {}
+    for datapoint in datapoints:
+        station = datapoint.station_arso_code
+        newest = latest.get(station)
+        if newest is None or ((newest.interval_end, newest.interval_start)
+                              <= (datapoint.interval_end, datapoint.interval_start)):
+            latest[station] = datapoint
+        station_range = ranges.get(station)
+        if station_range is None:
+            ranges[station] = (datapoint.interval_start, datapoint.interval_start)
+        else:
+            ranges[station] = (min(station_range[0], datapoint.interval_start),
+                               max(station_range[1], datapoint.interval_start))
+    return latest, ranges
+
+
+def group_by_partition(datapoints: Iterable[Datapoint]) -> dict[datetime.date, list[Datapoint]]:
+    by_month = {}
+    for datapoint in datapoints:
+        by_month.setdefault(partitions.month_of(datapoint.interval_start), []).append(datapoint)
+    return by_month
+
+
+def _returned_flags(cursor) -> list[bool]:
+    """First column of the row each statement of executemany(..., returning=True) returned."""
+    flags = []
+    while True:
+        flags.extend(row[0] for row in cursor.fetchall())
+        if not cursor.nextset():
+            return flags
+
+
+class DatapointWriter:
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else db.get_pool()
+        self._partitioned = None
+        self._rollups = None
+
+    def _upserts(self, datapoints: list[Datapoint]) -> list[tuple[str, list[Datapoint]]]:
+        """Upsert queries with their datapoints, one per partition when the table is partitioned."""
+        with self.pool.connection() as conn:
+            if self._partitioned is None:
+                self._partitioned = partitions.is_partitioned(conn)
+                self._rollups = db.table_exists(conn, "weather_rollups_dirty")
+            if not self._partitioned:
+                return [(UPSERT_DATAPOINT_SQL, datapoints)]
+            by_month = group_by_partition(datapoints)
+            partitions.ensure_partitions(conn, by_month.keys())
+        return [(upsert_datapoint_sql(partitions.partition_name(month)), month_datapoints)
+                for month, month_datapoints in sorted(by_month.items())]
+
+    def write(self, datapoints: list[Datapoint], checkpoint: Optional[FileCheckpoint] = None):
+        """Upserts the datapoints in one transaction, which also saves the checkpoint if given."""
+        if not datapoints:
+            if checkpoint is not None:
+                with self.pool.connection() as conn, conn.cursor() as cur:
+                    checkpoint.save(cur)
+            return
+        latest, ranges = summarize(datapoints)
+        upserts = self._upserts(datapoints)
+        with self.pool.connection() as conn:
+            # The pool commits when the block exits, or rolls back on an exception.
+            with conn.pipeline(), conn.cursor() as cur:
+                inserted = []
+                for query, query_datapoints in upserts:
+                    cur.executemany(query, [datapoint.model_dump() for datapoint in query_datapoints], returning=True)
+                    inserted.extend(d for d, is_inserted in zip(query_datapoints, _returned_flags(cur)) if is_inserted)
+                cur.executemany(UPSERT_STATION_LATEST_SQL, [datapoint.model_dump() for datapoint in latest.values()])
+                coverage.mark_coverage(cur, datapoints)
+                climatology.mark_climatology(cur, inserted)
+                if self._rollups:
+                    db.mark_rollups_dirty(cur, ranges)
+                db.notify_datapoints_changed(cur, latest.keys(), min(start for start, _ in ranges.values()),
+                                             max(datapoint.interval_end for datapoint in latest.values()))
+                if checkpoint is not None:
+                    checkpoint.save(cur)
@@ -0,0 +1,39 @@
+"""Export of deduplicated datapoints from the archive to CSV."""
+
+import csv
+import datetime
+from typing import Iterable, Optional, TextIO
+
+from data_pipeline.archive_index import iter_datapoints
+from data_pipeline.models import Datapoint
+
+CSV_COLUMNS = list(Datapoint.model_fields.keys())
+
+
+def export_csv(fp: TextIO,
+               stations: Optional[Iterable[str]] = None,
+               start: Optional[datetime.datetime] = None,
+               end: Optional[datetime.datetime] = None,
+               data_dir: Optional[str] = None) -> int:
+    """Writes datapoints matching the filters (see iter_datapoints) as CSV, sorted by station and time.
+
+    When the same interval appears in several archive files, the newest version is kept.
+    Returns the number of written rows."""
+    datapoints = {}
+    for datapoint in iter_datapoints(stations, start, end, data_dir):
+        datapoints[(datapoint.station_arso_code, datapoint.interval_start, datapoint.interval_end)] = datapoint
+    return write_csv(fp, (datapoints[key] for key in sorted(datapoints)))
+
+
+def write_csv(fp: TextIO, datapoints: Iterable[Datapoint]) -> int:
+    """Writes the datapoints as CSV with a header row. Returns the number of written rows."""
+    writer = csv.writer(fp)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for d in datapoints:
+        writer.writerow([
+            value.isoformat() if isinstance(value, datetime.datetime) else value
+            for value in (getattr(d, column) for column in CSV_COLUMNS)
+        ])
+        count += 1
+    return count
@@ -0,0 +1,243 @@
+"""Deduplication of the whole meteo archive in bounded memory, for full rebuilds.
+
+Datapoints parsed from archive files are spilled into sorted runs on disk: fixed-size
+binary records (the parse cache's record layout plus a sequence number), sorted by
+(station, interval_start, interval_end) before writing. Runs are then merged k ways.
+Of the records with the same key, which is the key loaders upsert on, the one with the
+highest sequence number wins: files are read oldest first, so that's the version from the
+newest scrape, as if every file was upserted in order.
+
+Memory is bounded by the run size (SLO_WEATHER_DEDUP_RUN_RECORDS datapoints, default
+250000) and the merge fan-in, not by the size of the archive. Runs are written to a
+temporary directory in the data dir (SLO_WEATHER_DEDUP_TMP_DIR overrides it), which needs
+room for all parsed datapoints, about 200 bytes each.
+
+Deduplicated datapoints stream, sorted by key, into a sink: the database (write_to_db)
+or a CSV file (see export.write_csv).
+
+Usage: slo-weather ingest --mode external
+"""
+
+import datetime
+import heapq
+import math
+import os
+import struct
+import tempfile
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+
+from data_pipeline.compaction import read_rows_until_truncated
+from data_pipeline.models import Datapoint
+from data_pipeline.parse_cache import (
+    DATETIME_FIELDS,
+    FLOAT_FIELDS,
+    ParseCache,
+    _timezone,
+    cached_xml_to_datapoints,
+    get_parse_cache,
+)
+from data_pipeline.paths_util import get_data_dir
+
+DEFAULT_RUN_RECORDS = 250000
+RUN_RECORDS = int(os.environ.get("SLO_WEATHER_DEDUP_RUN_RECORDS", DEFAULT_RUN_RECORDS))
+# Runs merged at once, more are first merged into longer runs.
+MAX_FAN_IN = 64
+# Records read from a run at a time.
+READ_RECORDS = 4096
+DB_BATCH_SIZE = 10000
+
+# Station index, (epoch seconds, UTC offset in minutes) for every datetime, float for every value, sequence number.
+_record = struct.Struct("<H" + "qh" * len(DATETIME_FIELDS) + "d" * len(FLOAT_FIELDS) + "Q")
+_INTERVAL_START = 1 + 2 * DATETIME_FIELDS.index("interval_start")
+_INTERVAL_END = 1 + 2 * DATETIME_FIELDS.index("interval_end")
+
+
+class Stations:
+    """Indexes of station codes in records, shared by all runs of a dedup."""
+
+    def __init__(self):
+        self.codes = []
+        self._indexes = {}
+
+    def index(self, code: str) -> int:
+        i = self._indexes.get(code)
+        if i is None:
+            i = self._indexes[code] = len(self.codes)
+            self.codes.append(code)
+        return i
+
+
+def encode_record(datapoint: Datapoint, station: int, sequence: int) -> tuple:
+    values = [station]
+    for name in DATETIME_FIELDS:
+        dt = getattr(datapoint, name)
+        values.append(int(dt.timestamp()))
+        values.append(int(dt.utcoffset().total_seconds()) // 60)
+    for name in FLOAT_FIELDS:
+        value = getattr(datapoint, name)
+        values.append(math.nan if value is None else value)
+    values.append(sequence)
+    return tuple(values)
+
+
+def decode_record(values: tuple, stations: Stations) -> Datapoint:
+    d = {"station_arso_code": stations.codes[values[0]]}
+    i = 1
+    for name in DATETIME_FIELDS:
+        d[name] = datetime.datetime.fromtimestamp(values[i], tz=_timezone(values[i + 1]))
+        i += 2
+    for name in FLOAT_FIELDS:
+        value = values[i]
+        d[name] = None if math.isnan(value) else value
+        i += 1
+    return Datapoint.model_construct(**d)
+
+
+def _key_function(stations: Stations) -> Callable[[tuple], tuple]:
+    codes = stations.codes
+    return lambda values: (codes[values[0]], values[_INTERVAL_START], values[_INTERVAL_END], values[-1])
+
+
+def _same_datapoint(a: tuple, b: tuple) -> bool:
+    return a[0] == b[0] and a[_INTERVAL_START] == b[_INTERVAL_START] and a[_INTERVAL_END] == b[_INTERVAL_END]
+
+
+def write_run(records: list[tuple], fp: BinaryIO):
+    """Writes records given as (key, packed record), sorted by key."""
+    records.sort()
+    fp.write(b"".join(record for _, record in records))
+
+
+def read_run(fp: BinaryIO) -> Iterator[tuple]:
+    fp.seek(0)
+    while True:
+        data = fp.read(READ_RECORDS * _record.size)
+        if not data:
+            return
+        yield from _record.iter_unpack(data)
+
+
+class RunSpiller:
+    """Collects records and writes them out as sorted runs of at most run_records."""
+
+    def __init__(self, tmp_dir: str, stations: Stations, run_records: int = RUN_RECORDS):
+        self.tmp_dir = tmp_dir
+        self.stations = stations
+        self.run_records = run_records
+        self.key = _key_function(stations)
+        self.runs = []
+        self.records = 0
+        self._buffer = []
+
+    def _new_run(self) -> BinaryIO:
+        fp = open(os.path.join(self.tmp_dir, f"{len(self.runs)}.run"), mode="w+b")
+        self.runs.append(fp)
+        return fp
+
+    def add(self, datapoint: Datapoint):
+        values = encode_record(datapoint, self.stations.index(datapoint.station_arso_code), self.records)
+        # Packed right away, a tuple of all values takes several times more memory.
+        self._buffer.append((self.key(values), _record.pack(*values)))
+        self.records += 1
+        if len(self._buffer) >= self.run_records:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            write_run(self._buffer, self._new_run())
+            self._buffer = []
+
+    def merged(self) -> Iterator[tuple]:
+        """All records sorted by key, merging runs in passes of at most MAX_FAN_IN."""
+        self.flush()
+        runs = list(self.runs)
+        while len(runs) > MAX_FAN_IN:
+            merged_runs = []
+            for i in range(0, len(runs), MAX_FAN_IN):
+                group = runs[i:i + MAX_FAN_IN]
+                fp = self._new_run()
+                for values in heapq.merge(*map(read_run, group), key=self.key):
+                    fp.write(_record.pack(*values))
+                for run in group:
+                    run.close()
+                    os.remove(run.name)
+                merged_runs.append(fp)
+            runs = merged_runs
+        yield from heapq.merge(*map(read_run, runs), key=self.key)
+
+    def close(self):
+        for fp in self.runs:
+            fp.close()
+
+
+def newest(records: Iterable[tuple]) -> Iterator[tuple]:
+    """Last record of each run of records with the same key, records sorted by key and sequence."""
+    previous = None
+    for values in records:
+        if previous is not None and not _same_datapoint(previous, values):
+            yield previous
+        previous = values
+    if previous is not None:
+        yield previous
+
+
+def archive_datapoints(paths: Iterable[str], cache: Optional[ParseCache] = None) -> Iterator[Datapoint]:
+    """Datapoints of the archive files in order, rows before the end of truncated files included."""
+    for path in paths:
+        print("Reading", path)
+        rows, error = read_rows_until_truncated(path)
+        if error is not None:
+            print(f"Failed to read {path}: {error}")
+        for row in rows:
+            yield from cached_xml_to_datapoints(row["xml"], cache)
+
+
+def deduplicated(datapoints: Iterable[Datapoint], tmp_dir: Optional[str] = None,
+                 run_records: int = RUN_RECORDS) -> Iterator[Datapoint]:
+    """The last of the datapoints with each (station, interval_start, interval_end), sorted by it."""
+    stations = Stations()
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        spiller = RunSpiller(run_dir, stations, run_records)
+        try:
+            for datapoint in datapoints:
+                spiller.add(datapoint)
+            spiller.flush()
+            print(f"Spilled {spiller.records} datapoints into {len(spiller.runs)} runs")
+            for values in newest(spiller.merged()):
+                yield decode_record(values, stations)
+        finally:
+            spiller.close()
+
+
+def write_to_db(datapoints: Iterable[Datapoint], batch_size: int = DB_BATCH_SIZE) -> int:
+    """Upserts the datapoints in batches. Returns their number."""
+    from data_pipeline.datapoint_writer import DatapointWriter
+
+    writer = DatapointWriter()
+    count = 0
+    batch = []
+    for datapoint in datapoints:
+        batch.append(datapoint)
+        if len(batch) >= batch_size:
+            writer.write(batch)
+            count += len(batch)
+            batch = []
+    writer.write(batch)
+    return count + len(batch)
+
+
+def main(output: Optional[str] = None):
+    """Rebuilds from the whole archive, into the database or a CSV file if output is given."""
+    from data_pipeline.archive_util import get_input_files_list
+
+    data_dir = get_data_dir()
+    tmp_dir = os.environ.get("SLO_WEATHER_DEDUP_TMP_DIR") or data_dir
+    datapoints = deduplicated(archive_datapoints(get_input_files_list(data_dir), get_parse_cache()), tmp_dir)
+    if output is None:
+        count = write_to_db(datapoints)
+    else:
+        from data_pipeline.export import write_csv
+
+        with open(output, mode="w", newline="") as fp:
+            count = write_csv(fp, datapoints)
+    print(f"Wrote {count} deduplicated datapoints")
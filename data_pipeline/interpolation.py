@@ -0,0 +1,240 @@
+"""Interpolation of station values onto a regular grid over Slovenia.
+
+Input are [time x station] matrices written by rust_data_pipeline's dump_binary
+(data_descriptor.json, precipitation.bin, temperature.bin). Output are memory-mapped
+[time x lat x lon] cubes in .npy format, so map animations can read any frame without
+recomputing it:
+
+    cube = numpy.load("data/grids/precipitation.npy", mmap_mode="r")
+
+Values are interpolated with inverse distance weighting from the k nearest stations.
+Temperatures are first reduced to sea level with a constant lapse rate, interpolated,
+and raised back to the elevation of each grid cell.
+
+Weights depend only on the station set and the grid, so they are computed once into a
+sparse [cell x station] matrix with k weights per cell, finding the nearest stations with
+a KD-tree. Interpolating a block of timesteps is then one sparse matrix product for the
+weighted sum and one for the sum of weights of stations with values, which renormalizes
+the weights when some stations are missing a value. Memory and time grow with cells x k,
+not with cells x stations.
+
+Usage: slo-weather grids [--input-dir DIR] [--step DEGREES]
+"""
+
+import datetime
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from data_pipeline.paths_util import get_data_dir
+
+DEFAULT_NEIGHBOURS = 8
+DEFAULT_POWER = 2.0
+LAPSE_RATE = 0.0065  # K/m, standard atmosphere
+TIME_BLOCK = 512
+
+_KM_PER_DEGREE_LAT = 110.574
+_KM_PER_DEGREE_LON_AT_EQUATOR = 111.320
+# Stations closer than this to a cell centre get the weight of this distance, which avoids division by zero.
+_MIN_DISTANCE_KM = 0.01
+
+
+@dataclass(frozen=True)
+class Grid:
+    """Cell centres from (lon_min, lat_min) to (lon_max, lat_max), step degrees apart."""
+
+    lon_min: float
+    lat_min: float
+    lon_max: float
+    lat_max: float
+    step: float
+
+    @property
+    def lons(self) -> np.ndarray:
+        return self.lon_min + self.step * np.arange(round((self.lon_max - self.lon_min) / self.step) + 1)
+
+    @property
+    def lats(self) -> np.ndarray:
+        return self.lat_min + self.step * np.arange(round((self.lat_max - self.lat_min) / self.step) + 1)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return len(self.lats), len(self.lons)
+
+    def cell_coordinates(self) -> tuple[np.ndarray, np.ndarray]:
+        """Latitudes and longitudes of all cells, flattened in row-major order."""
+        lons, lats = np.meshgrid(self.lons, self.lats)
+        return lats.ravel(), lons.ravel()
+
+
+SLOVENIA_GRID = Grid(lon_min=13.35, lat_min=45.40, lon_max=16.65, lat_max=46.90, step=0.01)
+
+
+def to_km(lats: np.ndarray, lons: np.ndarray, lat_0: float) -> np.ndarray:
+    """Equirectangular projection around lat_0, as [n x 2] (x, y) in km. Accurate enough at the scale of Slovenia."""
+    x = np.asarray(lons, dtype=np.float64) * _KM_PER_DEGREE_LON_AT_EQUATOR * np.cos(np.radians(lat_0))
+    y = np.asarray(lats, dtype=np.float64) * _KM_PER_DEGREE_LAT
+    return np.column_stack((x, y))
+
+
+def nearest_neighbours(points: np.ndarray, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Indexes of and distances to the k nearest points of each query, both [query x k]."""
+    k = min(k, len(points))
+    distances, indexes = cKDTree(points).query(queries, k=k)
+    # query drops the k axis when k is 1.
+    return indexes.reshape(len(queries), k), distances.reshape(len(queries), k)
+
+
+def idw_weights(station_lats: np.ndarray, station_lons: np.ndarray, grid: Grid,
+                k: int = DEFAULT_NEIGHBOURS, power: float = DEFAULT_POWER) -> sparse.csr_matrix:
+    """Sparse [cell x station] matrix of inverse distance weights of each cell's k nearest stations.
+
+    Stations without coordinates (NaN) get no weight."""
+    cell_lats, cell_lons = grid.cell_coordinates()
+    lat_0 = (grid.lat_min + grid.lat_max) / 2
+    shape = (len(cell_lats), len(station_lats))
+
+    located = np.flatnonzero(~(np.isnan(station_lats) | np.isnan(station_lons)))
+    if len(located) == 0:
+        return sparse.csr_matrix(shape, dtype=np.float32)
+    indexes, distances = nearest_neighbours(
+        to_km(station_lats[located], station_lons[located], lat_0),
+        to_km(cell_lats, cell_lons, lat_0),
+        k,
+    )
+    weights = (np.maximum(distances, _MIN_DISTANCE_KM) ** -power).astype(np.float32)
+    # Row i holds the k weights of cell i, already in CSR order.
+    indptr = np.arange(0, indexes.size + 1, indexes.shape[1])
+    return sparse.csr_matrix((weights.ravel(), located[indexes.ravel()], indptr), shape=shape)
+
+
+def interpolate(values: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+    """[time x cell] interpolated values of a [time x station] matrix. NaN marks missing values.
+
+    Cells whose neighbouring stations all miss a value are NaN."""
+    present = ~np.isnan(values)
+    weighted_sum = (weights @ np.where(present, values, 0).astype(np.float32).T).T
+    weight_sum = (weights @ present.astype(np.float32).T).T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(weight_sum > 0, weighted_sum / weight_sum, np.nan).astype(np.float32)
+
+
+def interpolate_temperature(values: np.ndarray, weights: sparse.csr_matrix, station_altitudes: np.ndarray,
+                            cell_elevations: np.ndarray, lapse_rate: float = LAPSE_RATE) -> np.ndarray:
+    """Like interpolate, interpolating sea level temperatures and adjusting them to cell elevations."""
+    sea_level = values + lapse_rate * station_altitudes.astype(np.float32)
+    return interpolate(sea_level, weights) - np.float32(lapse_rate) * cell_elevations.astype(np.float32)
+
+
+def station_elevation_surface(station_altitudes: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+    """Cell elevations interpolated from station altitudes, used when no elevation model is given.
+
+    Smooths out valleys and peaks, so it only corrects for the broad altitude differences between stations."""
+    return interpolate(station_altitudes[None, :], weights)[0]
+
+
+def weights_cache_path(cache_dir: str, station_lats: np.ndarray, station_lons: np.ndarray, grid: Grid,
+                       k: int, power: float) -> str:
+    key = hashlib.blake2b(digest_size=16)
+    key.update(np.ascontiguousarray(station_lats, dtype=np.float64).tobytes())
+    key.update(np.ascontiguousarray(station_lons, dtype=np.float64).tobytes())
+    key.update(json.dumps([asdict(grid), k, power]).encode("utf-8"))
+    return os.path.join(cache_dir, f"weights_{key.hexdigest()}.npz")
+
+
+def load_or_build_weights(cache_dir: str, station_lats: np.ndarray, station_lons: np.ndarray, grid: Grid,
+                          k: int = DEFAULT_NEIGHBOURS, power: float = DEFAULT_POWER) -> sparse.csr_matrix:
+    """idw_weights, stored in cache_dir for the next run with the same stations and grid."""
+    path = weights_cache_path(cache_dir, station_lats, station_lons, grid, k, power)
+    try:
+        return sparse.load_npz(path).tocsr()
+    except FileNotFoundError:
+        pass
+    weights = idw_weights(station_lats, station_lons, grid, k, power)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    sparse.save_npz(tmp_path, weights)
+    os.replace(tmp_path, path)
+    return weights
+
+
+def write_cube(path: str, values: np.ndarray, grid: Grid, interpolate_block, descriptor: dict) -> np.ndarray:
+    """Interpolates [time x station] values block by block into a memory-mapped .npy [time x lat x lon] cube.
+
+    interpolate_block maps a [time x station] block to [time x cell]. The descriptor is
+    written next to the cube as <path>.json."""
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    cube = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(len(values), *grid.shape))
+    for i in range(0, len(values), TIME_BLOCK):
+        block = np.asarray(values[i:i + TIME_BLOCK], dtype=np.float32)
+        cube[i:i + len(block)] = interpolate_block(block).reshape(len(block), *grid.shape)
+    cube.flush()
+    del cube
+    os.replace(tmp_path, path)
+
+    with open(f"{path}.json", mode="w") as fp:
+        json.dump({**descriptor, "grid": asdict(grid), "shape": [len(values), *grid.shape]}, fp, indent=2)
+    return np.load(path, mmap_mode="r")
+
+
+def read_station_matrix(input_dir: str, name: str) -> tuple[dict, np.ndarray]:
+    """dump_binary's descriptor and its [time x station] matrix of the variable, memory-mapped."""
+    with open(os.path.join(input_dir, "data_descriptor.json")) as fp:
+        descriptor = json.load(fp)
+    matrix = np.memmap(os.path.join(input_dir, f"{name}.bin"), dtype="<f4", mode="r",
+                       shape=(descriptor["rows"], descriptor["columns"]))
+    # Columns after the last station are unused.
+    return descriptor, matrix[:, :len(descriptor["stations"])]
+
+
+def station_locations(codes: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Latitudes, longitudes and altitudes of the stations from the database, NaN for unknown stations."""
+    from data_pipeline import db
+
+    with db.connect() as conn:
+        rows = conn.execute(
+            "SELECT arso_code, latitude, longitude, altitude FROM stations WHERE arso_code = ANY(%s)", (codes,)
+        ).fetchall()
+    by_code = {code: (lat, lon, altitude) for code, lat, lon, altitude in rows}
+    locations = np.array([by_code.get(code, (np.nan, np.nan, np.nan)) for code in codes], dtype=np.float64)
+    return locations[:, 0], locations[:, 1], locations[:, 2]
+
+
+def main(input_dir: Optional[str] = None, grid: Grid = SLOVENIA_GRID, elevation_path: Optional[str] = None):
+    input_dir = input_dir or get_data_dir()
+    output_dir = os.path.join(get_data_dir(), "grids")
+    os.makedirs(output_dir, exist_ok=True)
+
+    descriptor, precipitation = read_station_matrix(input_dir, "precipitation")
+    _, temperature = read_station_matrix(input_dir, "temperature")
+    lats, lons, altitudes = station_locations(descriptor["stations"])
+    print(f"Located {np.count_nonzero(~np.isnan(lats))} of {len(lats)} stations")
+
+    weights = load_or_build_weights(output_dir, lats, lons, grid)
+    if elevation_path is not None:
+        elevations = np.load(elevation_path).astype(np.float32).ravel()
+    else:
+        elevations = station_elevation_surface(np.nan_to_num(altitudes), weights)
+
+    cube_descriptor = {
+        "start": descriptor["start"],
+        "step": str(datetime.timedelta(hours=1)),
+        "created_at": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+    }
+    cube = write_cube(os.path.join(output_dir, "precipitation.npy"), precipitation, grid,
+                      lambda block: interpolate(block, weights), {**cube_descriptor, "variable": "precipitation_sum_1h"})
+    print("Wrote precipitation cube", cube.shape)
+    cube = write_cube(os.path.join(output_dir, "temperature.npy"), temperature, grid,
+                      lambda block: interpolate_temperature(block, weights, altitudes, elevations),
+                      {**cube_descriptor, "variable": "temperature_air_avg"})
+    print("Wrote temperature cube", cube.shape)
+
+
+if __name__ == "__main__":
+    main()
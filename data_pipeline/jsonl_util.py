@@ -4,13 +4,13 @@ import gzip
 import json
 from typing import Any, List
 
-from scrapy.utils.serialize import ScrapyJSONEncoder
-
 
 def read_jsonl(path: str) -> List[Any]:
     """Reads a JSONL file into a list."""
 
-    if path.endswith(".gz"):
+    if path.endswith(".zst"):
+        return parse_jsonl(read_bytes(path))
+    elif path.endswith(".gz"):
         with gzip.open(path, mode="r") as fp:
             return [json.loads(line) for line in fp]
     else:
@@ -18,8 +18,32 @@ def read_jsonl(path: str) -> List[Any]:
             return [json.loads(line) for line in fp]
 
 
+def read_bytes(path: str) -> bytes:
+    """Reads the whole (decompressed) content of a JSONL file."""
+
+    if path.endswith(".zst"):
+        # Imported here, only needed for recompressed archives.
+        from data_pipeline import archive_codec
+
+        return archive_codec.read_bytes(path)
+    elif path.endswith(".gz"):
+        with gzip.open(path, mode="rb") as fp:
+            return fp.read()
+    else:
+        with open(path, mode="rb") as fp:
+            return fp.read()
+
+
+def parse_jsonl(content: bytes) -> List[Any]:
+    """Parses content returned by read_bytes into a list."""
+    return [json.loads(line) for line in content.splitlines() if line]
+
+
 def write_jsonl(path: str, data: List[Any]) -> None:
     """Writes a list to a JSONL file."""
+    # Imported here, Scrapy is slow to import and not needed for reading.
+    from scrapy.utils.serialize import ScrapyJSONEncoder
+
     with open(path, mode="w") as fp:
         for line in data:
             fp.write(json.dumps(line, cls=ScrapyJSONEncoder) + "\n")
@@ -0,0 +1,40 @@
+"""Parsing of ARSO observation history XMLs (observationAms_<station>_history.xml)."""
+
+import xml.etree.ElementTree as ET
+from typing import Iterable
+
+from data_pipeline.models import Datapoint
+from data_pipeline.parsing_util import parse_arso_datetime, float_or_none
+
+
+def xml_to_datapoints(xml: str) -> Iterable[Datapoint]:
+    return tree_to_datapoints(ET.fromstring(xml))
+
+
+def tree_to_datapoints(tree: ET.Element) -> Iterable[Datapoint]:
+    for met_data in tree.findall("metData"):
+        yield Datapoint(
+            station_arso_code=met_data.find("domain_meteosiId").text.strip("_"),
+            sunrise=parse_arso_datetime(met_data.find("sunrise").text),
+            sunset=parse_arso_datetime(met_data.find("sunset").text),
+            interval_start=parse_arso_datetime(met_data.find("validStart").text),
+            interval_end=parse_arso_datetime(met_data.find("validEnd").text),
+            temperature_dew_point=float_or_none(met_data.find("td").text),
+            temperature_air_avg=float_or_none(met_data.find("tavg").text),
+            temperature_air_max=float_or_none(met_data.find("tx").text),
+            temperature_air_min=float_or_none(met_data.find("tn").text),
+            humidity_relative_avg=float_or_none(met_data.find("rhavg").text),
+            wind_direction_avg=float_or_none(met_data.find("ddavg_val").text),
+            wind_direction_max_gust=float_or_none(met_data.find("ddmax_val").text),
+            wind_speed_avg=float_or_none(met_data.find("ffavg_val").text),
+            wind_speed_max=float_or_none(met_data.find("ffmax_val").text),
+            pressure_mean_sea_level_avg=float_or_none(met_data.find("mslavg").text),
+            pressure_surface_level_avg=float_or_none(met_data.find("pavg").text),
+            precipitation_sum_10min=float_or_none(met_data.find("rr_val").text),
+            precipitation_sum_1h=float_or_none(met_data.find("tp_1h_acc").text),
+            precipitation_sum_24h=float_or_none(met_data.find("tp_24h_acc").text),
+            snow_cover_height=float_or_none(met_data.find("snow").text),
+            sun_radiation_global_avg=float_or_none(met_data.find("gSunRadavg").text),
+            sun_radiation_diffuse_avg=float_or_none(met_data.find("diffSunRadavg").text),
+            visibility=float_or_none(met_data.find("vis_val").text)
+        )
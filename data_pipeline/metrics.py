@@ -0,0 +1,186 @@
+"""Per-stage timing, throughput and optional profiling of pipeline runs.
+
+Set SLO_WEATHER_PROFILE=cprofile or SLO_WEATHER_PROFILE=tracemalloc to profile a run.
+Profiles and JSON run summaries are written to data/runs/.
+"""
+
+import cProfile
+import datetime
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+
+from data_pipeline.jsonl_util import read_bytes, parse_jsonl
+from data_pipeline.paths_util import get_data_dir
+
+STAGES = ("gunzip", "json_decode", "xml_parse", "conversion", "db_write")
+
+PROFILE_ENV_VAR = "SLO_WEATHER_PROFILE"
+
+
+def get_runs_dir() -> str:
+    return os.path.join(get_data_dir(), "runs")
+
+
+@dataclass
+class FileMetrics:
+    """Metrics of processing a single archive file. Picklable, so workers can return it."""
+
+    path: str
+    bytes_compressed: int = 0
+    bytes_uncompressed: int = 0
+    rows: int = 0
+    datapoints: int = 0
+    cache_hits: int = 0
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def seconds(self) -> float:
+        return sum(self.stage_seconds.values())
+
+    def to_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "seconds": self.seconds,
+            "datapoints_per_second": self.datapoints / self.seconds if self.seconds else None,
+            "mb_per_second": self.bytes_uncompressed / 1e6 / self.seconds if self.seconds else None,
+        }
+
+    def __str__(self):
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stage_seconds.items())
+        rate = self.datapoints / self.seconds if self.seconds else 0
+        return f"{os.path.basename(self.path)}: {self.datapoints} datapoints, {rate:.0f}/s ({stages})"
+
+
+@dataclass
+class RunMetrics:
+    """Aggregate of FileMetrics of one pipeline run."""
+
+    name: str
+    started_at: datetime.datetime = field(default_factory=lambda: datetime.datetime.now(tz=datetime.timezone.utc))
+    files: list[FileMetrics] = field(default_factory=list)
+    peak_memory_bytes: Optional[int] = None
+    _start: float = field(default_factory=time.perf_counter)
+
+    def add(self, file_metrics: FileMetrics):
+        self.files.append(file_metrics)
+        print(file_metrics)
+
+    def summary(self) -> dict:
+        wall_seconds = time.perf_counter() - self._start
+        stage_seconds = {stage: 0.0 for stage in STAGES}
+        for f in self.files:
+            for stage, seconds in f.stage_seconds.items():
+                stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+        datapoints = sum(f.datapoints for f in self.files)
+        bytes_uncompressed = sum(f.bytes_uncompressed for f in self.files)
+
+        return {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": wall_seconds,
+            "files": len(self.files),
+            "failed_files": [f.path for f in self.files if f.error is not None],
+            "rows": sum(f.rows for f in self.files),
+            "datapoints": datapoints,
+            "cache_hits": sum(f.cache_hits for f in self.files),
+            "bytes_compressed": sum(f.bytes_compressed for f in self.files),
+            "bytes_uncompressed": bytes_uncompressed,
+            "datapoints_per_second": datapoints / wall_seconds if wall_seconds else None,
+            "mb_per_second": bytes_uncompressed / 1e6 / wall_seconds if wall_seconds else None,
+            # Summed over workers, so with a process pool this exceeds wall time.
+            "stage_seconds": stage_seconds,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "per_file": [f.to_dict() for f in self.files],
+        }
+
+    def write_summary(self, runs_dir: Optional[str] = None) -> str:
+        runs_dir = runs_dir or get_runs_dir()
+        os.makedirs(runs_dir, exist_ok=True)
+        path = os.path.join(runs_dir, f"{self.name}_{self.started_at:%Y%m%dT%H%M%S}.json")
+        summary = self.summary()
+        with open(path, mode="w") as fp:
+            json.dump(summary, fp, indent=2)
+
+        stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in summary["stage_seconds"].items())
+        print(f"{summary['datapoints']} datapoints from {summary['files']} files "
+              f"in {summary['wall_seconds']:.1f}s ({stages})")
+        print("Run summary written to", path)
+        return path
+
+
+@contextmanager
+def profiling(run: RunMetrics, mode: Optional[str] = None, runs_dir: Optional[str] = None):
+    """Profiles the enclosed block in the current process.
+
+    mode is "cprofile", "tracemalloc" or None (defaults to SLO_WEATHER_PROFILE).
+    Pool workers are not covered, profile the sequential variant of a loader instead."""
+    mode = mode if mode is not None else os.environ.get(PROFILE_ENV_VAR)
+    if not mode:
+        yield
+        return
+
+    runs_dir = runs_dir or get_runs_dir()
+    os.makedirs(runs_dir, exist_ok=True)
+    path_prefix = os.path.join(runs_dir, f"{run.name}_{run.started_at:%Y%m%dT%H%M%S}")
+
+    if mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(f"{path_prefix}.prof")
+            print("Profile written to", f"{path_prefix}.prof")
+    elif mode == "tracemalloc":
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            _, run.peak_memory_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(f"{path_prefix}_tracemalloc.txt", mode="w") as fp:
+                for stat in snapshot.statistics("lineno")[:50]:
+                    fp.write(f"{stat}\n")
+            print("Allocation statistics written to", f"{path_prefix}_tracemalloc.txt")
+    else:
+        raise ValueError(f"Unknown profiling mode {mode!r}, expected cprofile or tracemalloc")
+
+
+def timed_iter(iterable, metrics: FileMetrics, stage: str):
+    """Yields from iterable, adding time spent in producing each item to the stage."""
+    iterator = iter(iterable)
+    while True:
+        with metrics.stage(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def read_jsonl_timed(path: str, metrics: FileMetrics) -> list:
+    """read_jsonl, with decompression and JSON decoding timed separately."""
+    metrics.bytes_compressed = os.path.getsize(path)
+    with metrics.stage("gunzip"):
+        content = read_bytes(path)
+    metrics.bytes_uncompressed = len(content)
+    with metrics.stage("json_decode"):
+        rows = parse_jsonl(content)
+    metrics.rows = len(rows)
+    return rows
@@ -44,3 +44,23 @@ class Datapoint(BaseModel):
     visibility: Optional[float]  # from XML <vis_val>
 
     # TODO: Maybe add ground temperatures, cloud layers
+
+
+class WatersDatapoint(BaseModel):
+    """River and buoy measurements. All scraped table layouts map into this wide shape."""
+
+    location: str
+    timestamp: datetime.datetime  # UTC
+    water_level: Optional[int] = None  # "Vodostaj [cm]" (river, buoy V3)
+    flow_rate: Optional[float] = None  # "Pretok [m³/s]" (river)
+    temperature: Optional[float] = None  # "Temperatura vode [°C]"
+    waves_height: Optional[float] = None  # "Višina valov [m]"
+    max_waves_height: Optional[float] = None  # "Maksimalna višina valov [m]"
+    waves_period: Optional[int] = None  # "Vrednost periode valov [s]"
+    waves_direction: Optional[int] = None  # "Smer valov [°]"
+    sea_current_rate: Optional[int] = None  # "Hitrost morskega toka [cm/s]" (buoy V1)
+    sea_current_direction: Optional[int] = None  # "Smer morskega toka [°]" (buoy V1)
+    sea_current_rate_depth_2m: Optional[int] = None  # buoy V2
+    sea_current_direction_depth_2m: Optional[int] = None  # buoy V2
+    sea_current_rate_depth_10m: Optional[int] = None  # buoy V2
+    sea_current_direction_depth_10m: Optional[int] = None  # buoy V2
@@ -0,0 +1,234 @@
+"""On-disk cache of parsed station history XMLs, keyed by a hash of the XML and the parser version.
+
+A station's history XML often appears byte for byte in several daily scrapes, so
+reprocessing mostly finds it already parsed. Datapoints are stored in a compact binary
+form. When the cache grows over its size limit, least recently used entries are removed.
+
+The limit applies to the whole cache directory, which loader worker processes share.
+Instead of keeping a running total, which processes couldn't share, each process sums up
+the directory after it has written 1/EVICT_CHECK_FRACTION of the limit, and evicts if
+needed. With N processes writing, the cache can grow past the limit by at most
+N/EVICT_CHECK_FRACTION of it before one of them evicts.
+
+Loaders with their own XML parser pass its version to ParseCache.key, so that they don't
+read each other's entries. Versions must be bumped whenever parsing changes, entries of
+the previous version are then no longer used and eventually evicted.
+
+SLO_WEATHER_PARSE_CACHE_DIR overrides the location (default data/parse_cache),
+SLO_WEATHER_PARSE_CACHE_MAX_BYTES the size limit and SLO_WEATHER_PARSE_CACHE=off disables it.
+"""
+
+import datetime
+import functools
+import hashlib
+import math
+import os
+import struct
+import threading
+from typing import Any, Callable, Optional
+
+from data_pipeline.meteo_xml_util import xml_to_datapoints
+from data_pipeline.models import Datapoint
+from data_pipeline.paths_util import get_data_dir
+
+DATETIME_FIELDS = ("sunrise", "sunset", "interval_start", "interval_end")
+FLOAT_FIELDS = tuple(
+    name for name in Datapoint.model_fields if name != "station_arso_code" and name not in DATETIME_FIELDS
+)
+
+# Version of xml_to_datapoints, bump when it changes.
+PARSER_VERSION = "xml_to_datapoints/1"
+
+_MAGIC = b"SWPC\x01"
+_count = struct.Struct("<I")
+# Station index, (epoch seconds, UTC offset in minutes) for every datetime, float for every value.
+_record = struct.Struct("<H" + "qh" * len(DATETIME_FIELDS) + "d" * len(FLOAT_FIELDS))
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+EVICT_CHECK_FRACTION = 16
+
+_timezones = {}
+
+
+def _timezone(offset_minutes: int) -> datetime.timezone:
+    tz = _timezones.get(offset_minutes)
+    if tz is None:
+        tz = _timezones[offset_minutes] = datetime.timezone(datetime.timedelta(minutes=offset_minutes))
+    return tz
+
+
+def encode_datapoints(datapoints: list[dict[str, Any]]) -> bytes:
+    stations = sorted({d["station_arso_code"] for d in datapoints})
+    station_indexes = {station: i for i, station in enumerate(stations)}
+
+    parts = [_MAGIC, _count.pack(len(stations))]
+    for station in stations:
+        encoded = station.encode("utf-8")
+        parts.append(_count.pack(len(encoded)))
+        parts.append(encoded)
+
+    parts.append(_count.pack(len(datapoints)))
+    for d in datapoints:
+        values = [station_indexes[d["station_arso_code"]]]
+        for name in DATETIME_FIELDS:
+            dt = d[name]
+            values.append(int(dt.timestamp()))
+            values.append(int(dt.utcoffset().total_seconds()) // 60)
+        for name in FLOAT_FIELDS:
+            value = d[name]
+            values.append(math.nan if value is None else value)
+        parts.append(_record.pack(*values))
+    return b"".join(parts)
+
+
+def decode_datapoints(data: bytes) -> list[dict[str, Any]]:
+    if not data.startswith(_MAGIC):
+        raise ValueError("Not a parse cache entry")
+    offset = len(_MAGIC)
+
+    (station_count,) = _count.unpack_from(data, offset)
+    offset += _count.size
+    stations = []
+    for _ in range(station_count):
+        (length,) = _count.unpack_from(data, offset)
+        offset += _count.size
+        stations.append(data[offset:offset + length].decode("utf-8"))
+        offset += length
+
+    (datapoint_count,) = _count.unpack_from(data, offset)
+    offset += _count.size
+    if len(data) - offset != datapoint_count * _record.size:
+        raise ValueError("Truncated parse cache entry")
+
+    datapoints = []
+    for values in _record.iter_unpack(data[offset:]):
+        d = {"station_arso_code": stations[values[0]]}
+        i = 1
+        for name in DATETIME_FIELDS:
+            d[name] = datetime.datetime.fromtimestamp(values[i], tz=_timezone(values[i + 1]))
+            i += 2
+        for name in FLOAT_FIELDS:
+            value = values[i]
+            d[name] = None if math.isnan(value) else value
+            i += 1
+        datapoints.append(d)
+    return datapoints
+
+
+class ParseCache:
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Guards counters when the cache is shared by threads (see load_in_threads).
+        self._lock = threading.Lock()
+        # Bytes this process wrote since it last checked the size of the cache.
+        self._written = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(xml: str, parser_version: str = PARSER_VERSION) -> str:
+        h = hashlib.blake2b(parser_version.encode("utf-8") + b"\0", digest_size=16)
+        h.update(xml.encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.bin")
+
+    def _entries(self):
+        for prefix in os.scandir(self.cache_dir):
+            if prefix.is_dir():
+                for entry in os.scandir(prefix.path):
+                    if entry.name.endswith(".bin"):
+                        yield entry
+
+    def get(self, key: str) -> Optional[list[dict[str, Any]]]:
+        path = self._path(key)
+        try:
+            with open(path, mode="rb") as fp:
+                data = fp.read()
+            datapoints = decode_datapoints(data)
+        except (FileNotFoundError, ValueError, struct.error):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            # Access time is not reliable (noatime mounts), so mtime marks recent use.
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return datapoints
+
+    def put(self, key: str, datapoints: list[dict[str, Any]]):
+        path = self._path(key)
+        data = encode_datapoints(datapoints)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, mode="wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._written += len(data)
+            check = self._written >= self.max_bytes / EVICT_CHECK_FRACTION
+            if check:
+                self._written = 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used entries, if needed, until the cache is under 90% of its size limit."""
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size <= self.max_bytes:
+            return
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Removed by another worker sharing the cache.
+                pass
+            size -= entry_size
+
+    def datapoints(self, xml: str, parse: Callable[[str], list[dict[str, Any]]]) -> list[dict[str, Any]]:
+        """Datapoints (as dicts) of the XML, parsed with parse() only when not cached."""
+        key = self.key(xml)
+        datapoints = self.get(key)
+        if datapoints is None:
+            datapoints = parse(xml)
+            self.put(key, datapoints)
+        return datapoints
+
+
+@functools.lru_cache(maxsize=1)
+def get_parse_cache() -> Optional[ParseCache]:
+    """Parse cache of this process, configured by environment variables."""
+    if os.environ.get("SLO_WEATHER_PARSE_CACHE") == "off":
+        return None
+    return ParseCache(
+        os.environ.get("SLO_WEATHER_PARSE_CACHE_DIR") or os.path.join(get_data_dir(), "parse_cache"),
+        int(os.environ.get("SLO_WEATHER_PARSE_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+    )
+
+
+def cached_xml_to_datapoints(xml: str, cache: Optional[ParseCache]) -> list[Datapoint]:
+    """xml_to_datapoints, consulting the cache first."""
+    if cache is None:
+        return list(xml_to_datapoints(xml))
+    return [
+        Datapoint.model_construct(**d)
+        for d in cache.datapoints(xml, lambda x: [d.model_dump() for d in xml_to_datapoints(x)])
+    ]
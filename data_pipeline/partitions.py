@@ -0,0 +1,121 @@
+"""Monthly partitions of weather_datapoints (see schema_07_partition_weather_datapoints.sql).
+
+Partitions are named weather_datapoints_YYYY_MM and hold datapoints with interval_start
+in that month (UTC). The writer creates missing partitions before writing and upserts into
+partitions directly, so a batch only touches the partitions of its months.
+
+Old partitions can be detached, and optionally archived to gzipped CSV files and dropped:
+
+Usage: slo-weather partitions ensure [--months-ahead N]
+       slo-weather partitions detach --before YYYY-MM [--archive]
+"""
+
+import datetime
+import gzip
+import os
+import threading
+from typing import Iterable, Optional
+
+from data_pipeline.paths_util import get_data_dir
+
+PARENT_TABLE = "weather_datapoints"
+DEFAULT_MONTHS_AHEAD = 3
+
+# Months known to have a partition, per process.
+_known_months = set()
+_known_months_lock = threading.Lock()
+
+
+def month_of(dt: datetime.datetime) -> datetime.date:
+    """First day of the UTC month of the datetime. Naive datetimes are UTC."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc)
+    return datetime.date(dt.year, dt.month, 1)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return f"{PARENT_TABLE}_{month:%Y_%m}"
+
+
+def is_partitioned(conn) -> bool:
+    row = conn.execute(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (PARENT_TABLE,)
+    ).fetchone()
+    return bool(row and row[0])
+
+
+def ensure_partitions(conn, months: Iterable[datetime.date]) -> int:
+    """Creates missing partitions of the months. Returns the number of created partitions."""
+    with _known_months_lock:
+        missing = sorted(set(months) - _known_months)
+    if not missing:
+        return 0
+    created = 0
+    # One call per month, a range could span months of years without datapoints.
+    for month in missing:
+        created += conn.execute(
+            "SELECT create_weather_datapoints_partitions(%s, %s)", (month, month)
+        ).fetchone()[0]
+    conn.commit()
+    with _known_months_lock:
+        _known_months.update(missing)
+    return created
+
+
+def list_partitions(conn) -> list[str]:
+    return [row[0] for row in conn.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+        ORDER BY child.relname
+    """, (PARENT_TABLE,))]
+
+
+def detach_partitions(conn, before: datetime.date, archive_dir: Optional[str] = None) -> list[str]:
+    """Detaches partitions of months before the given one.
+
+    With archive_dir, each detached partition is exported to <archive_dir>/<partition>.csv.gz
+    and dropped. conn must be in autocommit mode, DETACH CONCURRENTLY can't run in a transaction."""
+    detached = []
+    for name in list_partitions(conn):
+        if name >= partition_name(before):
+            continue
+        print("Detaching", name)
+        conn.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}" CONCURRENTLY')
+        detached.append(name)
+
+        if archive_dir is not None:
+            os.makedirs(archive_dir, exist_ok=True)
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with conn.cursor() as cur, gzip.open(tmp_path, mode="wb") as fp:
+                with cur.copy(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)') as copy:
+                    for data in copy:
+                        fp.write(data)
+            os.replace(tmp_path, path)
+            conn.execute(f'DROP TABLE "{name}"')
+            print(f"Archived {name} to {path}")
+    return detached
+
+
+def main(command: str, months_ahead: int = DEFAULT_MONTHS_AHEAD, before: Optional[str] = None,
+         archive: bool = False):
+    from data_pipeline import db
+
+    with db.connect(autocommit=True) as conn:
+        if not is_partitioned(conn):
+            print(f"{PARENT_TABLE} is not partitioned, see schema_07_partition_weather_datapoints.sql")
+            return
+        if command == "ensure":
+            this_month = month_of(datetime.datetime.now(tz=datetime.timezone.utc))
+            months = [add_months(this_month, i) for i in range(months_ahead + 1)]
+            print(f"Created {ensure_partitions(conn, months)} partitions")
+        elif command == "detach":
+            month = datetime.date.fromisoformat(f"{before}-01")
+            archive_dir = os.path.join(get_data_dir(), "partitions") if archive else None
+            print(f"Detached {len(detach_partitions(conn, month, archive_dir))} partitions")
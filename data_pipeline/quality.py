@@ -0,0 +1,299 @@
+"""Quality control of datapoints, vectorized over all datapoints of a station.
+
+Checks, each setting a bit (QcFlag) of the variable's flag byte:
+
+- RANGE: value outside physically plausible limits.
+- SPIKE: value jumps away from both its neighbours by more than the variable's limit.
+- STUCK: value didn't change for longer than the variable ever stays constant.
+- INCONSISTENT: related variables disagree, e.g. not tn <= tavg <= tx.
+- OUTLIER: value deviates by more than OUTLIER_SIGMAS from the station's rolling baseline.
+
+Flags are stored in weather_datapoints.qc_flags, one byte per QC_VARIABLES entry, or NULL
+when no check failed (see schema_05_qc_flags.sql). Loaders clear the flags of datapoints whose
+values they change (see datapoint_writer.py), until the next run screens them again.
+
+Usage: slo-weather qc
+"""
+
+import enum
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+from data_pipeline.models import Datapoint
+
+QC_VARIABLES = (
+    "temperature_dew_point",
+    "temperature_air_avg",
+    "temperature_air_max",
+    "temperature_air_min",
+    "humidity_relative_avg",
+    "wind_direction_avg",
+    "wind_direction_max_gust",
+    "wind_speed_avg",
+    "wind_speed_max",
+    "pressure_mean_sea_level_avg",
+    "pressure_surface_level_avg",
+    "precipitation_sum_10min",
+    "precipitation_sum_1h",
+    "precipitation_sum_24h",
+    "snow_cover_height",
+    "sun_radiation_global_avg",
+    "sun_radiation_diffuse_avg",
+    "visibility",
+)
+_variable_index = {name: i for i, name in enumerate(QC_VARIABLES)}
+
+
+class QcFlag(enum.IntFlag):
+    RANGE = 1
+    SPIKE = 2
+    STUCK = 4
+    INCONSISTENT = 8
+    OUTLIER = 16
+
+
+# Plausible limits in Slovenia, in the units of the ARSO feed.
+RANGES = {
+    "temperature_dew_point": (-45.0, 35.0),
+    "temperature_air_avg": (-40.0, 45.0),
+    "temperature_air_max": (-40.0, 45.0),
+    "temperature_air_min": (-40.0, 45.0),
+    "humidity_relative_avg": (0.0, 100.0),
+    "wind_direction_avg": (0.0, 360.0),
+    "wind_direction_max_gust": (0.0, 360.0),
+    "wind_speed_avg": (0.0, 60.0),
+    "wind_speed_max": (0.0, 90.0),
+    "pressure_mean_sea_level_avg": (940.0, 1070.0),
+    "pressure_surface_level_avg": (650.0, 1070.0),
+    "precipitation_sum_10min": (0.0, 60.0),
+    "precipitation_sum_1h": (0.0, 150.0),
+    "precipitation_sum_24h": (0.0, 600.0),
+    "snow_cover_height": (0.0, 1000.0),
+    "sun_radiation_global_avg": (0.0, 1400.0),
+    "sun_radiation_diffuse_avg": (0.0, 1000.0),
+}
+
+# Largest plausible change between consecutive datapoints.
+SPIKE_LIMITS = {
+    "temperature_dew_point": 8.0,
+    "temperature_air_avg": 6.0,
+    "humidity_relative_avg": 40.0,
+    "pressure_mean_sea_level_avg": 4.0,
+    "pressure_surface_level_avg": 4.0,
+    "snow_cover_height": 30.0,
+}
+# Neighbours further apart than this are not compared.
+SPIKE_MAX_GAP_SECONDS = 3600
+
+# Longest time the variable plausibly stays exactly constant.
+STUCK_SECONDS = {
+    "temperature_dew_point": 6 * 3600,
+    "temperature_air_avg": 6 * 3600,
+    "humidity_relative_avg": 24 * 3600,  # stays at 100 in fog
+    "pressure_mean_sea_level_avg": 12 * 3600,
+    "pressure_surface_level_avg": 12 * 3600,
+    "wind_speed_avg": 12 * 3600,  # 0 in calm nights
+}
+
+BASELINE_VARIABLES = (
+    "temperature_dew_point",
+    "temperature_air_avg",
+    "humidity_relative_avg",
+    "pressure_mean_sea_level_avg",
+    "pressure_surface_level_avg",
+)
+BASELINE_WINDOW = 6 * 24 * 3  # datapoints, 3 days of 10-minute data
+OUTLIER_SIGMAS = 5.0
+# Tolerance of consistency checks, values are rounded in the feed.
+CONSISTENCY_TOLERANCE = 0.05
+
+
+def rolling_mean_std(values: np.ndarray, window: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Mean, standard deviation and count of non-NaN values among the window datapoints before each datapoint."""
+    present = ~np.isnan(values)
+    # Centered, so sums of squares of e.g. pressures near 1000 hPa don't lose precision.
+    reference = values[present][0] if present.any() else 0.0
+    x = np.where(present, values - reference, 0.0)
+    # Prefix sums with a leading zero, so the sum over [i - window, i) is cs[i] - cs[max(i - window, 0)].
+    cs = np.concatenate(([0.0], np.cumsum(x)))
+    cs2 = np.concatenate(([0.0], np.cumsum(x * x)))
+    cn = np.concatenate(([0], np.cumsum(present)))
+    end = np.arange(len(values))
+    start = np.maximum(end - window, 0)
+
+    count = cn[end] - cn[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (cs[end] - cs[start]) / count
+        variance = (cs2[end] - cs2[start]) / count - mean * mean
+    return mean + reference, np.sqrt(np.maximum(variance, 0.0)), count
+
+
+def _stuck(values: np.ndarray, times: np.ndarray, max_seconds: float) -> np.ndarray:
+    """Datapoints in runs of equal values lasting longer than max_seconds."""
+    if len(values) == 0:
+        return np.zeros(0, dtype=bool)
+    # NaN never equals NaN, so missing values end runs.
+    run_starts = np.concatenate(([True], values[1:] != values[:-1]))
+    run_ids = np.cumsum(run_starts) - 1
+    start_indexes = np.flatnonzero(run_starts)
+    end_indexes = np.concatenate((start_indexes[1:], [len(values)])) - 1
+    durations = times[end_indexes] - times[start_indexes]
+    return (durations > max_seconds)[run_ids] & ~np.isnan(values)
+
+
+def _spikes(values: np.ndarray, times: np.ndarray, limit: float) -> np.ndarray:
+    spikes = np.zeros(len(values), dtype=bool)
+    if len(values) < 3:
+        return spikes
+    before = values[1:-1] - values[:-2]
+    after = values[1:-1] - values[2:]
+    close = ((times[1:-1] - times[:-2]) <= SPIKE_MAX_GAP_SECONDS) & ((times[2:] - times[1:-1]) <= SPIKE_MAX_GAP_SECONDS)
+    # Away from both neighbours in the same direction, comparisons with NaN are False.
+    spikes[1:-1] = close & (np.abs(before) > limit) & (np.abs(after) > limit) & (np.sign(before) == np.sign(after))
+    return spikes
+
+
+def screen(times: np.ndarray, columns: dict[str, np.ndarray]) -> np.ndarray:
+    """Flags [datapoint x QC_VARIABLES] of a station's datapoints, sorted by time.
+
+    times are interval ends in epoch seconds, columns hold values of QC_VARIABLES (missing
+    columns are skipped), NaN for missing values."""
+    n = len(times)
+    times = np.asarray(times, dtype=np.float64)
+    flags = np.zeros((n, len(QC_VARIABLES)), dtype=np.uint8)
+    columns = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+
+    def flag(name: str, mask: np.ndarray, qc_flag: QcFlag):
+        flags[:, _variable_index[name]] |= np.where(mask, np.uint8(qc_flag), np.uint8(0))
+
+    for name, (low, high) in RANGES.items():
+        if name in columns:
+            values = columns[name]
+            flag(name, (values < low) | (values > high), QcFlag.RANGE)
+
+    for name, limit in SPIKE_LIMITS.items():
+        if name in columns:
+            flag(name, _spikes(columns[name], times, limit), QcFlag.SPIKE)
+
+    for name, max_seconds in STUCK_SECONDS.items():
+        if name in columns:
+            flag(name, _stuck(columns[name], times, max_seconds), QcFlag.STUCK)
+
+    for name in BASELINE_VARIABLES:
+        if name in columns:
+            values = columns[name]
+            mean, std, count = rolling_mean_std(values, BASELINE_WINDOW)
+            with np.errstate(invalid="ignore"):
+                outliers = (count >= BASELINE_WINDOW // 2) & (np.abs(values - mean) > OUTLIER_SIGMAS * np.maximum(std, 0.1))
+            flag(name, outliers, QcFlag.OUTLIER)
+
+    for low_name, high_name in (
+            ("temperature_air_min", "temperature_air_avg"),
+            ("temperature_air_avg", "temperature_air_max"),
+            ("temperature_air_min", "temperature_air_max"),
+            ("temperature_dew_point", "temperature_air_avg"),
+            ("wind_speed_avg", "wind_speed_max"),
+            ("sun_radiation_diffuse_avg", "sun_radiation_global_avg"),
+    ):
+        if low_name in columns and high_name in columns:
+            inconsistent = columns[low_name] > columns[high_name] + CONSISTENCY_TOLERANCE
+            flag(low_name, inconsistent, QcFlag.INCONSISTENT)
+            flag(high_name, inconsistent, QcFlag.INCONSISTENT)
+
+    return flags
+
+
+def screen_datapoints(datapoints: Iterable[Datapoint]) -> dict[tuple, np.ndarray]:
+    """Flags of datapoints by (station, interval_start, interval_end), only of datapoints with any flag set."""
+    by_station = {}
+    for datapoint in datapoints:
+        by_station.setdefault(datapoint.station_arso_code, []).append(datapoint)
+
+    flagged = {}
+    for station, station_datapoints in by_station.items():
+        station_datapoints.sort(key=lambda d: (d.interval_end, d.interval_start))
+        times = np.array([d.interval_end.timestamp() for d in station_datapoints])
+        columns = {
+            name: np.array([getattr(d, name) for d in station_datapoints], dtype=np.float64)
+            for name in QC_VARIABLES
+        }
+        flags = screen(times, columns)
+        for i in np.flatnonzero(flags.any(axis=1)):
+            d = station_datapoints[i]
+            flagged[(station, d.interval_start, d.interval_end)] = flags[i]
+    return flagged
+
+
+def encode_flags(flags: np.ndarray) -> Optional[bytes]:
+    """qc_flags value of a datapoint's flag row."""
+    return flags.tobytes() if flags.any() else None
+
+
+def decode_flags(qc_flags: Optional[bytes]) -> dict[str, QcFlag]:
+    """Flags of variables with any flag set."""
+    if qc_flags is None:
+        return {}
+    return {QC_VARIABLES[i]: QcFlag(value) for i, value in enumerate(qc_flags) if value}
+
+
+def screen_station(station: str, conn) -> tuple[int, np.ndarray]:
+    """Screens all datapoints of the station and updates their flags. Returns datapoint count and flag counts."""
+    from data_pipeline.columnar import copy_columns
+
+    chunks = list(copy_columns(conn, f"""
+        SELECT id, interval_end, {", ".join(f"COALESCE({name}, 'NaN')::float4" for name in QC_VARIABLES)}
+        FROM weather_datapoints WHERE station_arso_code = %s AND interval_end IS NOT NULL
+        ORDER BY interval_end, interval_start
+    """, (station,), {"id": "int4", "interval_end": "timestamp", **{name: "float4" for name in QC_VARIABLES}}))
+    if not chunks:
+        return 0, np.zeros(len(QcFlag), dtype=np.int64)
+    data = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    ids = data["id"].astype(np.int64)
+    times = data["interval_end"].astype("datetime64[us]").astype(np.int64) / 1e6
+    flags = screen(times, {name: data[name] for name in QC_VARIABLES})
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT id FROM weather_datapoints WHERE station_arso_code = %s AND qc_flags IS NOT NULL", (station,)
+        )
+        previously_flagged = np.array([row[0] for row in cur.fetchall()], dtype=np.int64)
+        flagged = flags.any(axis=1)
+        # Only datapoints which are or were flagged can change.
+        changed = np.flatnonzero(flagged | np.isin(ids, previously_flagged))
+
+        cur.execute("CREATE TEMPORARY TABLE qc_flags_staging (id INTEGER, qc_flags BYTEA) ON COMMIT DROP")
+        with cur.copy("COPY qc_flags_staging (id, qc_flags) FROM STDIN") as copy:
+            for i in changed:
+                copy.write_row((int(ids[i]), encode_flags(flags[i])))
+        cur.execute("""
+            UPDATE weather_datapoints SET qc_flags = s.qc_flags FROM qc_flags_staging s
+            WHERE weather_datapoints.id = s.id AND weather_datapoints.qc_flags IS DISTINCT FROM s.qc_flags
+        """)
+    conn.commit()
+
+    flag_counts = np.array([np.count_nonzero(flags & qc_flag) for qc_flag in QcFlag], dtype=np.int64)
+    return len(ids), flag_counts
+
+
+def main():
+    from data_pipeline import db
+
+    start = time.perf_counter()
+    total = 0
+    flag_counts = np.zeros(len(QcFlag), dtype=np.int64)
+    with db.connect() as conn:
+        stations = [row[0] for row in conn.execute("SELECT arso_code FROM stations ORDER BY arso_code")]
+        conn.commit()
+        for station in stations:
+            count, station_flag_counts = screen_station(station, conn)
+            total += count
+            flag_counts += station_flag_counts
+            print(f"Screened {count} datapoints of {station}")
+    print(f"Screened {total} datapoints of {len(stations)} stations in {time.perf_counter() - start:.1f}s, flagged values: "
+          + ", ".join(f"{qc_flag.name} {count}" for qc_flag, count in zip(QcFlag, flag_counts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Rollups of datapoints per station and variable at 1h, 1d and 1mon resolution.
+
+Each bucket stores count, sum, min and max of the variable's values (mean is sum / count)
+and one representative point picked by Largest-Triangle-Three-Buckets (LTTB), so charts
+drawn from bucket points keep the shape of the raw series. Each level is built from the
+level below: 1h from datapoints, 1d from 1h and 1mon from 1d.
+
+Loaders queue the ranges they write in weather_rollups_dirty (see db.mark_rollups_dirty)
+in the same transaction as datapoints. update_rollups drains the queue and recomputes only
+the affected buckets, so parallel loaders never race on rollup rows.
+
+LTTB normally anchors each bucket on the point picked in the previous bucket, which makes
+it sequential. Here both anchors are neighbouring bucket averages, so every bucket is
+independent: picks are vectorized, and updating a bucket never invalidates the next one.
+
+Tables are created by schema_06_rollups.sql.
+
+Usage: slo-weather rollups
+"""
+
+import datetime
+from contextlib import nullcontext
+from typing import Optional
+
+import numpy as np
+
+from data_pipeline.quality import QC_VARIABLES
+
+LEVELS = ("1h", "1d", "1mon")
+# Wind direction means are plain means of angles, not circular means.
+ROLLUP_VARIABLES = QC_VARIABLES
+
+_level_units = {"1h": "h", "1d": "D", "1mon": "M"}
+_level_sources = {"1d": "1h", "1mon": "1d"}
+LEVEL_SECONDS = {"1h": 3600, "1d": 86400, "1mon": 30.44 * 86400}
+
+
+def bucket_starts(times: np.ndarray, level: str) -> np.ndarray:
+    """Epoch seconds of the start of the level's bucket of each time (epoch seconds)."""
+    seconds = np.floor(np.asarray(times, dtype=np.float64)).astype("datetime64[s]")
+    return seconds.astype(f"datetime64[{_level_units[level]}]").astype("datetime64[s]").astype(np.int64)
+
+
+def rollup(buckets: np.ndarray, times: np.ndarray, values: np.ndarray, counts: np.ndarray,
+           sums: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> dict[str, np.ndarray]:
+    """Aggregates points into buckets. Inputs are per point, sorted by time.
+
+    A point is a datapoint (count 1, value as sum, min and max) or a bucket of the level
+    below (times and values are its LTTB point). Points with count 0 are skipped. Returns
+    arrays per non-empty bucket: bucket, count, sum, min, max, lttb_time and lttb_value."""
+    present = (counts > 0) & ~np.isnan(values)
+    buckets, times, values = buckets[present], times[present], values[present]
+    counts, sums, mins, maxs = counts[present], sums[present], mins[present], maxs[present]
+    if len(buckets) == 0:
+        return {name: np.zeros(0) for name in ("bucket", "count", "sum", "min", "max", "lttb_time", "lttb_value")}
+
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    sizes = np.diff(np.append(starts, len(buckets)))
+    groups = np.repeat(np.arange(len(starts)), sizes)
+
+    count = np.add.reduceat(counts, starts)
+    total = np.add.reduceat(sums, starts)
+    mean = total / count
+    mean_time = np.add.reduceat(times, starts) / sizes
+
+    # Anchors are the average points of the neighbouring buckets, or the bucket's own at the ends.
+    previous_time = np.concatenate((mean_time[:1], mean_time[:-1]))[groups]
+    previous_value = np.concatenate((mean[:1], mean[:-1]))[groups]
+    next_time = np.concatenate((mean_time[1:], mean_time[-1:]))[groups]
+    next_value = np.concatenate((mean[1:], mean[-1:]))[groups]
+    area = np.abs((previous_time - next_time) * (values - previous_value)
+                  - (previous_time - times) * (next_value - previous_value))
+    # First point with the largest triangle of each bucket.
+    largest = np.flatnonzero(area == np.maximum.reduceat(area, starts)[groups])
+    picked = largest[np.unique(groups[largest], return_index=True)[1]]
+
+    return {
+        "bucket": buckets[starts],
+        "count": count,
+        "sum": total,
+        "min": np.minimum.reduceat(mins, starts),
+        "max": np.maximum.reduceat(maxs, starts),
+        "lttb_time": times[picked],
+        "lttb_value": values[picked],
+    }
+
+
+def _shift(seconds: int, level: str, buckets: int) -> int:
+    """Start of the bucket the given number of buckets after the bucket of seconds."""
+    unit = _level_units[level]
+    start = np.datetime64(int(seconds), "s").astype(f"datetime64[{unit}]")
+    return int((start + np.timedelta64(buckets, unit)).astype("datetime64[s]").astype(np.int64))
+
+
+def _epoch(dt: datetime.datetime) -> float:
+    # Timestamps are stored without a time zone, in UTC.
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp() if dt.tzinfo is None else dt.timestamp()
+
+
+def _fetch_datapoints(cur, station: str, start: int, end: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """interval_starts, interval_ends and [datapoint x variable] values with interval_start in [start, end)."""
+    cur.execute(f"""
+        SELECT extract(epoch FROM interval_start)::double precision,
+               extract(epoch FROM interval_end)::double precision,
+               {", ".join(ROLLUP_VARIABLES)}
+        FROM weather_datapoints
+        WHERE station_arso_code = %s
+          AND interval_start >= to_timestamp(%s) AT TIME ZONE 'UTC'
+          AND interval_start < to_timestamp(%s) AT TIME ZONE 'UTC'
+        ORDER BY interval_start, interval_end
+    """, (station, start, end))
+    # None becomes NaN.
+    data = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 2 + len(ROLLUP_VARIABLES))
+    return data[:, 0], data[:, 1], data[:, 2:]
+
+
+def _fetch_rollups(cur, level: str, station: str, start: int, end: int) -> dict[str, np.ndarray]:
+    """Rollup rows of each variable with bucket_start in [start, end), as a [row x column] array of
+    bucket_start, count, sum, min, max, lttb_time, lttb_value."""
+    cur.execute("""
+        SELECT variable,
+               extract(epoch FROM bucket_start)::double precision, count, sum, min, max,
+               extract(epoch FROM lttb_time)::double precision, lttb_value
+        FROM weather_rollups
+        WHERE level = %s AND station_arso_code = %s
+          AND bucket_start >= to_timestamp(%s) AT TIME ZONE 'UTC'
+          AND bucket_start < to_timestamp(%s) AT TIME ZONE 'UTC'
+        ORDER BY variable, bucket_start
+    """, (level, station, start, end))
+    rows_by_variable = {}
+    for row in cur.fetchall():
+        rows_by_variable.setdefault(row[0], []).append(row[1:])
+    return {variable: np.array(rows, dtype=np.float64) for variable, rows in rows_by_variable.items()}
+
+
+def _store(cur, level: str, station: str, results: dict[str, dict[str, np.ndarray]]):
+    cur.execute("""
+        CREATE TEMPORARY TABLE IF NOT EXISTS weather_rollups_staging (
+            variable TEXT, bucket_start DOUBLE PRECISION, count INTEGER, sum DOUBLE PRECISION,
+            min REAL, max REAL, lttb_time DOUBLE PRECISION, lttb_value REAL
+        ) ON COMMIT DELETE ROWS
+    """)
+    cur.execute("TRUNCATE weather_rollups_staging")
+    with cur.copy("COPY weather_rollups_staging FROM STDIN") as copy:
+        for variable, result in results.items():
+            for row in zip(result["bucket"].tolist(), result["count"].tolist(), result["sum"].tolist(),
+                           result["min"].tolist(), result["max"].tolist(),
+                           result["lttb_time"].tolist(), result["lttb_value"].tolist()):
+                copy.write_row((variable, *row))
+    cur.execute("""
+        INSERT INTO weather_rollups (level, station_arso_code, variable, bucket_start, count, sum, min, max,
+                                     lttb_time, lttb_value)
+        SELECT %s, %s, variable, to_timestamp(bucket_start) AT TIME ZONE 'UTC', count, sum, min, max,
+               to_timestamp(lttb_time) AT TIME ZONE 'UTC', lttb_value
+        FROM weather_rollups_staging
+        ON CONFLICT (level, station_arso_code, variable, bucket_start) DO UPDATE SET
+            count = excluded.count,
+            sum = excluded.sum,
+            min = excluded.min,
+            max = excluded.max,
+            lttb_time = excluded.lttb_time,
+            lttb_value = excluded.lttb_value
+    """, (level, station))
+
+
+def update_station(cur, station: str, start: datetime.datetime, end: datetime.datetime):
+    """Recomputes rollups of all levels of buckets containing interval starts in [start, end]."""
+    start, end = _epoch(start), _epoch(end)
+    for level in LEVELS:
+        first = int(bucket_starts([start], level)[0])
+        last = int(bucket_starts([end], level)[0])
+        # One more bucket on each side, as anchors of the LTTB picks.
+        context_start, context_end = _shift(first, level, -1), _shift(last, level, 2)
+
+        results = {}
+        if level == "1h":
+            interval_starts, interval_ends, values = _fetch_datapoints(cur, station, context_start, context_end)
+            buckets = bucket_starts(interval_starts, level)
+            for i, variable in enumerate(ROLLUP_VARIABLES):
+                column = values[:, i]
+                results[variable] = rollup(buckets, interval_ends, column, (~np.isnan(column)).astype(np.int64),
+                                           np.nan_to_num(column), column, column)
+        else:
+            for variable, rows in _fetch_rollups(cur, _level_sources[level], station, context_start, context_end).items():
+                results[variable] = rollup(bucket_starts(rows[:, 0], level), rows[:, 5], rows[:, 6],
+                                           rows[:, 1].astype(np.int64), rows[:, 2], rows[:, 3], rows[:, 4])
+
+        for variable, result in results.items():
+            # Context buckets are only read, their rollups may depend on buckets further away.
+            keep = (result["bucket"] >= first) & (result["bucket"] <= last)
+            results[variable] = {name: values[keep] for name, values in result.items()}
+        _store(cur, level, station, results)
+
+
+def update_rollups(conn=None) -> int:
+    """Drains the queue of dirty ranges, committing after each station. Returns the number of updated stations."""
+    from data_pipeline import db
+
+    with (db.connect() if conn is None else nullcontext(conn)) as conn:
+        stations = [row[0] for row in conn.execute("SELECT DISTINCT station_arso_code FROM weather_rollups_dirty")]
+        conn.commit()
+        for station in stations:
+            with conn.cursor() as cur:
+                # Ranges queued meanwhile stay for the next run.
+                cur.execute(
+                    "DELETE FROM weather_rollups_dirty WHERE station_arso_code = %s RETURNING range_start, range_end",
+                    (station,),
+                )
+                ranges = cur.fetchall()
+                if ranges:
+                    start, end = min(r[0] for r in ranges), max(r[1] for r in ranges)
+                    print(f"Updating rollups of {station} from {start} to {end}")
+                    update_station(cur, station, start, end)
+            conn.commit()
+    return len(stations)
+
+
+def choose_level(start: datetime.datetime, end: datetime.datetime, pixels: int) -> Optional[str]:
+    """Coarsest level with at least one bucket per pixel over the range, None if datapoints are needed."""
+    span = (end - start).total_seconds()
+    for level in reversed(LEVELS):
+        if span / LEVEL_SECONDS[level] >= pixels:
+            return level
+    return None
+
+
+def query_series(conn, station: str, variable: str, start: datetime.datetime, end: datetime.datetime,
+                 pixels: int) -> tuple[Optional[str], list[tuple]]:
+    """Series of the variable for a chart pixels wide, from the coarsest sufficient level.
+
+    Returns the level (None for datapoints) and rows of (bucket_start, mean, min, max, lttb_time,
+    lttb_value). Datapoints are returned as rows of one-point buckets."""
+    if variable not in ROLLUP_VARIABLES:
+        raise ValueError(f"Unknown variable: {variable}")
+
+    level = choose_level(start, end, pixels)
+    if level is None:
+        rows = conn.execute(f"""
+            SELECT interval_start, {variable}, {variable}, {variable}, interval_end, {variable}
+            FROM weather_datapoints
+            WHERE station_arso_code = %s AND interval_start >= %s AND interval_start < %s AND {variable} IS NOT NULL
+            ORDER BY interval_start
+        """, (station, start, end)).fetchall()
+    else:
+        rows = conn.execute("""
+            SELECT bucket_start, sum / count, min, max, lttb_time, lttb_value
+            FROM weather_rollups
+            WHERE level = %s AND station_arso_code = %s AND variable = %s
+              AND bucket_start >= %s AND bucket_start < %s
+            ORDER BY bucket_start
+        """, (level, station, variable, start, end)).fetchall()
+    return level, rows
+
+
+def main():
+    print(f"Updated rollups of {update_rollups()} stations")
+
+
+if __name__ == "__main__":
+    main()
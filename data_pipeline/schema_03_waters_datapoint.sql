@@ -0,0 +1,25 @@
+CREATE TABLE IF NOT EXISTS waters_datapoints
+(
+    id                              SERIAL
+        constraint waters_datapoints_pk
+            primary key,
+    location                        TEXT      NOT NULL,
+    timestamp                       TIMESTAMPTZ NOT NULL,
+    water_level                     INTEGER,
+    flow_rate                       REAL,
+    temperature                     REAL,
+    waves_height                    REAL,
+    max_waves_height                REAL,
+    waves_period                    INTEGER,
+    waves_direction                 INTEGER,
+    sea_current_rate                INTEGER,
+    sea_current_direction           INTEGER,
+    sea_current_rate_depth_2m       INTEGER,
+    sea_current_direction_depth_2m  INTEGER,
+    sea_current_rate_depth_10m      INTEGER,
+    sea_current_direction_depth_10m INTEGER
+);
+
+alter table waters_datapoints
+    add constraint waters_datapoints_pk2
+        unique (location, timestamp);
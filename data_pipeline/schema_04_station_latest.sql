@@ -0,0 +1,61 @@
+-- Latest datapoint of each station, maintained by the loader next to weather_datapoints.
+CREATE TABLE IF NOT EXISTS station_latest
+(
+    station_arso_code           VARCHAR(255) NOT NULL
+        constraint station_latest_pk
+            primary key
+        constraint fk_station_latest_station_arso_code
+            references stations(arso_code),
+    sunrise                     TIMESTAMP,
+    sunset                      TIMESTAMP,
+    interval_start              TIMESTAMP,
+    interval_end                TIMESTAMP,
+    temperature_dew_point       REAL,
+    temperature_air_avg         REAL,
+    temperature_air_max         REAL,
+    temperature_air_min         REAL,
+    humidity_relative_avg       REAL,
+    wind_direction_avg          REAL,
+    wind_direction_max_gust     REAL,
+    wind_speed_avg              REAL,
+    wind_speed_max              REAL,
+    pressure_mean_sea_level_avg REAL,
+    pressure_surface_level_avg  REAL,
+    precipitation_sum_10min     REAL,
+    precipitation_sum_1h        REAL,
+    precipitation_sum_24h       REAL,
+    snow_cover_height           REAL,
+    sun_radiation_global_avg    REAL,
+    sun_radiation_diffuse_avg   REAL,
+    visibility                  REAL
+);
+
+-- Backfill from datapoints loaded before the table existed.
+INSERT INTO station_latest
+SELECT DISTINCT ON (station_arso_code)
+    station_arso_code,
+    sunrise,
+    sunset,
+    interval_start,
+    interval_end,
+    temperature_dew_point,
+    temperature_air_avg,
+    temperature_air_max,
+    temperature_air_min,
+    humidity_relative_avg,
+    wind_direction_avg,
+    wind_direction_max_gust,
+    wind_speed_avg,
+    wind_speed_max,
+    pressure_mean_sea_level_avg,
+    pressure_surface_level_avg,
+    precipitation_sum_10min,
+    precipitation_sum_1h,
+    precipitation_sum_24h,
+    snow_cover_height,
+    sun_radiation_global_avg,
+    sun_radiation_diffuse_avg,
+    visibility
+FROM weather_datapoints
+ORDER BY station_arso_code, interval_end DESC, interval_start DESC
+ON CONFLICT (station_arso_code) DO NOTHING;
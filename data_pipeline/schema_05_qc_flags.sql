@@ -0,0 +1,4 @@
+-- Quality flags of datapoints, one byte per variable in the order of quality.QC_VARIABLES,
+-- bits as in quality.QcFlag. NULL when no check failed.
+ALTER TABLE weather_datapoints
+    ADD COLUMN IF NOT EXISTS qc_flags BYTEA;
@@ -0,0 +1,30 @@
+-- Per-station aggregates of each variable at coarser time resolutions, see rollups.py.
+CREATE TABLE IF NOT EXISTS weather_rollups
+(
+    level             TEXT             NOT NULL, -- 1h, 1d or 1mon
+    station_arso_code VARCHAR(255)     NOT NULL,
+    variable          TEXT             NOT NULL,
+    bucket_start      TIMESTAMP        NOT NULL,
+    count             INTEGER          NOT NULL,
+    sum               DOUBLE PRECISION NOT NULL,
+    min               REAL,
+    max               REAL,
+    lttb_time         TIMESTAMP, -- shape-preserving representative point of the bucket
+    lttb_value        REAL,
+    constraint weather_rollups_pk
+        primary key (level, station_arso_code, variable, bucket_start)
+);
+
+-- Time ranges written by loaders, which rollups have yet to be updated for.
+CREATE TABLE IF NOT EXISTS weather_rollups_dirty
+(
+    station_arso_code VARCHAR(255) NOT NULL,
+    range_start       TIMESTAMP    NOT NULL,
+    range_end         TIMESTAMP    NOT NULL
+);
+
+-- Build rollups of datapoints loaded before the tables existed.
+INSERT INTO weather_rollups_dirty
+SELECT station_arso_code, MIN(interval_start), MAX(interval_start)
+FROM weather_datapoints
+GROUP BY station_arso_code;
@@ -0,0 +1,90 @@
+-- Monthly range partitioning of weather_datapoints on interval_start, see partitions.py.
+-- Run once on an existing database. The original table is kept as
+-- weather_datapoints_unpartitioned until the copy is checked and it's dropped by hand.
+BEGIN;
+
+-- Rows without interval_start have no partition to go to (not even a default one, the partition
+-- key must be NOT NULL), so they would be left behind. Fix or delete them before migrating.
+DO
+$$
+DECLARE
+    missing BIGINT;
+BEGIN
+    SELECT count(*) INTO missing FROM weather_datapoints WHERE interval_start IS NULL;
+    IF missing > 0 THEN
+        RAISE EXCEPTION '% weather_datapoints rows have no interval_start, not partitioning', missing;
+    END IF;
+END
+$$;
+
+ALTER TABLE weather_datapoints RENAME TO weather_datapoints_unpartitioned;
+ALTER TABLE weather_datapoints_unpartitioned RENAME CONSTRAINT weather_datapoints_pk TO weather_datapoints_unpartitioned_pk;
+ALTER TABLE weather_datapoints_unpartitioned RENAME CONSTRAINT weather_datapoints_pk2 TO weather_datapoints_unpartitioned_pk2;
+ALTER TABLE weather_datapoints_unpartitioned RENAME CONSTRAINT fk_weather_datapoints_station_arso_code
+    TO fk_weather_datapoints_unpartitioned_station_arso_code;
+
+CREATE TABLE weather_datapoints
+(
+    LIKE weather_datapoints_unpartitioned INCLUDING DEFAULTS
+) PARTITION BY RANGE (interval_start);
+-- The id sequence must outlive the original table.
+ALTER SEQUENCE weather_datapoints_id_seq OWNED BY weather_datapoints.id;
+-- Rows without interval_start would have no partition.
+ALTER TABLE weather_datapoints ALTER COLUMN interval_start SET NOT NULL;
+
+-- Unique constraints of partitioned tables must contain the partition key.
+ALTER TABLE weather_datapoints
+    ADD CONSTRAINT weather_datapoints_pk
+        primary key (id, interval_start);
+ALTER TABLE weather_datapoints
+    ADD CONSTRAINT weather_datapoints_pk2
+        unique (station_arso_code, interval_start, interval_end);
+ALTER TABLE weather_datapoints
+    ADD CONSTRAINT fk_weather_datapoints_station_arso_code
+        foreign key (station_arso_code) references stations (arso_code);
+
+-- Datapoints arrive roughly in time order, so tiny BRIN indexes are enough for time range scans.
+CREATE INDEX weather_datapoints_interval_start_brin ON weather_datapoints USING brin (interval_start);
+CREATE INDEX weather_datapoints_interval_end_brin ON weather_datapoints USING brin (interval_end);
+
+-- Creates missing monthly partitions of months from from_time to to_time. Returns the number of created partitions.
+CREATE OR REPLACE FUNCTION create_weather_datapoints_partitions(from_time TIMESTAMP, to_time TIMESTAMP)
+    RETURNS INTEGER
+    LANGUAGE plpgsql
+AS
+$$
+DECLARE
+    partition_start TIMESTAMP := date_trunc('month', from_time);
+    partition_name  TEXT;
+    created         INTEGER   := 0;
+BEGIN
+    WHILE partition_start <= to_time
+        LOOP
+            partition_name := 'weather_datapoints_' || to_char(partition_start, 'YYYY_MM');
+            IF to_regclass(partition_name) IS NULL THEN
+                -- Loaders may create the same partition concurrently.
+                PERFORM pg_advisory_xact_lock(hashtext('create_weather_datapoints_partitions'));
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE format('CREATE TABLE %I PARTITION OF weather_datapoints FOR VALUES FROM (%L) TO (%L)',
+                                   partition_name, partition_start, partition_start + INTERVAL '1 month');
+                    created := created + 1;
+                END IF;
+            END IF;
+            partition_start := partition_start + INTERVAL '1 month';
+        END LOOP;
+    RETURN created;
+END
+$$;
+
+SELECT create_weather_datapoints_partitions(
+               COALESCE(MIN(interval_start), (now() AT TIME ZONE 'UTC')),
+               (now() AT TIME ZONE 'UTC') + INTERVAL '3 months')
+FROM weather_datapoints_unpartitioned;
+
+INSERT INTO weather_datapoints
+SELECT *
+FROM weather_datapoints_unpartitioned;
+
+COMMIT;
+
+ANALYZE weather_datapoints;
@@ -0,0 +1,27 @@
+-- Bitmaps of 10-minute slots covered by datapoints, per station and month, see coverage.py.
+-- Bit n of a month is the slot starting n * 10 minutes after its first midnight (UTC).
+CREATE TABLE IF NOT EXISTS station_coverage
+(
+    station_arso_code VARCHAR(255) NOT NULL,
+    month             DATE         NOT NULL, -- first day of the month
+    slots             BIT(4464)    NOT NULL, -- 31 days of 144 slots
+    constraint station_coverage_pk
+        primary key (station_arso_code, month),
+    constraint fk_station_coverage_station_arso_code
+        foreign key (station_arso_code) references stations (arso_code)
+);
+
+-- Coverage of datapoints loaded before the table existed.
+INSERT INTO station_coverage (station_arso_code, month, slots)
+SELECT station_arso_code,
+       date_trunc('month', slot_start)::date,
+       bit_or(set_bit(repeat('0', 4464)::bit(4464),
+                      (extract(epoch FROM slot_start - date_trunc('month', slot_start)) / 600)::integer, 1))
+FROM weather_datapoints,
+     generate_series(
+             to_timestamp(floor(extract(epoch FROM interval_start) / 600) * 600) AT TIME ZONE 'UTC',
+             GREATEST(interval_start, interval_end - INTERVAL '1 microsecond'),
+             INTERVAL '10 minutes') AS slot_start
+GROUP BY 1, 2
+ON CONFLICT (station_arso_code, month) DO UPDATE SET
+    slots = station_coverage.slots | excluded.slots;
@@ -0,0 +1,13 @@
+-- Progress of loading each archive file, see checkpoints.py.
+CREATE TABLE IF NOT EXISTS ingest_checkpoints
+(
+    file_name  TEXT      NOT NULL
+        constraint ingest_checkpoints_pk
+            primary key,
+    file_size  BIGINT    NOT NULL,
+    lines_done INTEGER   NOT NULL, -- lines committed, the next batch starts at this line
+    done       BOOLEAN   NOT NULL,
+    attempts   INTEGER   NOT NULL DEFAULT 0, -- failed attempts since the last committed batch
+    error      TEXT,
+    updated_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'UTC')
+);
@@ -0,0 +1,16 @@
+-- Moments of each variable per station, day of the year and hour, see climatology.py.
+-- Cell n is day n // 24 of a leap year's calendar (0 is 1 Jan, 59 is 29 Feb) and hour n % 24 (UTC).
+-- Filled by `slo-weather climatology rebuild`, then kept up to date by loaders.
+CREATE TABLE IF NOT EXISTS station_climatology
+(
+    station_arso_code VARCHAR(255)     NOT NULL,
+    variable          VARCHAR(64)      NOT NULL,
+    cell              SMALLINT         NOT NULL,
+    count             INTEGER          NOT NULL,
+    mean              DOUBLE PRECISION NOT NULL,
+    m2                DOUBLE PRECISION NOT NULL, -- sum of squared deviations from the mean
+    constraint station_climatology_pk
+        primary key (station_arso_code, variable, cell),
+    constraint fk_station_climatology_station_arso_code
+        foreign key (station_arso_code) references stations (arso_code)
+);
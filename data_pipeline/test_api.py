@@ -0,0 +1,204 @@
+import asyncio
+import datetime
+import json
+import unittest
+
+from data_pipeline.api import ApiServer, ResponseCache
+from data_pipeline.db import datapoints_changed_payload
+
+UTC = datetime.timezone.utc
+
+
+def datapoint(station: str, interval_end: datetime.datetime) -> dict:
+    return {
+        "station_arso_code": station,
+        "interval_start": interval_end - datetime.timedelta(minutes=30),
+        "interval_end": interval_end,
+        "temperature_air_avg": 12.5,
+    }
+
+
+class FakeStorage:
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+        self.queries = 0
+        self.changes = asyncio.Queue()
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def latest(self, stations):
+        self.queries += 1
+        latest = {}
+        for row in sorted(self.rows, key=lambda row: row["interval_end"]):
+            if stations is None or row["station_arso_code"] in stations:
+                latest[row["station_arso_code"]] = row
+        return [latest[station] for station in sorted(latest)]
+
+    async def station_range(self, station, start, end):
+        self.queries += 1
+        return [row for row in self.rows if row["station_arso_code"] == station and start <= row["interval_end"]
+                and (end is None or row["interval_end"] <= end)]
+
+    async def stream_station_range(self, station, start, end):
+        rows = await self.station_range(station, start, end)
+        for i in range(0, len(rows), 2):
+            yield rows[i:i + 2]
+
+    async def at(self, time):
+        self.queries += 1
+        return [row for row in self.rows if row["interval_start"] < time <= row["interval_end"]]
+
+    async def listen(self):
+        async def changes():
+            while True:
+                yield await self.changes.get()
+
+        return changes()
+
+
+async def request(port: int, target: str, headers: dict = None) -> tuple[int, dict, bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    lines = [f"GET {target} HTTP/1.1", "Host: localhost", "Connection: close"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    response_headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+
+    if response_headers.get("transfer-encoding") == "chunked":
+        chunks = []
+        while True:
+            size, _, body = body.partition(b"\r\n")
+            size = int(size, 16)
+            if size == 0:
+                break
+            chunks.append(body[:size])
+            body = body[size + 2:]
+        body = b"".join(chunks)
+    return int(status_line.split()[1]), response_headers, body
+
+
+class TestApi(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        start = datetime.datetime(2024, 3, 1, tzinfo=UTC)
+        self.rows = [
+            datapoint(station, start + datetime.timedelta(minutes=30 * i))
+            for station in ("BILJE", "GODNJE")
+            for i in range(10)
+        ]
+        self.storage = FakeStorage(self.rows)
+        self.api = ApiServer(self.storage)
+        self.watcher = asyncio.create_task(self.api.watch_changes())
+        await asyncio.sleep(0)
+
+        self.server = await asyncio.start_server(self.api.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.watcher.cancel()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def notify(self, stations, start, end):
+        await self.storage.changes.put(json.loads(datapoints_changed_payload(stations, start, end)))
+        await asyncio.sleep(0.01)
+
+    async def test_latest_is_cached_and_revalidated(self):
+        status, headers, body = await request(self.port, "/latest")
+        self.assertEqual(200, status)
+        self.assertEqual(["BILJE", "GODNJE"], [row["station_arso_code"] for row in json.loads(body)])
+        self.assertEqual("2024-03-01T04:30:00+00:00", json.loads(body)[0]["interval_end"])
+
+        status, _, cached_body = await request(self.port, "/latest")
+        self.assertEqual((200, body), (status, cached_body))
+        self.assertEqual(1, self.storage.queries)
+
+        status, _, body = await request(self.port, "/latest", {"If-None-Match": headers["etag"]})
+        self.assertEqual((304, b""), (status, body))
+        self.assertEqual(1, self.storage.queries)
+
+    async def test_invalidated_by_notification(self):
+        _, headers, _ = await request(self.port, "/latest?station=BILJE")
+        await request(self.port, "/latest?station=GODNJE")
+        self.assertEqual(2, self.storage.queries)
+
+        self.rows.append(datapoint("BILJE", datetime.datetime(2024, 3, 2, tzinfo=UTC)))
+        await self.notify(["BILJE"], datetime.datetime(2024, 3, 2, tzinfo=UTC), datetime.datetime(2024, 3, 2, tzinfo=UTC))
+
+        status, _, body = await request(self.port, "/latest?station=BILJE", {"If-None-Match": headers["etag"]})
+        self.assertEqual(200, status)
+        self.assertEqual("2024-03-02T00:00:00+00:00", json.loads(body)[0]["interval_end"])
+        await request(self.port, "/latest?station=GODNJE")
+        self.assertEqual(3, self.storage.queries)
+
+    async def test_invalidation_by_time_range(self):
+        await request(self.port, "/observations?time=2024-03-01T01:15:00")
+        await self.notify(["BILJE"], datetime.datetime(2024, 3, 2, tzinfo=UTC), datetime.datetime(2024, 3, 3, tzinfo=UTC))
+        status, _, body = await request(self.port, "/observations?time=2024-03-01T01:15:00")
+        self.assertEqual(200, status)
+        self.assertEqual(["BILJE", "GODNJE"], [row["station_arso_code"] for row in json.loads(body)])
+        self.assertEqual(1, self.storage.queries)
+
+        await self.notify(["BILJE"], datetime.datetime(2024, 3, 1, tzinfo=UTC), datetime.datetime(2024, 3, 1, 2, tzinfo=UTC))
+        await request(self.port, "/observations?time=2024-03-01T01:15:00")
+        self.assertEqual(2, self.storage.queries)
+
+    async def test_long_range_is_streamed(self):
+        status, headers, body = await request(self.port, "/stations/BILJE/observations?start=2024-03-01T01:00:00")
+        self.assertEqual(200, status)
+        self.assertEqual("chunked", headers["transfer-encoding"])
+        self.assertEqual(8, len(json.loads(body)))
+
+        status, _, _ = await request(self.port, "/stations/BILJE/observations?start=2024-03-01T01:00:00",
+                                     {"If-None-Match": headers["etag"]})
+        self.assertEqual(304, status)
+
+        status, _, body = await request(self.port, "/stations/UNKNOWN/observations?start=2024-03-01T01:00:00")
+        self.assertEqual((200, []), (status, json.loads(body)))
+
+    async def test_short_range_is_cached(self):
+        target = "/stations/GODNJE/observations?start=2024-03-01T01:00:00&end=2024-03-01T02:00:00"
+        status, headers, body = await request(self.port, target)
+        self.assertEqual(200, status)
+        self.assertIn("content-length", headers)
+        self.assertEqual(3, len(json.loads(body)))
+        await request(self.port, target)
+        self.assertEqual(1, self.storage.queries)
+
+    async def test_errors(self):
+        self.assertEqual(400, (await request(self.port, "/observations"))[0])
+        self.assertEqual(400, (await request(self.port, "/observations?time=yesterday"))[0])
+        self.assertEqual(404, (await request(self.port, "/stations"))[0])
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_not_cached_when_disabled_or_invalidated_meanwhile(self):
+        cache = ResponseCache()
+        cache.put("key", object(), cache.generation)
+        self.assertEqual(0, len(cache.entries))
+
+        cache.enabled = True
+        generation = cache.generation
+        cache.invalidate({"BILJE"})
+        cache.put("key", object(), generation)
+        self.assertEqual(0, len(cache.entries))
+
+    def test_payload_without_stations_clears(self):
+        cache = ResponseCache(enabled=True)
+        cache.put("key", object(), cache.generation)
+        cache.invalidate_payload({})
+        self.assertEqual(0, len(cache.entries))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from data_pipeline import archive_codec
+from data_pipeline.archive_index import build_index, read_line
+from data_pipeline.archive_util import get_daily_archive_files, get_input_files_list
+from data_pipeline.compaction import read_rows_until_truncated
+from data_pipeline.jsonl_util import read_jsonl
+from scraper.postprocessing import ZstdPlugin
+
+_example = (Path(__file__).parent.parent / "data" / "example.xml").read_text(encoding="utf-8")
+# The header and first few metData blocks, the whole file takes long to train on.
+EXAMPLE_XML = _example[:_example.index("<metData>")] + "".join(
+    "<metData>" + block for block in _example.split("<metData>")[1:20]) + "</data>"
+
+
+def example_rows(count: int) -> list[dict]:
+    return [{"meteosiId": f"S{i:03d}_", "xml": EXAMPLE_XML.replace("GODNJE", f"S{i:03d}")} for i in range(count)]
+
+
+def jsonl(rows: list[dict]) -> bytes:
+    return b"".join(json.dumps(row).encode("utf-8") + b"\n" for row in rows)
+
+
+class TestArchiveCodec(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+        self.rows = example_rows(3)
+        self.dictionary = archive_codec.train_dictionary(jsonl(example_rows(40)).splitlines(), size=16 * 1024)
+        archive_codec.save_dictionary(self.dictionary, archive_codec.dictionary_dir(self.data_dir))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def compressed(self, content: bytes) -> bytes:
+        fp = io.BytesIO()
+        writer = archive_codec.FrameWriter(fp, self.dictionary)
+        writer.write(content)
+        writer.close()
+        return fp.getvalue()
+
+    def test_frame_per_line(self):
+        content = jsonl(self.rows)
+        data = self.compressed(content)
+        frames = list(archive_codec.iter_frames(data, archive_codec.dictionary_dir(self.data_dir)))
+        self.assertEqual(content.splitlines(keepends=True), [line for _, _, line in frames])
+        self.assertEqual(len(data), sum(length for _, length, _ in frames))
+        offset, length, line = frames[1]
+        self.assertEqual(line, archive_codec.decompress_frame(
+            data[offset:offset + length], archive_codec.dictionary_dir(self.data_dir)))
+
+    def test_split_writes(self):
+        content = jsonl(self.rows) + b"no newline at the end"
+        fp = io.BytesIO()
+        writer = archive_codec.FrameWriter(fp, self.dictionary)
+        for i in range(0, len(content), 1000):
+            writer.write(content[i:i + 1000])
+        writer.close()
+        self.assertEqual(content, archive_codec.decompress(fp.getvalue(), archive_codec.dictionary_dir(self.data_dir)))
+
+    def test_truncated(self):
+        data = self.compressed(jsonl(self.rows))
+        for end in (5, len(data) // 2, len(data) - 1):
+            with self.assertRaises(EOFError):
+                archive_codec.decompress(data[:end], archive_codec.dictionary_dir(self.data_dir))
+
+    def test_missing_dictionary(self):
+        with self.assertRaises(archive_codec.BadZstdFile):
+            archive_codec.decompress(self.compressed(jsonl(self.rows)), os.path.join(self.data_dir, "missing"))
+
+    def test_recompress(self):
+        gz_path = os.path.join(self.data_dir, "weather_data_2023-11-10T15-05-00.json.gz")
+        with gzip.open(gz_path, mode="wb") as fp:
+            fp.write(jsonl(self.rows))
+
+        archive_codec.main(remove_sources=False, data_dir=self.data_dir)
+        zst_path = gz_path[:-len(".json.gz")] + archive_codec.ZSTD_SUFFIX
+        self.assertEqual(self.rows, read_jsonl(zst_path))
+        self.assertLess(os.path.getsize(zst_path), os.path.getsize(gz_path))
+        # Only the recompressed version is read.
+        self.assertEqual([zst_path], get_daily_archive_files(self.data_dir))
+
+        index = build_index(zst_path)
+        self.assertEqual("zstd_frames", index["layout"])
+        self.assertEqual(self.rows[2], read_line(zst_path, index, index["lines"][2]))
+
+        archive_codec.main(remove_sources=True, data_dir=self.data_dir)
+        self.assertFalse(os.path.exists(gz_path))
+
+    def test_compacted_source_recompressed(self):
+        zst_path = os.path.join(self.data_dir, "weather_data_2023-11-10T15-05-00.json.zst")
+        with open(zst_path, mode="wb") as fp:
+            fp.write(self.compressed(jsonl(self.rows)))
+        with open(os.path.join(self.data_dir, "meteo_data_segment_2023-11.manifest.json"), mode="w") as fp:
+            json.dump({"segment": "meteo_data_segment_2023-11.json.gz",
+                       "sources": ["weather_data_2023-11-10T15-05-00.json.gz"]}, fp)
+        self.assertEqual([os.path.join(self.data_dir, "meteo_data_segment_2023-11.json.gz")],
+                         get_input_files_list(self.data_dir))
+
+    def test_read_rows_until_truncated(self):
+        path = os.path.join(self.data_dir, "weather_data_2023-11-10T15-05-00.json.zst")
+        data = self.compressed(jsonl(self.rows))
+        with open(path, mode="wb") as fp:
+            fp.write(data[:-10])
+        rows, error = read_rows_until_truncated(path)
+        self.assertEqual(self.rows[:2], rows)
+        self.assertIn("EOFError", error)
+
+    def test_zstd_plugin(self):
+        fp = io.BytesIO()
+        plugin = ZstdPlugin(fp, {"zstd_dictionary_dir": archive_codec.dictionary_dir(self.data_dir)})
+        content = jsonl(self.rows)
+        plugin.write(content[:100])
+        plugin.write(content[100:])
+        plugin.close()
+        self.assertFalse(fp.closed)
+        frames = list(archive_codec.iter_frames(fp.getvalue(), archive_codec.dictionary_dir(self.data_dir)))
+        self.assertEqual(3, len(frames))
+        self.assertEqual(content, b"".join(line for _, _, line in frames))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from data_pipeline.archive_index import (
+    build_index,
+    iter_datapoints,
+    load_index,
+    members_path,
+    read_line,
+    remove_member_copies,
+)
+from data_pipeline.jsonl_util import read_jsonl
+from data_pipeline.parse_cache import ParseCache
+
+
+def station_row(met_data: list, station: str) -> dict:
+    root = ET.Element("data")
+    for m in met_data:
+        m = ET.fromstring(ET.tostring(m))
+        m.find("domain_meteosiId").text = f"{station}_"
+        root.append(m)
+    return {"meteosiId": f"{station}_", "xml": ET.tostring(root, encoding="unicode")}
+
+
+class TestArchiveIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+
+        example = ET.parse(Path(__file__).parent.parent / "data" / "example.xml").getroot()
+        # validEnd from 10.11.2023 15:00 UTC back to 10.11.2023 13:10 UTC
+        met_data = example.findall("metData")[:12]
+        self.rows = [station_row(met_data[:6], "GODNJE"), station_row(met_data[6:], "BILJE")]
+
+        self.gz_path = os.path.join(self.data_dir, "weather_data_2023-11-10T15-05-00.json.gz")
+        with gzip.open(self.gz_path, mode="wt") as fp:
+            for row in self.rows:
+                fp.write(json.dumps(row) + "\n")
+
+        # Written like compaction writes segments, a gzip member per line.
+        self.segment_path = os.path.join(self.data_dir, "meteo_data_segment_2023-10.json.gz")
+        with open(self.segment_path, mode="wb") as fp:
+            for row in self.rows:
+                fp.write(gzip.compress(json.dumps(row).encode("utf-8") + b"\n", mtime=0))
+        with open(os.path.join(self.data_dir, "meteo_data_segment_2023-10.manifest.json"), mode="w") as fp:
+            json.dump({"segment": "meteo_data_segment_2023-10.json.gz", "sources": []}, fp)
+
+        self.plain_path = os.path.join(self.data_dir, "weather_data_2023-11-11T15-05-00.json")
+        with open(self.plain_path, mode="w") as fp:
+            for row in self.rows:
+                fp.write(json.dumps(row) + "\n")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_build_index(self):
+        with open(self.segment_path, mode="rb") as fp:
+            original = fp.read()
+        stat = os.stat(self.segment_path)
+        index = build_index(self.segment_path)
+        self.assertEqual("gzip_members", index["layout"])
+        self.assertEqual(["GODNJE", "BILJE"], [line["station"] for line in index["lines"]])
+        self.assertEqual(self.rows[1], read_line(self.segment_path, index, index["lines"][1]))
+        self.assertEqual(index, load_index(self.segment_path))
+        # The archive file is left as it was.
+        with open(self.segment_path, mode="rb") as fp:
+            self.assertEqual(original, fp.read())
+        self.assertEqual(stat.st_mtime_ns, os.stat(self.segment_path).st_mtime_ns)
+
+        # Lines of a single gzip stream can't be read on their own.
+        self.assertIsNone(build_index(self.gz_path))
+        self.assertFalse(os.path.exists(self.gz_path + ".idx"))
+
+        index = build_index(self.plain_path)
+        self.assertEqual("plain", index["layout"])
+        self.assertEqual(0, index["lines"][0]["offset"])
+
+    def test_remove_member_copies(self):
+        build_index(self.segment_path)
+        with open(members_path(self.segment_path), mode="wb") as fp:
+            fp.write(b"")
+        self.assertIsNone(load_index(self.segment_path))
+        remove_member_copies(self.data_dir)
+        self.assertFalse(os.path.exists(members_path(self.segment_path)))
+        self.assertFalse(os.path.exists(self.segment_path + ".idx"))
+        self.assertEqual(self.rows, read_jsonl(self.segment_path))
+
+    def test_stale_index(self):
+        build_index(self.plain_path)
+        with open(self.plain_path, mode="a") as fp:
+            fp.write(json.dumps(self.rows[0]) + "\n")
+        self.assertIsNone(load_index(self.plain_path))
+        self.assertEqual(3, len(build_index(self.plain_path)["lines"]))
+
+    def test_iter_datapoints(self):
+        cache = ParseCache(os.path.join(self.data_dir, "parse_cache"))
+        # Without indexes files are read in full, and not indexed.
+        datapoints = list(iter_datapoints(stations=["BILJE"], data_dir=self.data_dir, cache=cache))
+        # 6 datapoints in each of the three files.
+        self.assertEqual(18, len(datapoints))
+        self.assertEqual({"BILJE"}, {d.station_arso_code for d in datapoints})
+        self.assertIsNone(load_index(self.segment_path))
+
+        build_index(self.segment_path)
+        build_index(self.plain_path)
+        self.assertEqual(datapoints, list(iter_datapoints(stations=["BILJE"], data_dir=self.data_dir, cache=cache)))
+
+        utc = datetime.timezone.utc
+        datapoints = list(iter_datapoints(
+            start=datetime.datetime(2023, 11, 10, 14, 20, tzinfo=utc),
+            end=datetime.datetime(2023, 11, 10, 14, 40, tzinfo=utc),
+            data_dir=self.data_dir,
+            cache=cache,
+        ))
+        self.assertEqual(9, len(datapoints))
+        self.assertEqual({"GODNJE"}, {d.station_arso_code for d in datapoints})
@@ -0,0 +1,105 @@
+import contextlib
+import importlib
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from data_pipeline import checkpoints
+from data_pipeline.checkpoints import MAX_ATTEMPTS, FileCheckpoint, plan
+from data_pipeline.paths_util import get_data_dir
+
+loader = importlib.import_module("data_pipeline.02_parse_meteo_data_archive")
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params))
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield self.conn
+
+
+class FakeWriter:
+    def __init__(self, fail_at_write=None):
+        self.pool = FakePool()
+        self.writes = []
+        self.fail_at_write = fail_at_write
+
+    def write(self, datapoints, checkpoint=None):
+        if len(self.writes) == self.fail_at_write:
+            raise ConnectionError("server closed the connection")
+        self.writes.append((len(datapoints), checkpoint))
+
+
+class TestCheckpoints(unittest.TestCase):
+    def test_plan(self):
+        paths = ["/data/a.json.gz", "/data/b.json.gz", "/data/c.json.gz", "/data/d.json.gz", "/data/e.json.gz"]
+        sizes = dict.fromkeys(paths, 100)
+        sizes["/data/d.json.gz"] = 200
+        saved = {
+            "a.json.gz": FileCheckpoint("a.json.gz", 100, 10, done=True),
+            "b.json.gz": FileCheckpoint("b.json.gz", 100, 4),
+            "c.json.gz": FileCheckpoint("c.json.gz", 100, 2, attempts=1, error="EOFError()"),
+            # Changed since it was loaded.
+            "d.json.gz": FileCheckpoint("d.json.gz", 100, 10, done=True),
+            "e.json.gz": FileCheckpoint("e.json.gz", 100, 0, attempts=MAX_ATTEMPTS, error="EOFError()"),
+        }
+
+        self.assertEqual([(path, 0) for path in paths], plan(paths, sizes, saved))
+        self.assertEqual([("/data/b.json.gz", 4), ("/data/c.json.gz", 2), ("/data/d.json.gz", 0),
+                          ("/data/e.json.gz", 0)],
+                         plan(paths, sizes, saved, resume=True))
+        self.assertEqual([("/data/c.json.gz", 2)], plan(paths, sizes, saved, retry_failed=True))
+
+
+@mock.patch.dict(os.environ, {"SLO_WEATHER_PARSE_CACHE": "off"})
+@mock.patch.object(checkpoints, "BATCH_LINES", 2)
+class TestBatchedLoad(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(get_data_dir(), "example.xml")) as fp:
+            xml = fp.read()
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "weather_data_2024-01-01T04-17-00.json")
+        with open(self.path, "w") as fp:
+            for _ in range(5):
+                fp.write(json.dumps({"xml": xml}) + "\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_batches_from_start_line(self):
+        writer = FakeWriter()
+        metrics = loader.upsert_datapoints_in_file(self.path, writer, start_line=1)
+
+        self.assertIsNone(metrics.error)
+        self.assertEqual([(3, False), (5, True)],
+                         [(checkpoint.lines_done, checkpoint.done) for _, checkpoint in writer.writes])
+        datapoints_per_line = writer.writes[0][0] // 2
+        self.assertGreater(datapoints_per_line, 0)
+        self.assertEqual(datapoints_per_line * 2, writer.writes[1][0])
+        self.assertEqual(os.path.getsize(self.path), writer.writes[0][1].file_size)
+
+    def test_failure_is_recorded(self):
+        writer = FakeWriter(fail_at_write=1)
+        metrics = loader.upsert_datapoints_in_file(self.path, writer)
+
+        self.assertIn("ConnectionError", metrics.error)
+        self.assertEqual([(2, False)], [(checkpoint.lines_done, checkpoint.done) for _, checkpoint in writer.writes])
+        (query, params), = writer.pool.conn.executed
+        self.assertIn("attempts = ingest_checkpoints.attempts + 1", query)
+        self.assertEqual(os.path.basename(self.path), params[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import contextlib
+import io
+import subprocess
+import sys
+import unittest
+
+from data_pipeline.cli import build_parser, compact, ingest
+
+
+class TestCli(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        output = subprocess.run(
+            [sys.executable, "-c",
+             "import sys, data_pipeline.cli; "
+             "print(sorted({m.split('.')[0] for m in sys.modules} & {'scrapy', 'lxml', 'psycopg', 'pydantic'}))"],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        self.assertEqual("[]", output.strip())
+
+    def test_parser(self):
+        parser = build_parser()
+
+        args = parser.parse_args(["ingest", "--source", "waters"])
+        self.assertEqual((ingest, "waters"), (args.func, args.source))
+
+        args = parser.parse_args(["ingest", "--resume"])
+        self.assertEqual((True, False, "processes"), (args.resume, args.retry_failed, args.executor))
+        args = parser.parse_args(["ingest", "--executor", "threads"])
+        self.assertEqual(("threads", False), (args.executor, args.rollups))
+        self.assertTrue(parser.parse_args(["ingest", "--rollups"]).rollups)
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            parser.parse_args(["ingest", "--resume", "--retry-failed"])
+
+        args = parser.parse_args(["compact", "--remove-sources"])
+        self.assertEqual((compact, True), (args.func, args.remove_sources))
+
+        args = parser.parse_args(["export", "--station", "GODNJE", "--station", "BILJE", "--start", "2024-01-01"])
+        self.assertEqual(["GODNJE", "BILJE"], args.station)
+        self.assertEqual("2024-01-01T00:00:00+00:00", args.start.isoformat())
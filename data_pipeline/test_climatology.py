@@ -0,0 +1,113 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from data_pipeline import climatology
+from data_pipeline.climatology import CELLS, CLIMATOLOGY_VARIABLES, DAYS, HOURS
+from data_pipeline.models import Datapoint
+from data_pipeline.parse_cache import FLOAT_FIELDS
+
+UTC = datetime.timezone.utc
+CET = datetime.timezone(datetime.timedelta(hours=1))
+
+
+def datapoint(station: str, interval_start: datetime.datetime, temperature: float = None) -> Datapoint:
+    values = {name: None for name in FLOAT_FIELDS}
+    values["temperature_air_avg"] = temperature
+    return Datapoint(station_arso_code=station, sunrise=interval_start, sunset=interval_start,
+                     interval_start=interval_start, interval_end=interval_start + datetime.timedelta(minutes=10),
+                     **values)
+
+
+class TestClimatology(unittest.TestCase):
+    def test_cells(self):
+        times = [
+            datetime.datetime(2023, 1, 1, 0, 5),
+            datetime.datetime(2024, 2, 29, 13, 0),
+            datetime.datetime(2023, 3, 1, 23, 59),
+            datetime.datetime(2024, 3, 1, 1, 0),
+            datetime.datetime(2024, 12, 31, 23, 50),
+        ]
+        cells = climatology.cells_of(np.array(times, dtype="datetime64[us]"))
+        self.assertEqual([0, 59 * HOURS + 13, 60 * HOURS + 23, 60 * HOURS + 1, CELLS - 1], cells.tolist())
+        self.assertEqual(cells.tolist(), [climatology.cell_of(t) for t in times])
+        # Aware datetimes are converted to UTC.
+        self.assertEqual(climatology.cell_of(datetime.datetime(2023, 1, 1, 23, 30)),
+                         climatology.cell_of(datetime.datetime(2023, 1, 2, 0, 30, tzinfo=CET)))
+
+    def test_merged_moments_match_all_values(self):
+        rng = np.random.default_rng(1)
+        keys = rng.integers(0, 5, 1000)
+        values = rng.normal(1013.0, 8.0, 1000)
+        values[::7] = np.nan
+
+        unique_keys, count, mean, m2 = climatology.moments(keys, values)
+        merged = (np.zeros(5, dtype=np.int64), np.zeros(5), np.zeros(5))
+        for part in np.array_split(np.arange(1000), 7):
+            part_keys, *part_moments = climatology.moments(keys[part], values[part])
+            current = tuple(a[part_keys] for a in merged)
+            for a, b in zip(merged, climatology.merge_moments(*current, *part_moments)):
+                a[part_keys] = b
+
+        for key in range(5):
+            selected = values[(keys == key) & ~np.isnan(values)]
+            self.assertEqual(len(selected), count[key])
+            self.assertEqual(len(selected), merged[0][key])
+            self.assertAlmostEqual(selected.mean(), mean[key])
+            self.assertAlmostEqual(selected.mean(), merged[1][key])
+            self.assertAlmostEqual(selected.var() * len(selected), merged[2][key], places=6)
+        self.assertEqual(list(range(5)), unique_keys.tolist())
+
+    def test_batch_rows(self):
+        t = datetime.datetime(2024, 7, 1, 12, tzinfo=UTC)
+        datapoints = [datapoint("BILJE", t, 20.0), datapoint("BILJE", t + datetime.timedelta(minutes=10), 22.0),
+                      datapoint("GODNJE", t, None)]
+        rows = climatology.batch_rows(datapoints)
+        self.assertEqual([("BILJE", "temperature_air_avg", climatology.cell_of(t), 2, 21.0, 2.0)], rows)
+        self.assertEqual([], climatology.batch_rows([]))
+
+    def test_accumulator_rows(self):
+        times = np.array(["2024-07-01T12:00", "2024-07-01T12:10", "2023-07-01T12:20"], dtype="datetime64[us]")
+        chunk = {"station": np.array([1, 1, 1], dtype=np.int32), "interval_start": times,
+                 **{variable: np.full(3, np.nan, dtype=np.float32) for variable in CLIMATOLOGY_VARIABLES}}
+        chunk["temperature_air_avg"] = np.array([20.0, 22.0, 24.0], dtype=np.float32)
+        accumulator = climatology.Accumulator(2)
+        accumulator.add_chunk({name: values[:1] for name, values in chunk.items()})
+        accumulator.add_chunk({name: values[1:] for name, values in chunk.items()})
+        (row,) = accumulator.rows(["BILJE", "GODNJE"])
+        self.assertEqual(("GODNJE", "temperature_air_avg", climatology.cells_of(times[:1])[0], 3, 22.0), row[:5])
+        self.assertAlmostEqual(8.0, row[5])
+
+    def test_anomalies(self):
+        count = np.zeros((2, len(CLIMATOLOGY_VARIABLES), CELLS), dtype=np.int64)
+        mean = np.zeros(count.shape)
+        m2 = np.zeros(count.shape)
+        cell = climatology.cell_of(datetime.datetime(2024, 1, 3, 12))
+        # Values with mean 12 and standard deviation 2 on days around 3 January, 12:00
+        # (back to 31 December), and a day out of the window.
+        for day_offset in (-3, -1, 0, 2):
+            count[1, 0, (cell + day_offset * HOURS) % CELLS] = 10
+            mean[1, 0, (cell + day_offset * HOURS) % CELLS] = 12.0
+            m2[1, 0, (cell + day_offset * HOURS) % CELLS] = 40.0
+        count[1, 0, cell + 8 * HOURS] = 10
+        mean[1, 0, cell + 8 * HOURS] = 100.0
+
+        normals = climatology.Climatology(["BILJE", "GODNJE"], count, mean, m2)
+        anomalies = normals.anomalies(datapoint("GODNJE", datetime.datetime(2025, 1, 3, 12, 10, tzinfo=UTC), 16.0))
+        anomaly = anomalies["temperature_air_avg"]
+        self.assertEqual(40, anomaly.count)
+        self.assertAlmostEqual(12.0, anomaly.normal, places=5)
+        self.assertAlmostEqual(2.0, anomaly.std, places=5)
+        self.assertAlmostEqual(2.0, anomaly.z_score, places=5)
+
+        # The window wraps around the year, 24 December only reaches 31 December.
+        self.assertEqual(10, normals.count[1, 0, (DAYS - 8) * HOURS + 12])
+        # Not enough values, other variables or stations.
+        self.assertEqual({}, normals.anomalies(
+            datapoint("GODNJE", datetime.datetime(2025, 6, 3, 12, tzinfo=UTC), 16.0)))
+        self.assertEqual({}, normals.anomalies(datapoint("ARSO", datetime.datetime(2025, 1, 3, 12, tzinfo=UTC), 16.0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
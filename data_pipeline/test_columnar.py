@@ -0,0 +1,60 @@
+import struct
+import unittest
+
+import numpy as np
+
+from data_pipeline.columnar import BinaryCopyDecoder
+
+COLUMNS = {"station": "int4", "interval_end": "timestamp", "temperature_air_avg": "float4"}
+# 2024-01-01T00:10 in microseconds since 2000-01-01.
+INTERVAL_END = (8766 * 86400 + 600) * 1_000_000
+
+
+def copy_data(rows: list[tuple[int, int, float]]) -> bytes:
+    """Binary COPY output of rows of the COLUMNS."""
+    data = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    for station, interval_end, value in rows:
+        data += struct.pack(">hiiiqif", 3, 4, station, 8, interval_end, 4, value)
+    return data + struct.pack(">h", -1)
+
+
+def decode(data: bytes, chunk_rows: int, piece: int) -> list[dict]:
+    decoder = BinaryCopyDecoder(COLUMNS, chunk_rows)
+    chunks = []
+    for i in range(0, len(data), piece):
+        chunks.extend(decoder.feed(data[i:i + piece]))
+    chunks.extend(decoder.finish())
+    return chunks
+
+
+class TestColumnar(unittest.TestCase):
+    def test_decode_in_chunks(self):
+        rows = [(i % 3, INTERVAL_END + i * 600_000_000, float("nan") if i == 4 else i / 2) for i in range(7)]
+
+        # Data arrives in pieces that don't line up with rows.
+        chunks = decode(copy_data(rows), chunk_rows=3, piece=5)
+
+        self.assertEqual([3, 3, 1], [len(chunk["station"]) for chunk in chunks])
+        station = np.concatenate([chunk["station"] for chunk in chunks])
+        self.assertEqual(np.dtype(np.int32), station.dtype)
+        self.assertEqual([0, 1, 2, 0, 1, 2, 0], station.tolist())
+        interval_end = np.concatenate([chunk["interval_end"] for chunk in chunks])
+        self.assertEqual(np.datetime64("2024-01-01T00:10:00", "us"), interval_end[0])
+        self.assertEqual(np.datetime64("2024-01-01T01:10:00", "us"), interval_end[6])
+        values = np.concatenate([chunk["temperature_air_avg"] for chunk in chunks])
+        self.assertEqual(np.dtype(np.float32), values.dtype)
+        np.testing.assert_array_equal([0, 0.5, 1, 1.5, np.nan, 2.5, 3], values)
+
+    def test_empty(self):
+        self.assertEqual([], decode(copy_data([]), chunk_rows=3, piece=4))
+
+    def test_null(self):
+        data = copy_data([(0, INTERVAL_END, 1.0)])
+        # Length -1 is NULL, followed by no value.
+        data = data[:-10] + struct.pack(">i", -1) + data[-2:]
+        with self.assertRaises(ValueError):
+            decode(data, chunk_rows=3, piece=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from data_pipeline.archive_index import build_index, read_line
+from data_pipeline.archive_util import get_input_files_list
+from data_pipeline.compaction import compact, read_rows_until_truncated
+
+
+def station_xml(met_data: list, station: str) -> str:
+    root = ET.Element("data")
+    for m in met_data:
+        m = ET.fromstring(ET.tostring(m))
+        m.find("domain_meteosiId").text = station
+        root.append(m)
+    return ET.tostring(root, encoding="unicode")
+
+
+class TestCompaction(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+
+        example = ET.parse(Path(__file__).parent.parent / "data" / "example.xml").getroot()
+        self.met_data = example.findall("metData")[:12]
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def write_daily_file(self, batch_time: str, met_data: list, truncate: bool = False) -> str:
+        path = os.path.join(self.data_dir, f"weather_data_{batch_time}.json.gz")
+        with gzip.open(path, mode="wt") as fp:
+            for station in ["GODNJE_", "BILJE_"]:
+                fp.write(json.dumps({"meteosiId": station, "xml": station_xml(met_data, station)}) + "\n")
+        if truncate:
+            with open(path, mode="rb") as fp:
+                content = fp.read()
+            with open(path, mode="wb") as fp:
+                fp.write(content[:len(content) // 2])
+        return path
+
+    def test_compact(self):
+        # Newest blocks are first in ARSO XMLs, consecutive files overlap.
+        self.write_daily_file("2024-01-01T04-17-00", self.met_data[4:])
+        self.write_daily_file("2024-01-02T04-17-00", self.met_data[2:10])
+        self.write_daily_file("2024-01-03T04-17-00", self.met_data[:8])
+        self.write_daily_file("2024-01-04T04-17-00", self.met_data[:2], truncate=True)
+        current = self.write_daily_file("2024-02-01T04-17-00", self.met_data[:2])
+
+        manifests = compact(self.data_dir, datetime.date(2024, 2, 10))
+
+        self.assertEqual(1, len(manifests))
+        manifest = manifests[0]
+        self.assertEqual("2024-01", manifest["month"])
+        self.assertEqual(4, len(manifest["sources"]))
+        self.assertEqual(["weather_data_2024-01-04T04-17-00.json.gz"], list(manifest["truncated"].keys()))
+        self.assertEqual(2 * 12, manifest["blocks_out"])
+
+        self.assertEqual(
+            [os.path.join(self.data_dir, "meteo_data_segment_2024-01.json.gz"), current],
+            get_input_files_list(self.data_dir),
+        )
+
+        rows, error = read_rows_until_truncated(os.path.join(self.data_dir, manifest["segment"]))
+        self.assertIsNone(error)
+        self.assertEqual(["BILJE_", "GODNJE_"], sorted({row["meteosiId"] for row in rows}))
+        for row in rows:
+            starts = [m.find("validStart").text for m in ET.fromstring(row["xml"]).findall("metData")]
+            self.assertEqual(len(starts), len(set(starts)))
+        # Rows are gzip members, which can be indexed and read on their own.
+        index = build_index(os.path.join(self.data_dir, manifest["segment"]))
+        self.assertEqual(len(rows), len(index["lines"]))
+        self.assertEqual(rows[-1], read_line(os.path.join(self.data_dir, manifest["segment"]), index, index["lines"][-1]))
+
+        # Already compacted months are skipped.
+        self.assertEqual([], compact(self.data_dir, datetime.date(2024, 2, 10)))
+
+    def test_compact_remove_sources(self):
+        source = self.write_daily_file("2024-01-01T04-17-00", self.met_data)
+        compact(self.data_dir, datetime.date(2024, 2, 10), remove_sources=True)
+        self.assertFalse(os.path.exists(source))
+        self.assertEqual(
+            [os.path.join(self.data_dir, "meteo_data_segment_2024-01.json.gz")],
+            get_input_files_list(self.data_dir),
+        )
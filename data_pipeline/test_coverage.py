@@ -0,0 +1,105 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from data_pipeline.coverage import (MONTH_SLOTS, SLOTS_PER_DAY, assemble, find_gaps, from_bit_string,
+                                    month_bitmaps, recoverable_stations, slot_of, slots_of, to_bit_string)
+from data_pipeline.test_datapoint_writer import datapoint
+
+UTC = datetime.timezone.utc
+
+
+class FakeConnection:
+    """Answers queries by a part of their text, like a psycopg connection with the default row factory."""
+
+    def __init__(self, results: dict[str, list[tuple]]):
+        self.results = results
+
+    def execute(self, query, params=None):
+        for part, rows in self.results.items():
+            if part in query:
+                return FakeCursor(rows)
+        raise AssertionError(f"Unexpected query {query}")
+
+
+class FakeCursor:
+    def __init__(self, rows: list[tuple]):
+        self.rows = rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class TestCoverage(unittest.TestCase):
+    def test_slots_of(self):
+        t = datetime.datetime(2024, 3, 1, 12, tzinfo=UTC)
+        self.assertEqual([slot_of(t)], list(slots_of(t, t + datetime.timedelta(minutes=10))))
+        self.assertEqual(3, len(slots_of(t, t + datetime.timedelta(minutes=30))))
+        # Naive datetimes are UTC.
+        self.assertEqual(slot_of(t), slot_of(t.replace(tzinfo=None)))
+
+    def test_month_bitmaps(self):
+        # 30 minutes from 23:50 on the last day of February cross into March.
+        t = datetime.datetime(2024, 2, 29, 23, 50, tzinfo=UTC)
+        bitmaps = month_bitmaps([datapoint("BILJE", t, 30), datapoint("BILJE", t, 10), datapoint("GODNJE", t, 10)])
+
+        self.assertEqual({("BILJE", datetime.date(2024, 2, 1)), ("BILJE", datetime.date(2024, 3, 1)),
+                          ("GODNJE", datetime.date(2024, 2, 1))}, set(bitmaps))
+        self.assertEqual([29 * SLOTS_PER_DAY - 1], np.flatnonzero(bitmaps[("BILJE", datetime.date(2024, 2, 1))]).tolist())
+        self.assertEqual([0, 1], np.flatnonzero(bitmaps[("BILJE", datetime.date(2024, 3, 1))]).tolist())
+
+    def test_bit_string(self):
+        bits = np.zeros(MONTH_SLOTS, dtype=bool)
+        bits[[0, 5, MONTH_SLOTS - 1]] = True
+        s = to_bit_string(bits)
+        self.assertEqual(MONTH_SLOTS, len(s))
+        self.assertEqual("100001", s[:6])
+        np.testing.assert_array_equal(bits, from_bit_string(s))
+
+    def test_assemble_and_find_gaps(self):
+        february, march = datetime.date(2024, 2, 1), datetime.date(2024, 3, 1)
+        first = slot_of(datetime.datetime(2024, 2, 29, 23, tzinfo=UTC))
+        end = slot_of(datetime.datetime(2024, 3, 1, 1, tzinfo=UTC))
+        february_bits = np.ones(MONTH_SLOTS, dtype=bool)
+        february_bits[29 * SLOTS_PER_DAY - 2] = False
+        march_bits = np.zeros(MONTH_SLOTS, dtype=bool)
+        march_bits[3:] = True
+
+        covered = assemble([(february, february_bits), (march, march_bits)], first, end)
+
+        # Bits after the 29th of February are not slots and don't leak into March.
+        self.assertEqual(12, len(covered))
+        self.assertEqual([(first + 4, first + 5), (first + 6, first + 9)], find_gaps(covered, first))
+        self.assertEqual([(0, 12)], find_gaps(assemble([], first, end)))
+        self.assertEqual([], find_gaps(np.ones(5, dtype=bool)))
+
+    def test_recoverable_stations(self):
+        now = datetime.datetime(2024, 3, 3, 12, 5, tzinfo=UTC)
+        march = datetime.date(2024, 3, 1)
+        complete = np.ones(MONTH_SLOTS, dtype=bool)
+        gap = complete.copy()
+        gap[SLOTS_PER_DAY + 3] = False
+        conn = FakeConnection({
+            # station_latest stores naive UTC times.
+            "MAX(interval_end)": [(datetime.datetime(2024, 3, 3, 12),)],
+            "FROM station_latest WHERE": [("BILJE",), ("GODNJE",)],
+            "FROM station_coverage": [("BILJE", march, to_bit_string(complete)), ("GODNJE", march, to_bit_string(gap))],
+        })
+        self.assertEqual(["GODNJE"], recoverable_stations(conn, now))
+
+        # Nothing was loaded within the window.
+        conn.results["MAX(interval_end)"] = [(datetime.datetime(2024, 2, 1),)]
+        self.assertEqual([], recoverable_stations(conn, now))
+        conn.results["MAX(interval_end)"] = [(None,)]
+        self.assertEqual([], recoverable_stations(conn, now))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import datetime
+import unittest
+
+from data_pipeline.datapoint_writer import UPSERT_DATAPOINT_SQL, UPSERT_STATION_LATEST_SQL, summarize
+from data_pipeline.models import Datapoint
+from data_pipeline.parse_cache import FLOAT_FIELDS
+
+UTC = datetime.timezone.utc
+
+
+def datapoint(station: str, interval_start: datetime.datetime, minutes: int) -> Datapoint:
+    return Datapoint(station_arso_code=station, sunrise=interval_start, sunset=interval_start,
+                     interval_start=interval_start,
+                     interval_end=interval_start + datetime.timedelta(minutes=minutes),
+                     **{name: None for name in FLOAT_FIELDS})
+
+
+class TestDatapointWriter(unittest.TestCase):
+    def test_summarize(self):
+        t = datetime.datetime(2024, 3, 1, 12, tzinfo=UTC)
+        datapoints = [
+            datapoint("BILJE", t, 10),
+            datapoint("BILJE", t - datetime.timedelta(hours=1), 30),
+            datapoint("BILJE", t - datetime.timedelta(minutes=20), 30),
+            datapoint("GODNJE", t, 10),
+        ]
+        latest, ranges = summarize(datapoints)
+
+        # Same interval_end, the later interval_start (shorter interval) wins.
+        self.assertIs(datapoints[0], latest["BILJE"])
+        self.assertIs(datapoints[3], latest["GODNJE"])
+        self.assertEqual((t - datetime.timedelta(hours=1), t), ranges["BILJE"])
+        self.assertEqual((t, t), ranges["GODNJE"])
+
+    def test_station_latest_sql(self):
+        self.assertIn("%(visibility)s", UPSERT_STATION_LATEST_SQL)
+        self.assertNotIn("station_arso_code = excluded", UPSERT_STATION_LATEST_SQL)
+
+    def test_upsert_clears_qc_flags(self):
+        self.assertIn("qc_flags = CASE", UPSERT_DATAPOINT_SQL)
+        self.assertIn("excluded.visibility) THEN d.qc_flags", " ".join(UPSERT_DATAPOINT_SQL.split()))
+
+
+if __name__ == '__main__':
+    unittest.main()
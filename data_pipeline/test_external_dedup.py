@@ -0,0 +1,87 @@
+import datetime
+import io
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from data_pipeline import external_dedup
+from data_pipeline.export import write_csv
+from data_pipeline.models import Datapoint
+from data_pipeline.parse_cache import FLOAT_FIELDS
+
+UTC = datetime.timezone.utc
+CET = datetime.timezone(datetime.timedelta(hours=1))
+
+
+def datapoint(station: str, interval_start: datetime.datetime, minutes: int, value: float = None) -> Datapoint:
+    return Datapoint(station_arso_code=station, sunrise=interval_start, sunset=interval_start,
+                     interval_start=interval_start,
+                     interval_end=interval_start + datetime.timedelta(minutes=minutes),
+                     **{name: value for name in FLOAT_FIELDS})
+
+
+class TestExternalDedup(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_record_roundtrip(self):
+        stations = external_dedup.Stations()
+        d = datapoint("GODNJE", datetime.datetime(2024, 3, 1, 12, tzinfo=CET), 10)
+        d.temperature_air_avg = 3.5
+        values = external_dedup.encode_record(d, stations.index("GODNJE"), 7)
+        decoded = external_dedup.decode_record(values, stations)
+        self.assertEqual(d.model_dump(), decoded.model_dump())
+        self.assertEqual(CET, decoded.interval_start.tzinfo)
+
+    def test_newest_version_wins(self):
+        t = datetime.datetime(2024, 3, 1, tzinfo=UTC)
+        # Each scrape repeats the last two days, with the value of the scrape.
+        scrapes = []
+        for scrape in range(10):
+            scrapes.append([
+                datapoint(station, t + datetime.timedelta(hours=hour), 60, value=float(scrape))
+                for station in ("GODNJE", "BILJE", "ARSO")
+                for hour in range(scrape * 24, scrape * 24 + 48)
+            ])
+        # Order within a scrape doesn't matter, only the order of scrapes.
+        for scrape in scrapes:
+            random.Random(len(scrape)).shuffle(scrape)
+        datapoints = [d for scrape in scrapes for d in scrape]
+
+        expected = {}
+        for d in datapoints:
+            expected[(d.station_arso_code, d.interval_start, d.interval_end)] = d
+
+        # Small runs and fan-in, so that runs are merged in several passes.
+        with mock.patch.object(external_dedup, "MAX_FAN_IN", 3):
+            result = list(external_dedup.deduplicated(datapoints, self.tmp_dir.name, run_records=50))
+
+        self.assertEqual(sorted(expected), [(d.station_arso_code, d.interval_start, d.interval_end) for d in result])
+        for d in result:
+            self.assertEqual(expected[(d.station_arso_code, d.interval_start, d.interval_end)].model_dump(),
+                             d.model_dump())
+
+    def test_same_start_different_end(self):
+        t = datetime.datetime(2024, 3, 1, tzinfo=UTC)
+        datapoints = [datapoint("GODNJE", t, 10), datapoint("GODNJE", t, 60), datapoint("GODNJE", t, 10, value=1.0)]
+        result = list(external_dedup.deduplicated(datapoints, self.tmp_dir.name, run_records=2))
+        self.assertEqual([(10, 1.0), (60, None)],
+                         [((d.interval_end - t).seconds // 60, d.visibility) for d in result])
+
+    def test_write_csv(self):
+        t = datetime.datetime(2024, 3, 1, tzinfo=UTC)
+        fp = io.StringIO()
+        count = write_csv(fp, external_dedup.deduplicated(
+            [datapoint("GODNJE", t, 10), datapoint("BILJE", t, 10)], self.tmp_dir.name))
+        self.assertEqual(2, count)
+        lines = fp.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("station_arso_code,"))
+        self.assertTrue(lines[1].startswith("BILJE,"))
+
+
+if __name__ == '__main__':
+    unittest.main()
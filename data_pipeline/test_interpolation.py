@@ -0,0 +1,88 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from data_pipeline.interpolation import (
+    Grid,
+    LAPSE_RATE,
+    idw_weights,
+    interpolate,
+    interpolate_temperature,
+    load_or_build_weights,
+    nearest_neighbours,
+    write_cube,
+)
+
+GRID = Grid(lon_min=14.0, lat_min=46.0, lon_max=14.5, lat_max=46.2, step=0.1)
+STATION_LATS = np.array([46.0, 46.2, 46.1, np.nan])
+STATION_LONS = np.array([14.0, 14.5, 14.2, np.nan])
+
+
+class TestInterpolation(unittest.TestCase):
+    def test_grid(self):
+        self.assertEqual((3, 6), GRID.shape)
+        lats, lons = GRID.cell_coordinates()
+        self.assertAlmostEqual(46.0, lats[0])
+        self.assertAlmostEqual(14.5, lons[5])
+        self.assertAlmostEqual(46.1, lats[6])
+
+    def test_nearest_neighbours(self):
+        points = np.array([[0.0, 0.0], [10.0, 0.0], [0.0, 3.0]])
+        indexes, distances = nearest_neighbours(points, np.array([[1.0, 0.0], [9.0, 1.0]]), 2)
+        self.assertEqual([{0, 2}, {0, 1}], [set(map(int, row)) for row in indexes])
+        self.assertAlmostEqual(1.0, distances[0][list(indexes[0]).index(0)])
+        indexes, distances = nearest_neighbours(points, np.array([[1.0, 0.0]]), 1)
+        self.assertEqual(([[0]], [[1.0]]), (indexes.tolist(), distances.tolist()))
+
+    def test_idw(self):
+        weights = idw_weights(STATION_LATS, STATION_LONS, GRID, k=2)
+        self.assertEqual((18, 4), weights.shape)
+        self.assertTrue(np.all(np.diff(weights.indptr) == 2))
+        self.assertEqual(0, weights[:, 3].nnz)
+
+        values = np.array([
+            [1.0, 3.0, 2.0, 100.0],
+            [1.0, np.nan, 2.0, 100.0],
+            [np.nan, np.nan, np.nan, 100.0],
+        ])
+        grid_values = interpolate(values, weights)
+        self.assertEqual((3, 18), grid_values.shape)
+        # Cells at stations take the station's value.
+        self.assertAlmostEqual(1.0, grid_values[0, 0], places=3)
+        self.assertAlmostEqual(3.0, grid_values[0, 17], places=3)
+        self.assertTrue(np.all((grid_values[0] >= 1.0) & (grid_values[0] <= 3.0)))
+        # Missing stations are left out.
+        self.assertAlmostEqual(2.0, grid_values[1, 17], places=3)
+        self.assertTrue(np.all(np.isnan(grid_values[2])))
+
+    def test_lapse_rate(self):
+        weights = idw_weights(STATION_LATS, STATION_LONS, GRID, k=3)
+        altitudes = np.array([0.0, 1000.0, 500.0, np.nan])
+        # Same temperature at sea level everywhere.
+        values = np.array([[10.0, 10.0 - 1000 * LAPSE_RATE, 10.0 - 500 * LAPSE_RATE, np.nan]])
+        elevations = np.full(18, 2000.0)
+        grid_values = interpolate_temperature(values, weights, altitudes, elevations)
+        np.testing.assert_allclose(grid_values, 10.0 - 2000 * LAPSE_RATE, atol=1e-4)
+
+    def test_write_cube(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            weights = load_or_build_weights(tmp_dir, STATION_LATS, STATION_LONS, GRID)
+            self.assertEqual(1, len(os.listdir(tmp_dir)))
+            np.testing.assert_array_equal(
+                weights.toarray(), load_or_build_weights(tmp_dir, STATION_LATS, STATION_LONS, GRID).toarray())
+
+            values = np.random.default_rng(0).random((5, 4))
+            path = os.path.join(tmp_dir, "cube.npy")
+            cube = write_cube(path, values, GRID, lambda block: interpolate(block, weights), {"variable": "test"})
+            self.assertEqual((5, 3, 6), cube.shape)
+            self.assertIsInstance(cube, np.memmap)
+            np.testing.assert_allclose(cube[4].ravel(), interpolate(values[4:], weights)[0], rtol=1e-6)
+            with open(f"{path}.json") as fp:
+                self.assertEqual([5, 3, 6], json.load(fp)["shape"])
+
+
+if __name__ == '__main__':
+    unittest.main()
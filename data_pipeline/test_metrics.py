@@ -0,0 +1,47 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from data_pipeline.metrics import FileMetrics, RunMetrics, profiling, read_jsonl_timed, timed_iter
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_read_jsonl_timed(self):
+        path = os.path.join(self.tmp_dir.name, "meteo_data_archive_1.json.gz")
+        with gzip.open(path, mode="wt") as fp:
+            fp.write('{"xml": "<data/>"}\n{"xml": "<data/>"}\n')
+
+        metrics = FileMetrics(path)
+        self.assertEqual([{"xml": "<data/>"}] * 2, read_jsonl_timed(path, metrics))
+        self.assertEqual(2, metrics.rows)
+        self.assertEqual(38, metrics.bytes_uncompressed)
+        self.assertEqual({"gunzip", "json_decode"}, set(metrics.stage_seconds.keys()))
+
+    def test_timed_iter(self):
+        metrics = FileMetrics("")
+        self.assertEqual([1, 2, 3], list(timed_iter([1, 2, 3], metrics, "xml_parse")))
+        self.assertIn("xml_parse", metrics.stage_seconds)
+
+    def test_write_summary(self):
+        run = RunMetrics("test")
+        with profiling(run, "cprofile", self.tmp_dir.name):
+            metrics = FileMetrics("a.json.gz", datapoints=10)
+            with metrics.stage("conversion"):
+                pass
+            run.add(metrics)
+            run.add(FileMetrics("b.json.gz", error="Compressed file ended before the end-of-stream marker was reached"))
+
+        with open(run.write_summary(self.tmp_dir.name)) as fp:
+            summary = json.load(fp)
+        self.assertEqual(10, summary["datapoints"])
+        self.assertEqual(["b.json.gz"], summary["failed_files"])
+        self.assertEqual(2, len(summary["per_file"]))
+        self.assertTrue(any(filename.endswith(".prof") for filename in os.listdir(self.tmp_dir.name)))
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from data_pipeline.meteo_xml_util import xml_to_datapoints
+from data_pipeline.parse_cache import (
+    PARSER_VERSION,
+    ParseCache,
+    cached_xml_to_datapoints,
+    decode_datapoints,
+    encode_datapoints,
+)
+
+
+class TestParseCache(unittest.TestCase):
+    xml: str
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.xml = (Path(__file__).parent.parent / "data" / "example.xml").read_text()
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_encode_decode(self):
+        datapoints = [d.model_dump() for d in xml_to_datapoints(self.xml)]
+        self.assertEqual(datapoints, decode_datapoints(encode_datapoints(datapoints)))
+        self.assertEqual([], decode_datapoints(encode_datapoints([])))
+
+    def test_cached_xml_to_datapoints(self):
+        cache = ParseCache(self.tmp_dir.name)
+        expected = list(xml_to_datapoints(self.xml))
+        self.assertEqual(expected, cached_xml_to_datapoints(self.xml, cache))
+        self.assertEqual(expected, cached_xml_to_datapoints(self.xml, cache))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_key_depends_on_parser_version(self):
+        self.assertEqual(ParseCache.key(self.xml), ParseCache.key(self.xml, PARSER_VERSION))
+        self.assertNotEqual(ParseCache.key(self.xml), ParseCache.key(self.xml, "other_parser/1"))
+        self.assertNotEqual(ParseCache.key(self.xml), ParseCache.key(self.xml + " "))
+
+    def test_evict(self):
+        datapoints = [d.model_dump() for d in xml_to_datapoints(self.xml)][:1]
+        cache = ParseCache(self.tmp_dir.name, max_bytes=len(encode_datapoints(datapoints)) * 3 // 2)
+        cache.put("aa01", datapoints)
+        os.utime(cache._path("aa01"), ns=(0, 0))
+        cache.put("bb02", datapoints)
+        self.assertIsNone(cache.get("aa01"))
+        self.assertEqual(datapoints, cache.get("bb02"))
+
+    def test_evict_shared_by_processes(self):
+        datapoints = [d.model_dump() for d in xml_to_datapoints(self.xml)][:1]
+        entry_size = len(encode_datapoints(datapoints))
+        # As in two worker processes, each writing less than the limit.
+        first = ParseCache(self.tmp_dir.name, max_bytes=entry_size * 5 // 2)
+        second = ParseCache(self.tmp_dir.name, max_bytes=entry_size * 5 // 2)
+        first.put("aa01", datapoints)
+        os.utime(first._path("aa01"), ns=(0, 0))
+        second.put("bb02", datapoints)
+        first.put("cc03", datapoints)
+        self.assertIsNone(second.get("aa01"))
+        self.assertEqual(datapoints, second.get("bb02"))
+        self.assertEqual(datapoints, first.get("cc03"))
@@ -0,0 +1,36 @@
+import datetime
+import unittest
+
+from data_pipeline.datapoint_writer import UPSERT_DATAPOINT_SQL, group_by_partition, upsert_datapoint_sql
+from data_pipeline.partitions import add_months, month_of, partition_name
+from data_pipeline.test_datapoint_writer import datapoint
+
+
+class TestPartitions(unittest.TestCase):
+    def test_months(self):
+        cet = datetime.timezone(datetime.timedelta(hours=1))
+        # Partitions are by UTC month.
+        self.assertEqual(datetime.date(2024, 2, 1), month_of(datetime.datetime(2024, 3, 1, 0, 30, tzinfo=cet)))
+        self.assertEqual(datetime.date(2024, 3, 1), month_of(datetime.datetime(2024, 3, 31, 23, 50)))
+        self.assertEqual(datetime.date(2025, 1, 1), add_months(datetime.date(2024, 11, 1), 2))
+        self.assertEqual(datetime.date(2023, 12, 1), add_months(datetime.date(2024, 1, 1), -1))
+        self.assertEqual("weather_datapoints_2024_03", partition_name(datetime.date(2024, 3, 1)))
+
+    def test_group_by_partition(self):
+        utc = datetime.timezone.utc
+        datapoints = [
+            datapoint("BILJE", datetime.datetime(2024, 2, 29, 23, 50, tzinfo=utc), 10),
+            datapoint("BILJE", datetime.datetime(2024, 3, 1, 0, 0, tzinfo=utc), 10),
+            datapoint("GODNJE", datetime.datetime(2024, 3, 1, 0, 0, tzinfo=utc), 10),
+        ]
+        by_month = group_by_partition(datapoints)
+        self.assertEqual([1, 2], [len(by_month[datetime.date(2024, month, 1)]) for month in (2, 3)])
+
+    def test_upsert_sql(self):
+        query = upsert_datapoint_sql("weather_datapoints_2024_03")
+        self.assertTrue(query.strip().startswith('INSERT INTO "weather_datapoints_2024_03" AS d ('))
+        self.assertEqual(UPSERT_DATAPOINT_SQL.count("weather_datapoints"), query.count("weather_datapoints"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import datetime
+import time
+import unittest
+
+import numpy as np
+
+from data_pipeline.models import Datapoint
+from data_pipeline.quality import (
+    BASELINE_WINDOW,
+    QC_VARIABLES,
+    QcFlag,
+    decode_flags,
+    encode_flags,
+    rolling_mean_std,
+    screen,
+    screen_datapoints,
+)
+
+STEP = 600
+
+
+def column(name: str) -> int:
+    return QC_VARIABLES.index(name)
+
+
+class TestQuality(unittest.TestCase):
+    def setUp(self):
+        n = 1000
+        self.times = np.arange(n, dtype=np.float64) * STEP
+        daily = np.sin(self.times / 86400 * 2 * np.pi)
+        self.columns = {
+            "temperature_air_avg": 10 + 5 * daily,
+            "temperature_air_min": 9 + 5 * daily,
+            "temperature_air_max": 11 + 5 * daily,
+            "pressure_mean_sea_level_avg": 1013 + 0.5 * daily,
+            "precipitation_sum_10min": np.zeros(n),
+        }
+
+    def test_clean(self):
+        flags = screen(self.times, self.columns)
+        self.assertEqual((1000, len(QC_VARIABLES)), flags.shape)
+        self.assertFalse(flags.any())
+
+    def test_range_and_consistency(self):
+        self.columns["precipitation_sum_10min"][5] = -1
+        self.columns["temperature_air_min"][7] = 30
+        self.columns["temperature_air_avg"][9] = np.nan
+        flags = screen(self.times, self.columns)
+
+        self.assertEqual(QcFlag.RANGE, flags[5, column("precipitation_sum_10min")])
+        self.assertTrue(flags[7, column("temperature_air_min")] & QcFlag.INCONSISTENT)
+        self.assertTrue(flags[7, column("temperature_air_avg")] & QcFlag.INCONSISTENT)
+        self.assertTrue(flags[7, column("temperature_air_max")] & QcFlag.INCONSISTENT)
+        self.assertFalse(flags[9].any())
+
+    def test_spike(self):
+        self.columns["temperature_air_avg"][500] += 15
+        # A step to a new level is not a spike.
+        self.columns["pressure_mean_sea_level_avg"][600:] += 6
+        flags = screen(self.times, self.columns)
+        temperature_flags = flags[:, column("temperature_air_avg")]
+        self.assertEqual([500], list(np.flatnonzero(temperature_flags & QcFlag.SPIKE)))
+        self.assertFalse((flags[:, column("pressure_mean_sea_level_avg")] & QcFlag.SPIKE).any())
+
+    def test_spike_across_gap(self):
+        self.times[501:] += 7200
+        self.columns["temperature_air_avg"][500] += 15
+        flags = screen(self.times, self.columns)
+        self.assertFalse((flags[:, column("temperature_air_avg")] & QcFlag.SPIKE).any())
+
+    def test_stuck(self):
+        self.columns["temperature_air_avg"][100:200] = 12.3
+        flags = screen(self.times, self.columns)
+        stuck = np.flatnonzero(flags[:, column("temperature_air_avg")] & QcFlag.STUCK)
+        self.assertEqual(list(range(100, 200)), list(stuck))
+        self.assertFalse((flags[:, column("precipitation_sum_10min")] & QcFlag.STUCK).any())
+
+    def test_outlier(self):
+        self.columns["pressure_mean_sea_level_avg"][800] = 1030
+        flags = screen(self.times, self.columns)
+        outliers = np.flatnonzero(flags[:, column("pressure_mean_sea_level_avg")] & QcFlag.OUTLIER)
+        self.assertEqual([800], list(outliers))
+
+    def test_rolling_mean_std(self):
+        values = np.array([1.0, 2.0, np.nan, 4.0, 5.0])
+        mean, std, count = rolling_mean_std(values, 2)
+        self.assertEqual([0, 1, 2, 1, 1], list(count))
+        np.testing.assert_allclose([np.nan, 1.0, 1.5, 2.0, 4.0], mean)
+        np.testing.assert_allclose([0.5, 0.0], std[2:4])
+
+    def test_encoding(self):
+        flags = np.zeros(len(QC_VARIABLES), dtype=np.uint8)
+        self.assertIsNone(encode_flags(flags))
+        flags[column("visibility")] = QcFlag.RANGE | QcFlag.STUCK
+        self.assertEqual({"visibility": QcFlag.RANGE | QcFlag.STUCK}, decode_flags(encode_flags(flags)))
+
+    def test_screen_datapoints(self):
+        start = datetime.datetime(2024, 3, 1, tzinfo=datetime.timezone.utc)
+        datapoints = []
+        for i in range(10):
+            interval_end = start + datetime.timedelta(minutes=10 * i)
+            values = {name: None for name in QC_VARIABLES}
+            values["humidity_relative_avg"] = 120.0 if i == 3 else 80.0 + i
+            datapoints.append(Datapoint(station_arso_code="BILJE", sunrise=start, sunset=start,
+                                        interval_start=interval_end - datetime.timedelta(minutes=10),
+                                        interval_end=interval_end, **values))
+        flagged = screen_datapoints(reversed(datapoints))
+        self.assertEqual([("BILJE", datapoints[3].interval_start, datapoints[3].interval_end)], list(flagged))
+
+    def test_years_of_data_in_seconds(self):
+        n = 6 * 24 * 365 * 5
+        rng = np.random.default_rng(0)
+        times = np.arange(n, dtype=np.float64) * STEP
+        columns = {name: rng.normal(10, 1, n) for name in QC_VARIABLES}
+        start = time.perf_counter()
+        screen(times, columns)
+        self.assertLess(time.perf_counter() - start, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
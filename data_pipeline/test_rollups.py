@@ -0,0 +1,81 @@
+import datetime
+import unittest
+
+import numpy as np
+
+from data_pipeline.rollups import bucket_starts, choose_level, rollup
+
+UTC = datetime.timezone.utc
+START = datetime.datetime(2024, 1, 30, tzinfo=UTC).timestamp()
+
+
+def raw_rollup(times: np.ndarray, values: np.ndarray, level: str) -> dict:
+    present = (~np.isnan(values)).astype(np.int64)
+    return rollup(bucket_starts(times, level), times + 600, values, present, np.nan_to_num(values), values, values)
+
+
+def level_rollup(lower: dict, level: str) -> dict:
+    return rollup(bucket_starts(lower["bucket"], level), lower["lttb_time"], lower["lttb_value"],
+                  lower["count"], lower["sum"], lower["min"], lower["max"])
+
+
+class TestRollups(unittest.TestCase):
+    def test_bucket_starts(self):
+        times = np.array([START + 3599, START + 86400 * 2 + 60])
+        self.assertEqual([START, START + 86400 * 2], bucket_starts(times, "1h").tolist())
+        self.assertEqual([START, START + 86400 * 2], bucket_starts(times, "1d").tolist())
+        february = datetime.datetime(2024, 2, 1, tzinfo=UTC).timestamp()
+        january = datetime.datetime(2024, 1, 1, tzinfo=UTC).timestamp()
+        self.assertEqual([january, february], bucket_starts(times, "1mon").tolist())
+
+    def test_aggregates(self):
+        times = START + 600 * np.arange(12)
+        values = np.arange(12, dtype=np.float64)
+        values[3] = np.nan
+        result = raw_rollup(times, values, "1h")
+
+        self.assertEqual([START, START + 3600], result["bucket"].tolist())
+        self.assertEqual([5, 6], result["count"].tolist())
+        self.assertEqual([0 + 1 + 2 + 4 + 5, 6 + 7 + 8 + 9 + 10 + 11], result["sum"].tolist())
+        self.assertEqual([0, 6], result["min"].tolist())
+        self.assertEqual([5, 11], result["max"].tolist())
+
+    def test_lttb_keeps_spike(self):
+        times = START + 600 * np.arange(18)
+        values = np.zeros(18)
+        values[9] = 10.0
+        result = raw_rollup(times, values, "1h")
+        self.assertEqual(10.0, result["lttb_value"][1])
+        self.assertEqual(times[9] + 600, result["lttb_time"][1])
+
+    def test_empty(self):
+        result = raw_rollup(START + 600 * np.arange(3), np.full(3, np.nan), "1h")
+        self.assertEqual(0, len(result["bucket"]))
+
+    def test_pyramid_matches_datapoints(self):
+        rng = np.random.default_rng(0)
+        times = START + 600 * np.arange(6 * 24 * 40)
+        values = rng.normal(5, 3, len(times))
+        values[rng.random(len(times)) < 0.1] = np.nan
+
+        hourly = raw_rollup(times, values, "1h")
+        daily = level_rollup(hourly, "1d")
+        monthly = level_rollup(daily, "1mon")
+        direct = raw_rollup(times, values, "1mon")
+
+        for name in ("bucket", "count", "min", "max"):
+            np.testing.assert_array_equal(direct[name], monthly[name])
+        np.testing.assert_allclose(direct["sum"], monthly["sum"])
+        # Picked points are actual datapoints.
+        self.assertTrue(set(monthly["lttb_time"].tolist()) <= set((times + 600).tolist()))
+
+    def test_choose_level(self):
+        start = datetime.datetime(2020, 1, 1, tzinfo=UTC)
+        self.assertEqual("1mon", choose_level(start, start + datetime.timedelta(days=3650), 100))
+        self.assertEqual("1d", choose_level(start, start + datetime.timedelta(days=365), 300))
+        self.assertEqual("1h", choose_level(start, start + datetime.timedelta(days=30), 700))
+        self.assertIsNone(choose_level(start, start + datetime.timedelta(days=1), 800))
+
+
+if __name__ == '__main__':
+    unittest.main()
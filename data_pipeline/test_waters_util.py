@@ -0,0 +1,114 @@
+import unittest
+from datetime import datetime, timezone
+
+from data_pipeline.models import WatersDatapoint
+from data_pipeline.waters_util import row_to_waters_datapoint, parse_waters_timestamp
+
+
+class TestWatersUtil(unittest.TestCase):
+    def test_river_datapoint(self):
+        self.assertEqual(
+            WatersDatapoint(
+                location="Postaja Šentjakob - Sava",
+                timestamp=datetime(2023, 8, 13, 12, 30, tzinfo=timezone.utc),
+                water_level=327,
+                flow_rate=89.3,
+                temperature=14.9,
+            ),
+            row_to_waters_datapoint({
+                "location": "Postaja Šentjakob - Sava",
+                "timestamp": "2023-08-13 14:30:00",
+                "water_level": 327,
+                "flow_rate": 89.3,
+                "temperature": 14.9,
+            }),
+        )
+
+    def test_buoy_datapoint(self):
+        self.assertEqual(
+            WatersDatapoint(
+                location="Location",
+                timestamp=datetime(2023, 8, 14, 5, 0, tzinfo=timezone.utc),
+                temperature=25.3,
+                waves_height=0.13,
+                waves_period=2,
+                waves_direction=214,
+                sea_current_rate=28,
+                sea_current_direction=359,
+                max_waves_height=0.21,
+            ),
+            row_to_waters_datapoint({
+                "location": "Location",
+                "timestamp": "2023-08-14 07:00:00",
+                "temperature": 25.3,
+                "waves_height": 0.13,
+                "waves_period": 2,
+                "waves_direction": 214,
+                "flow_rate": 28,
+                "flow_direction": 359,
+                "max_waves_height": 0.21,
+            }),
+        )
+
+    def test_buoy_datapoint_v2(self):
+        self.assertEqual(
+            WatersDatapoint(
+                location="Location",
+                timestamp=datetime(2023, 8, 25, 8, 0, tzinfo=timezone.utc),
+                temperature=27.3,
+                sea_current_direction_depth_2m=14,
+                sea_current_rate_depth_2m=9,
+                sea_current_direction_depth_10m=350,
+                sea_current_rate_depth_10m=9,
+                waves_height=0.08,
+                max_waves_height=0.0,
+                waves_direction=332,
+                waves_period=3,
+            ),
+            row_to_waters_datapoint({
+                "location": "Location",
+                "timestamp": "2023-08-25 10:00:00",
+                "temperature": 27.3,
+                "flow_direction_depth_2m": 14,
+                "flow_rate_depth_2m": 9,
+                "flow_direction_depth_10m": 350,
+                "flow_rate_depth_10m": 9,
+                "waves_height": 0.08,
+                "max_waves_height": 0.0,
+                "waves_direction": 332,
+                "waves_period": 3,
+            }),
+        )
+
+    def test_buoy_datapoint_v3(self):
+        self.assertEqual(
+            WatersDatapoint(
+                location="Location",
+                timestamp=datetime(2023, 8, 25, 8, 0, tzinfo=timezone.utc),
+                water_level=120,
+                temperature=None,
+            ),
+            row_to_waters_datapoint({
+                "location": "Location",
+                "timestamp": "2023-08-25 10:00:00",
+                "water_level": 120,
+                "temperature": None,
+            }),
+        )
+
+    def test_parse_waters_timestamp(self):
+        self.assertEqual(
+            datetime(2023, 10, 29, 0, 30, tzinfo=timezone.utc),
+            parse_waters_timestamp("2023-10-29 02:30:00+02:00"),
+        )
+        self.assertEqual(
+            datetime(2023, 10, 29, 1, 30, tzinfo=timezone.utc),
+            parse_waters_timestamp("2023-10-29 02:30:00+01:00"),
+        )
+        self.assertEqual(
+            datetime(2023, 12, 1, 9, 0, tzinfo=timezone.utc),
+            parse_waters_timestamp("2023-12-01 10:00:00"),
+        )
+
+    def test_html_datapoint(self):
+        self.assertIsNone(row_to_waters_datapoint({"html": "<html></html>"}))
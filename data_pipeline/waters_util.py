@@ -0,0 +1,77 @@
+"""Mapping of scraped waters items (see scraper/items.py) into WatersDatapoint."""
+
+import datetime
+from typing import Any, Optional
+from zoneinfo import ZoneInfo
+
+from data_pipeline.models import WatersDatapoint
+
+WATERS_COLUMNS = list(WatersDatapoint.model_fields.keys())
+
+LJUBLJANA = ZoneInfo("Europe/Ljubljana")
+
+
+def parse_waters_timestamp(s: str) -> datetime.datetime:
+    """Parse timestamp from the feed into UTC.
+
+    Feeds store it with UTC offset, for example "2023-10-29 02:30:00+01:00". Older feeds
+    store local time without offset ("2023-08-14 07:10:00"), which is ambiguous for
+    one hour a year."""
+    timestamp = datetime.datetime.fromisoformat(s)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=LJUBLJANA)
+    return timestamp.astimezone(datetime.timezone.utc)
+
+
+def row_to_waters_datapoint(row: dict[str, Any]) -> Optional[WatersDatapoint]:
+    """Maps a row of waters_*.json.gz into a WatersDatapoint.
+
+    The item class is not stored in the feed, so it is recognized by its fields.
+    Returns None for rows which don't hold a datapoint (HtmlDatapoint)."""
+
+    if "location" not in row or "timestamp" not in row:
+        return None
+
+    common = dict(location=row["location"], timestamp=parse_waters_timestamp(row["timestamp"]))
+
+    if "flow_direction_depth_2m" in row:
+        # BuoyDatapointV2
+        return WatersDatapoint(
+            **common,
+            temperature=row["temperature"],
+            sea_current_direction_depth_2m=row["flow_direction_depth_2m"],
+            sea_current_rate_depth_2m=row["flow_rate_depth_2m"],
+            sea_current_direction_depth_10m=row["flow_direction_depth_10m"],
+            sea_current_rate_depth_10m=row["flow_rate_depth_10m"],
+            waves_height=row["waves_height"],
+            max_waves_height=row["max_waves_height"],
+            waves_direction=row["waves_direction"],
+            waves_period=row["waves_period"],
+        )
+    elif "waves_height" in row:
+        # BuoyDatapoint
+        return WatersDatapoint(
+            **common,
+            temperature=row["temperature"],
+            waves_height=row["waves_height"],
+            waves_period=row["waves_period"],
+            waves_direction=row["waves_direction"],
+            sea_current_rate=row["flow_rate"],
+            sea_current_direction=row["flow_direction"],
+            max_waves_height=row["max_waves_height"],
+        )
+    elif "flow_rate" in row:
+        # RiverDatapoint
+        return WatersDatapoint(
+            **common,
+            water_level=row["water_level"],
+            flow_rate=row["flow_rate"],
+            temperature=row["temperature"],
+        )
+    else:
+        # BuoyDatapointV3
+        return WatersDatapoint(
+            **common,
+            water_level=row["water_level"],
+            temperature=row["temperature"],
+        )
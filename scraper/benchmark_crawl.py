@@ -0,0 +1,202 @@
+"""Offline benchmark of the spiders, crawling the replay server (see replay_server.py).
+
+Spiders run one after another with the project settings, except that DOWNLOAD_DELAY is 0,
+requests go to the replay server and feeds are written to a temporary directory. For each
+spider it reports items/sec and the CPU time of the crawling thread spent in parsing
+callbacks and in feed export, split into serialization and gzip compression.
+
+Usage: slo-weather bench crawl [--stations N] [--gauges N]
+       python -m scraper.benchmark_crawl [stations] [gauges]
+"""
+
+import collections
+import functools
+import inspect
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from scrapy import signals
+from scrapy.extensions.postprocessing import GzipPlugin
+from scrapy.settings import Settings
+
+from .exporters import TimezoneAwareJsonLinesItemExporter
+from .replay_server import ReplayServer
+
+SPIDERS = ["weather_stations", "waters_1day", "waters_30day"]
+
+# CPU seconds of the crawling thread per activity, of the spider being crawled.
+cpu_seconds = collections.Counter()
+
+
+def _timed(key: str, callback):
+    """Counts CPU time of the callback, including iterating its results if it's a generator."""
+
+    def timed_iter(results):
+        while True:
+            start = time.thread_time()
+            try:
+                result = next(results)
+            except StopIteration:
+                return
+            finally:
+                cpu_seconds[key] += time.thread_time() - start
+            yield result
+
+    @functools.wraps(callback)
+    def timed(*args, **kwargs):
+        start = time.thread_time()
+        results = callback(*args, **kwargs)
+        cpu_seconds[key] += time.thread_time() - start
+        return timed_iter(results) if inspect.isgenerator(results) else results
+
+    return timed
+
+
+class ReplayMiddleware:
+    """Downloader middleware sending requests to the replay server.
+
+    Responses get the original URL back, so links are resolved and filtered by
+    allowed_domains as when crawling ARSO."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("REPLAY_BASE_URL"))
+
+    def process_request(self, request, spider):
+        if "replay_url" in request.meta:
+            return None
+        parts = urllib.parse.urlsplit(request.url)
+        path = urllib.parse.urlunsplit(("", "", parts.path, parts.query, ""))
+        # The original request already passed the duplicate and offsite filters.
+        return request.replace(url=self.base_url + path, meta={**request.meta, "replay_url": request.url},
+                               dont_filter=True)
+
+    def process_response(self, request, response, spider):
+        if "replay_url" in request.meta:
+            return response.replace(url=request.meta["replay_url"])
+        return response
+
+
+class CallbackTimer:
+    """Extension timing the spider's parse* callbacks."""
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        extension = cls()
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        return extension
+
+    def spider_opened(self, spider):
+        # Requests look up their callbacks later, when start_requests is iterated.
+        for name in dir(type(spider)):
+            if name.startswith("parse") and callable(getattr(spider, name)):
+                setattr(spider, name, _timed("parse", getattr(spider, name)))
+
+
+class TimedJsonLinesItemExporter(TimezoneAwareJsonLinesItemExporter):
+    def export_item(self, item):
+        start = time.thread_time()
+        try:
+            return super().export_item(item)
+        finally:
+            cpu_seconds["export"] += time.thread_time() - start
+
+
+class TimedGzipPlugin(GzipPlugin):
+    def write(self, data):
+        start = time.thread_time()
+        try:
+            return super().write(data)
+        finally:
+            cpu_seconds["gzip_write"] += time.thread_time() - start
+
+    def close(self):
+        start = time.thread_time()
+        try:
+            return super().close()
+        finally:
+            cpu_seconds["gzip_close"] += time.thread_time() - start
+
+
+def benchmark_settings(base_url: str, output_dir: str) -> Settings:
+    settings = Settings()
+    settings.setmodule("scraper.settings", priority="project")
+
+    feeds = {}
+    for uri, options in settings.getdict("FEEDS").items():
+        postprocessing = [
+            TimedGzipPlugin if plugin in (GzipPlugin, "scrapy.extensions.postprocessing.GzipPlugin") else plugin
+            for plugin in options.get("postprocessing", [])
+        ]
+        feeds[os.path.join(output_dir, os.path.basename(uri))] = {**options, "postprocessing": postprocessing}
+
+    settings.setdict({
+        "DOWNLOAD_DELAY": 0,
+        "AUTOTHROTTLE_ENABLED": False,
+        "LOG_LEVEL": "WARNING",
+        "FEEDS": feeds,
+        "FEED_EXPORTERS": {"jsonlines": TimedJsonLinesItemExporter},
+        "HTML_BLOBS_DIR": os.path.join(output_dir, "waters_html"),
+        "REPLAY_BASE_URL": base_url,
+        "DOWNLOADER_MIDDLEWARES": {ReplayMiddleware: 1},
+        "EXTENSIONS": {CallbackTimer: 0},
+    }, priority="cmdline")
+    return settings
+
+
+def crawl(settings: Settings, spiders: list[str]) -> dict[str, dict]:
+    """Crawls the spiders one after another. Returns stats of each with the CPU seconds of its activities."""
+    from scrapy.crawler import CrawlerProcess
+    from twisted.internet import defer
+
+    process = CrawlerProcess(settings)
+    results = {}
+
+    @defer.inlineCallbacks
+    def crawl_all():
+        try:
+            for name in spiders:
+                cpu_seconds.clear()
+                crawler = process.create_crawler(name)
+                start = time.thread_time()
+                yield process.crawl(crawler)
+                cpu_seconds["total"] = time.thread_time() - start
+                results[name] = {**crawler.stats.get_stats(), "cpu_seconds": dict(cpu_seconds)}
+        finally:
+            # The reactor is installed by the first crawl.
+            from twisted.internet import reactor
+
+            reactor.stop()
+
+    crawl_all()
+    process.start(stop_after_crawl=False)
+    return results
+
+
+def main(stations: int = 200, gauges: int = 100, spiders: list[str] = SPIDERS):
+    with ReplayServer(stations, gauges) as server, tempfile.TemporaryDirectory() as output_dir:
+        results = crawl(benchmark_settings(server.base_url, output_dir), spiders)
+
+    for name, stats in results.items():
+        items = stats.get("item_scraped_count", 0)
+        elapsed = stats.get("elapsed_time_seconds", 0)
+        cpu = stats["cpu_seconds"]
+        gzip_seconds = cpu.get("gzip_write", 0) + cpu.get("gzip_close", 0)
+        # Compressing written lines is part of exporting them.
+        serialize_seconds = cpu.get("export", 0) - cpu.get("gzip_write", 0)
+        print(
+            f"{name}: {stats.get('response_received_count', 0)} responses, {items} items in {elapsed:.2f} s, "
+            f"{items / elapsed if elapsed else 0:.1f} items/s\n"
+            f"  CPU: total {cpu.get('total', 0):.3f} s, parsing callbacks {cpu.get('parse', 0):.3f} s, "
+            f"feed serialization {serialize_seconds:.3f} s, gzip {gzip_seconds:.3f} s"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
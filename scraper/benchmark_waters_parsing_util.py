@@ -0,0 +1,53 @@
+"""Compares table parsing speed on the example pages in scraper/examples.
+
+Usage: python -m scraper.benchmark_waters_parsing_util [repeat]
+"""
+
+import dataclasses
+import sys
+import timeit
+from pathlib import Path
+
+from scrapy import Selector
+
+from .waters_parsing_util import parse_page_with_table, parse_page_with_table_per_row
+
+
+def main(repeat: int = 200):
+    examples_dir = Path(__file__).parent / "examples"
+
+    for path in sorted(examples_dir.glob("*.html")):
+        html = path.read_text()
+        table = Selector(text=html).css("table.podatki")
+
+        # The per row parser leaves timestamps naive.
+        columnar_datapoints = [
+            dataclasses.replace(d, timestamp=d.timestamp.replace(tzinfo=None))
+            for d in parse_page_with_table(table, "Location", html)
+        ]
+        if columnar_datapoints != parse_page_with_table_per_row(table, "Location", html):
+            raise AssertionError(f"Parsers disagree on {path.name}")
+
+        per_row = min(
+            timeit.repeat(
+                lambda: parse_page_with_table_per_row(table, "Location", html),
+                number=repeat,
+                repeat=3,
+            )
+        )
+        columnar = min(
+            timeit.repeat(
+                lambda: parse_page_with_table(table, "Location", html),
+                number=repeat,
+                repeat=3,
+            )
+        )
+        print(
+            f"{path.name}: per row {per_row / repeat * 1000:.3f} ms, "
+            f"columnar {columnar / repeat * 1000:.3f} ms, "
+            f"speedup {per_row / columnar:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
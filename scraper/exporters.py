@@ -0,0 +1,19 @@
+import datetime
+
+from scrapy.exporters import JsonLinesItemExporter
+from scrapy.utils.serialize import ScrapyJSONEncoder
+
+
+class TimezoneAwareJSONEncoder(ScrapyJSONEncoder):
+    """ScrapyJSONEncoder drops the UTC offset of datetimes, keep it for timezone aware ones."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime) and o.tzinfo is not None:
+            return o.isoformat(sep=" ")
+        return super().default(o)
+
+
+class TimezoneAwareJsonLinesItemExporter(JsonLinesItemExporter):
+    def __init__(self, file, **kwargs):
+        super().__init__(file, **kwargs)
+        self.encoder = TimezoneAwareJSONEncoder(**self._kwargs)
@@ -0,0 +1,47 @@
+"""Content-addressed storage of raw pages which we weren't able to parse.
+
+Each unique page is stored once as <sha256>.html.gz, feeds only reference it by hash."""
+
+import gzip
+import hashlib
+import os
+from typing import Iterable
+
+
+def html_sha256(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def blob_path(blobs_dir: str, sha256: str) -> str:
+    return os.path.join(blobs_dir, sha256[:2], f"{sha256}.html.gz")
+
+
+def store_html_blob(blobs_dir: str, html: str) -> str:
+    """Stores the page unless it is already stored. Returns its hash."""
+    sha256 = html_sha256(html)
+    path = blob_path(blobs_dir, sha256)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, mode="wt", encoding="utf-8") as fp:
+            fp.write(html)
+        os.replace(tmp_path, path)
+    return sha256
+
+
+def load_html_blob(blobs_dir: str, sha256: str) -> str:
+    with gzip.open(blob_path(blobs_dir, sha256), mode="rt", encoding="utf-8") as fp:
+        return fp.read()
+
+
+def list_html_blobs(blobs_dir: str) -> Iterable[str]:
+    """Hashes of all stored pages."""
+    if not os.path.isdir(blobs_dir):
+        return []
+    return sorted(
+        filename[: -len(".html.gz")]
+        for prefix in os.listdir(blobs_dir)
+        if os.path.isdir(os.path.join(blobs_dir, prefix))
+        for filename in os.listdir(os.path.join(blobs_dir, prefix))
+        if filename.endswith(".html.gz")
+    )
@@ -102,3 +102,10 @@ class HtmlDatapoint:
     """When we weren't able to parse table into other data structures"""
 
     html: str
+
+
+@dataclass
+class HtmlBlobDatapoint:
+    """HtmlDatapoint whose page is stored once in HTML_BLOBS_DIR, see scraper.html_blobs"""
+
+    html_sha256: str
@@ -0,0 +1,23 @@
+# Define your item pipelines here
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+
+from .html_blobs import store_html_blob
+from .items import HtmlDatapoint, HtmlBlobDatapoint
+
+
+class HtmlBlobPipeline:
+    """Replaces HtmlDatapoint items with a reference to the page stored in HTML_BLOBS_DIR."""
+
+    def __init__(self, blobs_dir: str):
+        self.blobs_dir = blobs_dir
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("HTML_BLOBS_DIR"))
+
+    def process_item(self, item, spider):
+        if isinstance(item, HtmlDatapoint):
+            return HtmlBlobDatapoint(html_sha256=store_html_blob(self.blobs_dir, item.html))
+        return item
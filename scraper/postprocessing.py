@@ -0,0 +1,29 @@
+"""Feed postprocessing plugins, see https://docs.scrapy.org/en/latest/topics/feed-exports.html#post-processing"""
+
+from typing import Any, BinaryIO
+
+from data_pipeline.archive_codec import DEFAULT_LEVEL, FrameWriter, latest_dictionary
+
+
+class ZstdPlugin:
+    """Compresses received data with zstd, one frame per line, as data_pipeline.archive_codec reads it.
+
+    Accepted feed_options parameters:
+
+    - zstd_dictionary_dir: directory of trained dictionaries, the latest one is used
+      (default ./data/zstd_dictionaries, without dictionaries frames are compressed without one)
+    - zstd_level: compression level
+    """
+
+    def __init__(self, file: BinaryIO, feed_options: dict[str, Any]):
+        self.file = file
+        self.feed_options = feed_options
+        dictionary = latest_dictionary(feed_options.get("zstd_dictionary_dir", "./data/zstd_dictionaries"))
+        self.writer = FrameWriter(file, dictionary, feed_options.get("zstd_level", DEFAULT_LEVEL))
+
+    def write(self, data: bytes) -> int:
+        return self.writer.write(data)
+
+    def close(self):
+        # Like GzipPlugin, the feed storage closes the file.
+        self.writer.close()
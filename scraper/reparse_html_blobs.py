@@ -0,0 +1,89 @@
+"""Parses stored pages (see scraper.html_blobs) with the current table layouts.
+
+Run after adding a layout to waters_parsing_util, the typed datapoints are written
+to a waters_reparsed_*.json.gz feed next to the scraped ones.
+
+Pages which were parsed are recorded in reparsed.json in the blobs directory, with the
+waters_parsing_util.PARSER_VERSION they were parsed with. Later runs only emit datapoints
+of pages which weren't parsed yet or were parsed with an older version, and write no feed
+if there are none.
+
+Usage: python -m scraper.reparse_html_blobs [blobs_dir] [output_dir]
+"""
+
+import datetime
+import gzip
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+from scrapy import Selector
+
+from .exporters import TimezoneAwareJSONEncoder
+from .html_blobs import list_html_blobs, load_html_blob
+from .items import HtmlDatapoint
+from .waters_parsing_util import PARSER_VERSION, parse_page_with_table
+
+REPARSED_FILENAME = "reparsed.json"
+
+
+def parse_html_blob(blobs_dir: str, sha256: str) -> list:
+    """Parses a stored page the same way as WatersSpreadsheetBaseSpider.parse_spreadsheet.
+
+    Returns an empty list if the page still can't be parsed."""
+    html = load_html_blob(blobs_dir, sha256)
+    selector = Selector(text=html)
+    location = selector.css(".vsebina > h1::text").get()
+    table = selector.css("table.podatki")
+    datapoints = parse_page_with_table(table, location, html)
+    return [datapoint for datapoint in datapoints if not isinstance(datapoint, HtmlDatapoint)]
+
+
+def load_reparsed(blobs_dir: str) -> dict[str, int]:
+    """Parser versions of pages which were parsed, by hash."""
+    try:
+        with open(os.path.join(blobs_dir, REPARSED_FILENAME)) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+
+
+def save_reparsed(blobs_dir: str, reparsed: dict[str, int]):
+    path = os.path.join(blobs_dir, REPARSED_FILENAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, mode="w") as fp:
+        json.dump(reparsed, fp, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def main(blobs_dir: str = "./data/waters_html", output_dir: str = "./data"):
+    reparsed = load_reparsed(blobs_dir)
+    # Pages which still can't be parsed aren't recorded, they are tried again after a layout is added.
+    hashes = [sha256 for sha256 in list_html_blobs(blobs_dir) if reparsed.get(sha256) != PARSER_VERSION]
+    print(f"Parsing {len(hashes)} stored pages not parsed with parser version {PARSER_VERSION}")
+
+    with Pool() as p:
+        results = p.starmap(parse_html_blob, [(blobs_dir, sha256) for sha256 in hashes])
+    parsed = [(sha256, datapoints) for sha256, datapoints in zip(hashes, results) if datapoints]
+    datapoint_counter = sum(len(datapoints) for _, datapoints in parsed)
+    print(f"Parsed {len(parsed)} of {len(hashes)} pages into {datapoint_counter} datapoints")
+    if not parsed:
+        return
+
+    batch_time = datetime.datetime.now(tz=datetime.timezone.utc).isoformat().replace(":", "-")
+    output_path = os.path.join(output_dir, f"waters_reparsed_{batch_time}.json.gz")
+    with gzip.open(output_path, mode="wt", encoding="utf-8") as fp:
+        for _, datapoints in parsed:
+            for datapoint in datapoints:
+                fp.write(json.dumps(datapoint, cls=TimezoneAwareJSONEncoder) + "\n")
+    print("Written", output_path)
+
+    # Recorded once the feed is written, pages of an interrupted run are parsed again.
+    for sha256, _ in parsed:
+        reparsed[sha256] = PARSER_VERSION
+    save_reparsed(blobs_dir, reparsed)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
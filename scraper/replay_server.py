@@ -0,0 +1,126 @@
+"""Local stand-in for the ARSO sites the spiders crawl, replaying recorded responses.
+
+Responses are built from data/example.xml (history XML of one station) and the pages in
+scraper/examples, multiplied into any number of synthetic stations and water gauges:
+
+ - observationAms_si_latest.xml lists stations SYN0000_, SYN0001_, ..., each with a history
+   XML which is example.xml renamed to the station,
+ - Ht_1.html and Ht_30.html link to gauge pages, which cycle through scraper/examples.
+
+Requests are matched on the path only, see ReplayMiddleware in benchmark_crawl.py for
+pointing spiders at the server. The server runs in its own process, so serving doesn't
+take CPU time or the GIL from the crawl being measured.
+
+Usage: python -m scraper.replay_server [stations] [gauges]
+"""
+
+import multiprocessing
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+EXAMPLE_XML = ROOT_DIR / "data" / "example.xml"
+EXAMPLES_DIR = Path(__file__).parent / "examples"
+
+METEO_DIR = "/uploads/probase/www/observ/surface/text/sl"
+WATERS_DIR = "/vode/podatki/amp"
+EXAMPLE_STATION = "GODNJE"
+
+
+def station_code(i: int) -> str:
+    return f"SYN{i:04d}"
+
+
+def build_routes(stations: int, gauges: int) -> dict[str, tuple[str, bytes]]:
+    """Content type and body of each path."""
+    history = EXAMPLE_XML.read_text(encoding="utf-8")
+    first_station = history[history.index("<metData>"):history.index("</metData>") + len("</metData>")]
+    header = history[:history.index("<metData>")]
+
+    xml = "application/xml; charset=utf-8"
+    routes = {}
+    latest = [header]
+    for i in range(stations):
+        code = station_code(i)
+        latest.append(first_station.replace(EXAMPLE_STATION, code))
+        routes[f"{METEO_DIR}/recent/observationAms_{code}_history.xml"] = (
+            xml, history.replace(EXAMPLE_STATION, code).encode("utf-8"))
+    latest.append("</data>\n")
+    routes[f"{METEO_DIR}/observationAms_si_latest.xml"] = (xml, "\n".join(latest).encode("utf-8"))
+
+    html = "text/html; charset=utf-8"
+    pages = [path.read_bytes() for path in sorted(EXAMPLES_DIR.glob("*.html"))]
+    areas = []
+    for i in range(gauges):
+        name = f"replay_{i:04d}.html"
+        routes[f"{WATERS_DIR}/{name}"] = (html, pages[i % len(pages)])
+        areas.append(f'<area shape="rect" coords="0,0,1,1" href="{name}">')
+    index = f'<html><body><map name="Zemljevid">{"".join(areas)}</map></body></html>'.encode("utf-8")
+    routes[f"{WATERS_DIR}/Ht_1.html"] = (html, index)
+    routes[f"{WATERS_DIR}/Ht_30.html"] = (html, index)
+    return routes
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real servers.
+    protocol_version = "HTTP/1.1"
+    routes = {}
+
+    def do_GET(self):
+        route = self.routes.get(self.path.split("?", 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        content_type, body = route
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(routes: dict[str, tuple[str, bytes]], port_queue=None, port: int = 0):
+    handler = type("Handler", (ReplayRequestHandler,), {"routes": routes})
+    with ThreadingHTTPServer(("127.0.0.1", port), handler) as server:
+        if port_queue is not None:
+            port_queue.put(server.server_address[1])
+        server.serve_forever()
+
+
+def _serve_synthetic(stations: int, gauges: int, port_queue):
+    serve(build_routes(stations, gauges), port_queue)
+
+
+class ReplayServer:
+    """Replay server in a child process, for use as a context manager. base_url is set once it listens."""
+
+    def __init__(self, stations: int, gauges: int):
+        self.stations = stations
+        self.gauges = gauges
+        self.base_url = None
+        self._process = None
+
+    def __enter__(self):
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=_serve_synthetic, args=(self.stations, self.gauges, port_queue), daemon=True)
+        self._process.start()
+        self.base_url = f"http://127.0.0.1:{port_queue.get(timeout=60)}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self._process.terminate()
+        self._process.join()
+
+
+def main(stations: int = 200, gauges: int = 100, port: int = 8765):
+    print(f"Replaying {stations} stations and {gauges} gauges on http://127.0.0.1:{port}")
+    serve(build_routes(stations, gauges), port=port)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
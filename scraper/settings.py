@@ -6,8 +6,10 @@
 #     https://docs.scrapy.org/en/latest/topics/settings.html
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
+import os
+
 from scraper.items import WeatherStation, WeatherStationArchiveXml, BuoyDatapoint, BuoyDatapointV2, BuoyDatapointV3, \
-    RiverDatapoint, HtmlDatapoint
+    RiverDatapoint, HtmlDatapoint, HtmlBlobDatapoint
 
 BOT_NAME = "scraper"
 
@@ -63,9 +65,9 @@ TELNETCONSOLE_ENABLED = False
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-# ITEM_PIPELINES = {
-#    "scraper.pipelines.ScraperPipeline": 300,
-# }
+ITEM_PIPELINES = {
+    "scraper.pipelines.HtmlBlobPipeline": 300,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -93,7 +95,12 @@ REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
 FEED_URI_PARAMS = "scraper.util.uri_params"
+FEED_EXPORTERS = {
+    "jsonlines": "scraper.exporters.TimezoneAwareJsonLinesItemExporter",
+}
 LOG_LEVEL = 'INFO'
+# Pages with tables we weren't able to parse, see scraper.html_blobs
+HTML_BLOBS_DIR = "./data/waters_html"
 FEEDS = {
     "./data/weather_stations_%(batch_time)s.json.gz": {
         "format": "jsonlines",
@@ -105,7 +112,23 @@ FEEDS = {
         "item_classes": [WeatherStation],
         "postprocessing": ['scrapy.extensions.postprocessing.GzipPlugin']
     },
-    "./data/weather_data_%(batch_time)s.json.gz": {
+    "./data/waters_%(spider_name)s_%(batch_time)s.json.gz": {
+        "format": "jsonlines",
+        "encoding": "utf8",
+        "store_empty": False,
+        "item_export_kwargs": {
+            "export_empty_fields": True,
+        },
+        "item_classes": [BuoyDatapoint, BuoyDatapointV2, BuoyDatapointV3, RiverDatapoint, HtmlDatapoint,
+                         HtmlBlobDatapoint],
+        "postprocessing": ['scrapy.extensions.postprocessing.GzipPlugin'],
+    }
+}
+
+# Station history XMLs, by far the largest feed. With SLO_WEATHER_ARCHIVE_CODEC=zstd they are
+# written as .json.zst with a trained dictionary, see data_pipeline.archive_codec.
+if os.environ.get("SLO_WEATHER_ARCHIVE_CODEC") == "zstd":
+    FEEDS["./data/weather_data_%(batch_time)s.json.zst"] = {
         "format": "jsonlines",
         "encoding": "utf8",
         "store_empty": False,
@@ -113,16 +136,17 @@ FEEDS = {
             "export_empty_fields": True,
         },
         "item_classes": [WeatherStationArchiveXml],
-        "postprocessing": ['scrapy.extensions.postprocessing.GzipPlugin']
-    },
-    "./data/waters_%(spider_name)s_%(batch_time)s.json.gz": {
+        "postprocessing": ["scraper.postprocessing.ZstdPlugin"],
+        "zstd_dictionary_dir": "./data/zstd_dictionaries",
+    }
+else:
+    FEEDS["./data/weather_data_%(batch_time)s.json.gz"] = {
         "format": "jsonlines",
         "encoding": "utf8",
         "store_empty": False,
         "item_export_kwargs": {
             "export_empty_fields": True,
         },
-        "item_classes": [BuoyDatapoint, BuoyDatapointV2, BuoyDatapointV3, RiverDatapoint, HtmlDatapoint],
-        "postprocessing": ['scrapy.extensions.postprocessing.GzipPlugin'],
+        "item_classes": [WeatherStationArchiveXml],
+        "postprocessing": ['scrapy.extensions.postprocessing.GzipPlugin']
     }
-}
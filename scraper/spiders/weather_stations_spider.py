@@ -3,10 +3,27 @@ import scrapy
 from scraper.items import WeatherStation, Point, WeatherStationArchiveXml
 
 
+def history_url(meteosi_id: str) -> str:
+    return f"https://meteo.arso.gov.si/uploads/probase/www/observ/surface/text/sl/recent/observationAms_{meteosi_id}_history.xml"
+
+
 class WeatherStationsSpider(scrapy.Spider):
+    """Crawls all automatic stations and their history XMLs.
+
+    With -a stations=CODE1,CODE2 only history XMLs of the given stations are crawled
+    (see data_pipeline/coverage.py)."""
     name = "weather_stations"
 
+    def __init__(self, stations=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stations = [station for station in (stations or "").split(",") if station]
+
     def start_requests(self):
+        if self.stations:
+            for station in self.stations:
+                yield scrapy.Request(url=history_url(station), callback=self.parse_meteo_data)
+            return
+
         manned_stations_url = 'https://meteo.arso.gov.si/uploads/probase/www/observ/surface/text/sl/observation_si_latest.xml'
         automatic_stations_url = 'https://meteo.arso.gov.si/uploads/probase/www/observ/surface/text/sl/observationAms_si_latest.xml'
         urls = [
@@ -33,7 +50,7 @@ class WeatherStationsSpider(scrapy.Spider):
             )
             yield station
             yield scrapy.Request(
-                url=f"https://meteo.arso.gov.si/uploads/probase/www/observ/surface/text/sl/recent/observationAms_{station.meteosiId}_history.xml",
+                url=history_url(station.meteosiId),
                 callback=self.parse_meteo_data
             )
 
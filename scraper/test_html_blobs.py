@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from .html_blobs import html_sha256, list_html_blobs, load_html_blob, store_html_blob
+from .items import HtmlBlobDatapoint, HtmlDatapoint, RiverDatapoint
+from .pipelines import HtmlBlobPipeline
+from . import reparse_html_blobs
+from .reparse_html_blobs import load_reparsed, parse_html_blob
+
+
+class HtmlBlobsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.blobs_dir = self.tmp_dir.name
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_store_html_blob(self):
+        sha256 = store_html_blob(self.blobs_dir, "<html>Šentjakob</html>")
+        self.assertEqual(html_sha256("<html>Šentjakob</html>"), sha256)
+        self.assertEqual(sha256, store_html_blob(self.blobs_dir, "<html>Šentjakob</html>"))
+        self.assertEqual("<html>Šentjakob</html>", load_html_blob(self.blobs_dir, sha256))
+        self.assertEqual([sha256], list(list_html_blobs(self.blobs_dir)))
+
+    def test_list_html_blobs_missing_dir(self):
+        self.assertEqual([], list(list_html_blobs(os.path.join(self.blobs_dir, "missing"))))
+
+    def test_pipeline(self):
+        pipeline = HtmlBlobPipeline(self.blobs_dir)
+        item = pipeline.process_item(HtmlDatapoint(html="<html></html>"), None)
+        self.assertEqual(HtmlBlobDatapoint(html_sha256=html_sha256("<html></html>")), item)
+
+        river_datapoint = RiverDatapoint(
+            location="Location", timestamp=None, water_level=None, flow_rate=None, temperature=None
+        )
+        self.assertIs(river_datapoint, pipeline.process_item(river_datapoint, None))
+
+    def test_parse_html_blob(self):
+        html = (Path(__file__).parent / "examples" / "river_data.html").read_text()
+        datapoints = parse_html_blob(self.blobs_dir, store_html_blob(self.blobs_dir, html))
+        self.assertEqual(144, len(datapoints))
+        self.assertEqual("Postaja Šentjakob - Sava", datapoints[0].location)
+
+        unknown = store_html_blob(self.blobs_dir, "<html></html>")
+        self.assertEqual([], parse_html_blob(self.blobs_dir, unknown))
+
+    def test_reparse_only_new_pages(self):
+        output_dir = os.path.join(self.blobs_dir, "output")
+        os.makedirs(output_dir)
+        html = (Path(__file__).parent / "examples" / "river_data.html").read_text()
+        sha256 = store_html_blob(self.blobs_dir, html)
+        store_html_blob(self.blobs_dir, "<html></html>")
+
+        reparse_html_blobs.main(self.blobs_dir, output_dir)
+        self.assertEqual(1, len(os.listdir(output_dir)))
+        # Pages which can't be parsed aren't recorded.
+        self.assertEqual({sha256: reparse_html_blobs.PARSER_VERSION}, load_reparsed(self.blobs_dir))
+
+        reparse_html_blobs.main(self.blobs_dir, output_dir)
+        self.assertEqual(1, len(os.listdir(output_dir)))
+
+        with mock.patch.object(reparse_html_blobs, "PARSER_VERSION", reparse_html_blobs.PARSER_VERSION + 1):
+            reparse_html_blobs.main(self.blobs_dir, output_dir)
+        self.assertEqual(2, len(os.listdir(output_dir)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import urllib.error
+import urllib.request
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from scraper.benchmark_crawl import ReplayMiddleware
+from scraper.replay_server import METEO_DIR, WATERS_DIR, ReplayServer, build_routes
+
+
+class TestReplayServer(unittest.TestCase):
+    def test_build_routes(self):
+        routes = build_routes(3, 4)
+
+        content_type, latest = routes[f"{METEO_DIR}/observationAms_si_latest.xml"]
+        self.assertEqual("application/xml; charset=utf-8", content_type)
+        self.assertEqual(3, latest.count(b"<metData>"))
+        self.assertIn(b"<domain_meteosiId>SYN0002_</domain_meteosiId>", latest)
+        _, history = routes[f"{METEO_DIR}/recent/observationAms_SYN0001_history.xml"]
+        self.assertNotIn(b"GODNJE", history)
+
+        _, index = routes[f"{WATERS_DIR}/Ht_1.html"]
+        self.assertEqual(4, index.count(b"<area "))
+        # Gauge pages cycle through the examples.
+        self.assertEqual(routes[f"{WATERS_DIR}/replay_0000.html"], routes[f"{WATERS_DIR}/replay_0003.html"])
+
+    def test_serve(self):
+        with ReplayServer(1, 1) as server:
+            with urllib.request.urlopen(f"{server.base_url}{WATERS_DIR}/replay_0000.html") as response:
+                self.assertIn(b'class="podatki"', response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"{server.base_url}/missing.html")
+
+    def test_replay_middleware(self):
+        middleware = ReplayMiddleware("http://127.0.0.1:1234")
+        request = Request("https://www.arso.gov.si/vode/podatki/amp/Ht_1.html?x=1")
+
+        replayed = middleware.process_request(request, None)
+        self.assertEqual("http://127.0.0.1:1234/vode/podatki/amp/Ht_1.html?x=1", replayed.url)
+        self.assertIsNone(middleware.process_request(replayed, None))
+
+        response = HtmlResponse(replayed.url, body=b"<html></html>", request=replayed)
+        self.assertEqual(request.url, middleware.process_response(replayed, response, None).url)
+
+
+if __name__ == '__main__':
+    unittest.main()
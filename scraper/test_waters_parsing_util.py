@@ -1,10 +1,11 @@
+import dataclasses
 import datetime
 import unittest
 from pathlib import Path
 
 from scrapy import Selector
 
-from .items import RiverDatapoint, BuoyDatapoint, BuoyDatapointV2
+from .items import RiverDatapoint, BuoyDatapoint, BuoyDatapointV2, BuoyDatapointV3, HtmlDatapoint
 from .waters_parsing_util import (
     float_or_none,
     int_or_none,
@@ -15,6 +16,12 @@ from .waters_parsing_util import (
     parse_buoy_datapoint,
     is_buoy_data_table_v2,
     parse_buoy_datapoint_v2,
+    parse_buoy_datapoint_v3,
+    parse_page_with_table,
+    parse_page_with_table_per_row,
+    parse_local_datetime,
+    parse_local_datetimes,
+    LJUBLJANA,
 )
 
 
@@ -50,6 +57,42 @@ class ParsingUtilTestCase(unittest.TestCase):
             datetime.datetime(2023, 8, 13, 20, 50), parse_datetime("13.08.2023 20:50")
         )
 
+    def test_parse_local_datetime(self):
+        self.assertEqual(
+            datetime.datetime(2023, 8, 13, 18, 50, tzinfo=datetime.timezone.utc),
+            parse_local_datetime("13.08.2023 20:50"),
+        )
+        self.assertEqual(
+            datetime.datetime(2023, 12, 13, 19, 50, tzinfo=datetime.timezone.utc),
+            parse_local_datetime("13.12.2023 20:50"),
+        )
+
+    def test_parse_local_datetimes_dst_end(self):
+        column = [
+            "29.10.2023 03:00",
+            "29.10.2023 02:30",
+            "29.10.2023 02:00",
+            "29.10.2023 02:30",
+            "29.10.2023 02:00",
+            "29.10.2023 01:30",
+        ]
+        utc = datetime.timezone.utc
+        self.assertEqual(
+            [
+                datetime.datetime(2023, 10, 29, 2, 0, tzinfo=utc),
+                datetime.datetime(2023, 10, 29, 1, 30, tzinfo=utc),
+                datetime.datetime(2023, 10, 29, 1, 0, tzinfo=utc),
+                datetime.datetime(2023, 10, 29, 0, 30, tzinfo=utc),
+                datetime.datetime(2023, 10, 29, 0, 0, tzinfo=utc),
+                datetime.datetime(2023, 10, 28, 23, 30, tzinfo=utc),
+            ],
+            [dt.astimezone(utc) for dt in parse_local_datetimes(column)],
+        )
+        self.assertEqual(
+            [dt.astimezone(utc) for dt in reversed(parse_local_datetimes(column))],
+            [dt.astimezone(utc) for dt in parse_local_datetimes(list(reversed(column)))],
+        )
+
     def test_is_river_data_table(self):
         self.assertFalse(is_river_data_table(self.buoy_data.css("table.podatki")))
         self.assertTrue(is_river_data_table(self.river_data.css("table.podatki")))
@@ -123,6 +166,94 @@ class ParsingUtilTestCase(unittest.TestCase):
             ),
         )
 
+    def test_parse_page_with_table(self):
+        for html, selector in [
+            (self.river_data_html, self.river_data),
+            (self.buoy_data_html, self.buoy_data),
+            (self.buoy_data_v2_html, self.buoy_data_v2),
+        ]:
+            table = selector.css("table.podatki")
+            datapoints = parse_page_with_table(table, "Location", html)
+            for datapoint in datapoints:
+                self.assertEqual(LJUBLJANA, datapoint.timestamp.tzinfo)
+            self.assertEqual(
+                parse_page_with_table_per_row(table, "Location", html),
+                [
+                    dataclasses.replace(d, timestamp=d.timestamp.replace(tzinfo=None))
+                    for d in datapoints
+                ],
+            )
+
+    def test_parse_page_with_table_unknown_layout(self):
+        table = Selector(
+            text="<table class='podatki'><thead><tr><th>Datum</th></tr></thead></table>"
+        ).css("table.podatki")
+        self.assertEqual(
+            [HtmlDatapoint(html="raw")],
+            parse_page_with_table(table, "Location", "raw"),
+        )
+
+    def test_parse_page_with_table_missing_cell(self):
+        table = Selector(
+            text="""<table class='podatki'>
+            <thead><tr><th>Datum</th><th>Vodostaj [cm]</th><th>Temperatura vode [°C]</th></tr></thead>
+            <tbody>
+            <tr><td>13.08.2023 20:50</td><td>120</td></tr>
+            <tr><td>13.08.2023 20:40</td><td></td><td>14.2</td></tr>
+            </tbody>
+            </table>"""
+        ).css("table.podatki")
+        self.assertEqual(
+            [
+                BuoyDatapointV3(
+                    location="Location",
+                    timestamp=datetime.datetime(2023, 8, 13, 20, 50, tzinfo=LJUBLJANA),
+                    water_level=120,
+                    temperature=None,
+                ),
+                BuoyDatapointV3(
+                    location="Location",
+                    timestamp=datetime.datetime(2023, 8, 13, 20, 40, tzinfo=LJUBLJANA),
+                    water_level=None,
+                    temperature=14.2,
+                ),
+            ],
+            parse_page_with_table(table, "Location", "raw"),
+        )
+
+    def test_parse_page_with_table_cell_markup(self):
+        html = """<table class='podatki'>
+            <thead><tr><th>Datum</th><th>Vodostaj [cm]</th><th>Temperatura vode [°C]</th></tr></thead>
+            <tbody>
+            <tr><td>13.08.2023 20:50</td><td><b>120</b></td><td><span>14</span>.2</td></tr>
+            <tr><td>13.08.2023 20:40<br></td><td>121</td><td>14.1</td></tr>
+            </tbody>
+            </table>"""
+        table = Selector(text=html).css("table.podatki")
+        datapoints = parse_page_with_table(table, "Location", html)
+        self.assertEqual(
+            [
+                BuoyDatapointV3(
+                    location="Location",
+                    timestamp=datetime.datetime(2023, 8, 13, 20, 50, tzinfo=LJUBLJANA),
+                    water_level=120,
+                    temperature=14.2,
+                ),
+                BuoyDatapointV3(
+                    location="Location",
+                    timestamp=datetime.datetime(2023, 8, 13, 20, 40, tzinfo=LJUBLJANA),
+                    water_level=121,
+                    temperature=14.1,
+                ),
+            ],
+            datapoints,
+        )
+        # The row parsers only see text directly inside cells, which is all of the second row.
+        self.assertEqual(
+            parse_buoy_datapoint_v3("Location", table.css("tbody > tr")[1]),
+            dataclasses.replace(datapoints[1], timestamp=datapoints[1].timestamp.replace(tzinfo=None)),
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,5 +1,7 @@
 import datetime
+import functools
 from typing import Optional
+from zoneinfo import ZoneInfo
 
 from scrapy import Selector
 from scrapy.selector import SelectorList
@@ -12,6 +14,9 @@ from .items import (
     HtmlDatapoint,
 )
 
+LJUBLJANA = ZoneInfo("Europe/Ljubljana")
+"""Timezone of timestamps on ARSO waters pages."""
+
 
 def float_or_none(s: str) -> Optional[float]:
     try:
@@ -27,55 +32,102 @@ def int_or_none(s: str) -> Optional[float]:
         return None
 
 
+@functools.lru_cache(maxsize=8192)
 def parse_datetime(s: str) -> datetime.datetime:
-    return datetime.datetime.strptime(
-        s, "%d.%m.%Y %H:%M"
-    )  # Example: "13.08.2023 17:00"
+    """Parses local time, for example "13.08.2023 17:00", into a naive datetime."""
+    if len(s) == 16 and s[2] == "." and s[5] == "." and s[10] == " " and s[13] == ":":
+        return datetime.datetime(
+            int(s[6:10]), int(s[3:5]), int(s[0:2]), int(s[11:13]), int(s[14:16])
+        )
+    return datetime.datetime.strptime(s, "%d.%m.%Y %H:%M")
+
+
+@functools.lru_cache(maxsize=8192)
+def parse_local_datetime(s: str, fold: int = 0) -> datetime.datetime:
+    """Like parse_datetime, but in Europe/Ljubljana timezone.
+
+    fold=1 selects the second occurrence of the hour repeated when DST ends."""
+    return parse_datetime(s).replace(tzinfo=LJUBLJANA, fold=fold)
+
+
+def is_ambiguous_local_datetime(dt: datetime.datetime) -> bool:
+    return dt.utcoffset() != dt.replace(fold=1).utcoffset()
+
+
+def parse_local_datetimes(column: list[str]) -> list[datetime.datetime]:
+    """Parses a table column of local times.
+
+    When DST ends, the hour 02:00-03:00 appears twice in the table. Occurrences are
+    told apart by row order: the chronologically later one gets fold=1."""
+    timestamps = [parse_local_datetime(s) for s in column]
+
+    ambiguous = [i for i, dt in enumerate(timestamps) if is_ambiguous_local_datetime(dt)]
+    if ambiguous:
+        # Tables on ARSO pages list the newest rows first.
+        if timestamps[0] > timestamps[-1]:
+            ambiguous.reverse()
+        seen = set()
+        for i in ambiguous:
+            if column[i] in seen:
+                timestamps[i] = parse_local_datetime(column[i], 1)
+            else:
+                seen.add(column[i])
+
+    return timestamps
+
+
+RIVER_DATA_HEADERS = (
+    "Datum",
+    "Vodostaj [cm]",
+    "Pretok [m³/s]",
+    "Temperatura vode [°C]",
+)
+
+BUOY_DATA_HEADERS = (
+    "Datum",
+    "Temperatura vode [°C]",
+    "Višina valov [m]",
+    "Vrednost periode valov [s]",
+    "Smer valov [°]",
+    "Hitrost morskega toka [cm/s]",
+    "Smer morskega toka [°]",
+    "Maksimalna višina valov [m]",
+)
+
+BUOY_DATA_V2_HEADERS = (
+    "Datum",
+    "Temperatura vode [°C]",
+    "Smer morskega toka 2m pod gladino [°]",
+    "Hitrost morskega toka 2m pod glad. [cm/s]",
+    "Smer morskega toka 10m pod gladino [°]",
+    "Hitrost morskega toka 10m pod glad. [cm/s]",
+    "Značilna višina valov [m]",
+    "Maksimalna višina valov [m]",
+    "Smer valovanja [°]",
+    "Perioda valovanja [s]",
+)
+
+BUOY_DATA_V3_HEADERS = ("Datum", "Vodostaj [cm]", "Temperatura vode [°C]")
+
+
+def get_table_headers(e: SelectorList) -> tuple:
+    return tuple(e.css("thead > tr > th::text").getall())
 
 
 def is_river_data_table(e: SelectorList) -> bool:
-    headers = e.css("thead > tr > th::text").getall()
-    return headers == [
-        "Datum",
-        "Vodostaj [cm]",
-        "Pretok [m³/s]",
-        "Temperatura vode [°C]",
-    ]
+    return get_table_headers(e) == RIVER_DATA_HEADERS
 
 
 def is_buoy_data_table(e: SelectorList) -> bool:
-    headers = e.css("thead > tr > th::text").getall()
-    return headers == [
-        "Datum",
-        "Temperatura vode [°C]",
-        "Višina valov [m]",
-        "Vrednost periode valov [s]",
-        "Smer valov [°]",
-        "Hitrost morskega toka [cm/s]",
-        "Smer morskega toka [°]",
-        "Maksimalna višina valov [m]",
-    ]
+    return get_table_headers(e) == BUOY_DATA_HEADERS
 
 
 def is_buoy_data_table_v2(e: SelectorList) -> bool:
-    headers = e.css("thead > tr > th::text").getall()
-    return headers == [
-        "Datum",
-        "Temperatura vode [°C]",
-        "Smer morskega toka 2m pod gladino [°]",
-        "Hitrost morskega toka 2m pod glad. [cm/s]",
-        "Smer morskega toka 10m pod gladino [°]",
-        "Hitrost morskega toka 10m pod glad. [cm/s]",
-        "Značilna višina valov [m]",
-        "Maksimalna višina valov [m]",
-        "Smer valovanja [°]",
-        "Perioda valovanja [s]",
-    ]
+    return get_table_headers(e) == BUOY_DATA_V2_HEADERS
 
 
 def is_buoy_data_table_v3(e: SelectorList) -> bool:
-    headers = e.css("thead > tr > th::text").getall()
-    return headers == ["Datum", "Vodostaj [cm]", "Temperatura vode [°C]"]
+    return get_table_headers(e) == BUOY_DATA_V3_HEADERS
 
 
 def parse_river_datapoint(location: str, e: Selector) -> RiverDatapoint:
@@ -131,7 +183,189 @@ def parse_buoy_datapoint_v3(location: str, e: Selector) -> BuoyDatapointV3:
     )
 
 
+def _cell_text(td) -> str:
+    # td.text is only the text before the first child element, e.g. <b> or <br>.
+    return "".join(td.itertext())
+
+
+def get_table_cells(table: SelectorList, column_count: int) -> list[str]:
+    """Text of all body cells of the table, row by row, extracted in a single lxml pass.
+
+    Text of elements inside cells is included. Empty cells are returned as empty strings
+    and rows with missing cells are padded, so the list can always be sliced into columns."""
+    cells = [_cell_text(td) for t in table for td in t.root.xpath("tbody/tr/td")]
+    if len(cells) % column_count == 0:
+        return cells
+
+    cells = []
+    for t in table:
+        for tr in t.root.xpath("tbody/tr"):
+            row = [_cell_text(td) for td in tr.xpath("td")][:column_count]
+            cells.extend(row + [""] * (column_count - len(row)))
+    return cells
+
+
+def get_table_columns(cells: list[str], column_count: int) -> list[list[str]]:
+    return [cells[i::column_count] for i in range(column_count)]
+
+
+def parse_river_table(location: str, cells: list[str]) -> list[RiverDatapoint]:
+    timestamps, water_levels, flow_rates, temperatures = get_table_columns(cells, 4)
+    return [
+        RiverDatapoint(
+            location=location,
+            timestamp=timestamp,
+            water_level=water_level,
+            flow_rate=flow_rate,
+            temperature=temperature,
+        )
+        for timestamp, water_level, flow_rate, temperature in zip(
+            parse_local_datetimes(timestamps),
+            map(int_or_none, water_levels),
+            map(float_or_none, flow_rates),
+            map(float_or_none, temperatures),
+        )
+    ]
+
+
+def parse_buoy_table(location: str, cells: list[str]) -> list[BuoyDatapoint]:
+    (
+        timestamps,
+        temperatures,
+        waves_heights,
+        waves_periods,
+        waves_directions,
+        flow_rates,
+        flow_directions,
+        max_waves_heights,
+    ) = get_table_columns(cells, 8)
+    return [
+        BuoyDatapoint(
+            location=location,
+            timestamp=timestamp,
+            temperature=temperature,
+            waves_height=waves_height,
+            waves_period=waves_period,
+            waves_direction=waves_direction,
+            flow_rate=flow_rate,
+            flow_direction=flow_direction,
+            max_waves_height=max_waves_height,
+        )
+        for (
+            timestamp,
+            temperature,
+            waves_height,
+            waves_period,
+            waves_direction,
+            flow_rate,
+            flow_direction,
+            max_waves_height,
+        ) in zip(
+            parse_local_datetimes(timestamps),
+            map(float_or_none, temperatures),
+            map(float_or_none, waves_heights),
+            map(int_or_none, waves_periods),
+            map(int_or_none, waves_directions),
+            map(int_or_none, flow_rates),
+            map(int_or_none, flow_directions),
+            map(float_or_none, max_waves_heights),
+        )
+    ]
+
+
+def parse_buoy_table_v2(location: str, cells: list[str]) -> list[BuoyDatapointV2]:
+    (
+        timestamps,
+        temperatures,
+        flow_directions_depth_2m,
+        flow_rates_depth_2m,
+        flow_directions_depth_10m,
+        flow_rates_depth_10m,
+        waves_heights,
+        max_waves_heights,
+        waves_directions,
+        waves_periods,
+    ) = get_table_columns(cells, 10)
+    return [
+        BuoyDatapointV2(
+            location=location,
+            timestamp=timestamp,
+            temperature=temperature,
+            flow_direction_depth_2m=flow_direction_depth_2m,
+            flow_rate_depth_2m=flow_rate_depth_2m,
+            flow_direction_depth_10m=flow_direction_depth_10m,
+            flow_rate_depth_10m=flow_rate_depth_10m,
+            waves_height=waves_height,
+            max_waves_height=max_waves_height,
+            waves_direction=waves_direction,
+            waves_period=waves_period,
+        )
+        for (
+            timestamp,
+            temperature,
+            flow_direction_depth_2m,
+            flow_rate_depth_2m,
+            flow_direction_depth_10m,
+            flow_rate_depth_10m,
+            waves_height,
+            max_waves_height,
+            waves_direction,
+            waves_period,
+        ) in zip(
+            parse_local_datetimes(timestamps),
+            map(float_or_none, temperatures),
+            map(int_or_none, flow_directions_depth_2m),
+            map(int_or_none, flow_rates_depth_2m),
+            map(int_or_none, flow_directions_depth_10m),
+            map(int_or_none, flow_rates_depth_10m),
+            map(float_or_none, waves_heights),
+            map(float_or_none, max_waves_heights),
+            map(int_or_none, waves_directions),
+            map(int_or_none, waves_periods),
+        )
+    ]
+
+
+def parse_buoy_table_v3(location: str, cells: list[str]) -> list[BuoyDatapointV3]:
+    timestamps, water_levels, temperatures = get_table_columns(cells, 3)
+    return [
+        BuoyDatapointV3(
+            location=location,
+            timestamp=timestamp,
+            water_level=water_level,
+            temperature=temperature,
+        )
+        for timestamp, water_level, temperature in zip(
+            parse_local_datetimes(timestamps),
+            map(int_or_none, water_levels),
+            map(float_or_none, temperatures),
+        )
+    ]
+
+
+TABLE_PARSERS = {
+    RIVER_DATA_HEADERS: parse_river_table,
+    BUOY_DATA_HEADERS: parse_buoy_table,
+    BUOY_DATA_V2_HEADERS: parse_buoy_table_v2,
+    BUOY_DATA_V3_HEADERS: parse_buoy_table_v3,
+}
+"""Table parsers by the exact header row of the table."""
+
+PARSER_VERSION = 2
+"""Version of the table parsers, bump when parsing of a known layout changes. Stored pages
+parsed with an older version are parsed again by reparse_html_blobs."""
+
+
 def parse_page_with_table(table: SelectorList, location: str, raw_html) -> list:
+    headers = get_table_headers(table)
+    parser = TABLE_PARSERS.get(headers)
+    if parser is None:
+        return [HtmlDatapoint(html=raw_html)]
+
+    return parser(location, get_table_cells(table, len(headers)))
+
+
+def parse_page_with_table_per_row(table: SelectorList, location: str, raw_html) -> list:
     rows = table.css("tbody > tr")
 
     if is_river_data_table(table):